@@ -0,0 +1,192 @@
+# http_bench.py
+"""
+HTTP 服务压测：分别以开发模式 (Werkzeug) 和生产模式 (waitress) 启动服务，
+对 /upload（分块上传）、/download（本地文件下载）和 /api/status 施加并发负载，
+输出每种模式下各接口的 请求数/秒、p50 / p99 延迟和吞吐量。
+
+服务在子进程中运行，使用临时目录，不影响正式的上传 / 转换目录，也不会启动转换线程。
+
+用法（在 iw3web 目录下）:
+    python bench/http_bench.py                        # 两种模式都测
+    python bench/http_bench.py --mode production --concurrency 32 --duration 20
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import requests
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_server(mode, port, root, chunk_size):
+    """子进程入口：把上传 / 转换目录指向临时目录后启动服务"""
+    sys.path.insert(0, APP_DIR)
+    os.chdir(root)
+    from config import Config
+    Config.UPLOAD_FOLDER = os.path.join(root, 'uploads')
+    Config.CONVERTED_FOLDER = os.path.join(root, 'converted')
+    Config.UPLOAD_CHUNK_SIZE = chunk_size
+    Config.SERVER_MODE = mode
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(Config.CONVERTED_FOLDER, exist_ok=True)
+    import main
+    main.serve_http(host='127.0.0.1', port=port)
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def load(name, worker, concurrency, duration):
+    """并发执行 worker(session) 直到 duration 秒，worker 返回本次请求的字节数"""
+    latencies, errors, transferred = [], [0], [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def loop():
+        session = requests.Session()  # 每个线程一个连接池（keep-alive）
+        local_latencies, local_errors, local_bytes = [], 0, 0
+        while time.time() < deadline:
+            start = time.perf_counter()
+            try:
+                local_bytes += worker(session)
+                local_latencies.append(time.perf_counter() - start)
+            except Exception:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+            transferred[0] += local_bytes
+
+    threads = [threading.Thread(target=loop) for _ in range(concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    return {
+        'endpoint': name,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mb_per_s': round(transferred[0] / elapsed / 1024 / 1024, 1)
+    }
+
+
+def bench_mode(mode, args):
+    root = tempfile.mkdtemp(prefix=f'iw3bench_{mode}_')
+    os.makedirs(os.path.join(root, 'converted'))
+    download_name = 'bench.mp4'
+    with open(os.path.join(root, 'converted', download_name), 'wb') as f:
+        f.write(os.urandom(args.download_size))
+
+    port = args.port
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port),
+         '--root', root, '--chunk-size', str(args.chunk_size)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError(f"{mode} 模式服务未能启动")
+        base = f"http://127.0.0.1:{port}"
+        chunk = os.urandom(args.chunk_size)
+
+        def status(session):
+            r = session.get(f"{base}/api/status")
+            r.raise_for_status()
+            return len(r.content)
+
+        def download(session):
+            size = 0
+            with session.get(f"{base}/download/{download_name}", stream=True) as r:
+                r.raise_for_status()
+                for block in r.iter_content(1024 * 1024):
+                    size += len(block)
+            return size
+
+        # 每个线程一个上传会话，反复上传同一个块（重复块会覆盖写入，会话不会完成）
+        upload_sessions = threading.local()
+
+        def upload(session):
+            if not hasattr(upload_sessions, 'id'):
+                r = session.post(f"{base}/upload/init", json={'filename': 'bench.mp4', 'total_size': args.chunk_size * 2})
+                r.raise_for_status()
+                upload_sessions.id = r.json()['session_id']
+            r = session.post(f"{base}/upload", data={
+                'filename': 'bench.mp4',
+                'chunk_index': '0',
+                'total_chunks': '2',
+                'session_id': upload_sessions.id
+            }, files={'chunk': ('blob', chunk)})
+            r.raise_for_status()
+            return len(chunk)
+
+        results = []
+        for name, worker in (('/api/status', status), ('/download', download), ('/upload', upload)):
+            results.append(load(name, worker, args.concurrency, args.duration))
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+        # 等端口释放，下一个模式复用同一端口
+        time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IW3 Web GUI HTTP 压测')
+    parser.add_argument('--mode', choices=['development', 'production', 'both'], default='both')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=18000)
+    parser.add_argument('--chunk-size', type=int, default=1024 * 1024)
+    parser.add_argument('--download-size', type=int, default=32 * 1024 * 1024)
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--root', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        run_server(args.serve, args.port, args.root, args.chunk_size)
+        return
+
+    modes = ['development', 'production'] if args.mode == 'both' else [args.mode]
+    report = {}
+    for mode in modes:
+        print(f"=== {mode} 模式: 并发 {args.concurrency}，每个接口 {args.duration} 秒 ===", flush=True)
+        report[mode] = bench_mode(mode, args)
+        for row in report[mode]:
+            print(f"{row['endpoint']:<12} {row['rps']:>8} req/s  p50 {row['p50_ms']:>8} ms  "
+                  f"p99 {row['p99_ms']:>8} ms  {row['mb_per_s']:>7} MB/s  错误 {row['errors']}", flush=True)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+# pipeline_bench.py
+"""
+端到端流水线压测：用模拟转换器（bench/stub_iw3.py）代替 iw3，测量 Web GUI 自身的开销。
+
+服务在子进程中完整启动（恢复状态、扫描已转换文件、启动转换线程），使用临时目录，依次测量：
+    startup   预先放入 --converted 个已转换文件后的冷启动时间
+    upload    通过 /upload/init + /upload 上传 --tasks 个小文件（分块接收、合并、入队、写状态日志）
+    status    队列中有 --tasks 个任务时 /api/status 的吞吐和延迟（状态序列化）
+    direct    通过 /upload_direct 提交 --direct 个直链任务（本地文件服务器），直到全部进入队列
+    restart   重启服务，直到队列全部恢复（状态快照 + 日志重放）
+    convert   放开转换，--convert-duration 秒内完成的转换数和每个任务的额外开销（模拟转换耗时之外的部分）
+上传和直链阶段转换线程处于停止时间段（不出队），队列会一直增长到目标规模。
+
+结果可以保存为 JSON，作为基线与其他提交比较:
+    python bench/pipeline_bench.py --output baseline.json
+    python bench/pipeline_bench.py --compare baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, time as dt_time
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+from http_bench import percentile, wait_for_port, load
+
+START_CONVERSIONS_FLAG = 'start_conversions'
+
+
+def run_server(args):
+    """子进程入口：指向临时目录、使用模拟转换器，完整启动服务"""
+    sys.path.insert(0, APP_DIR)
+    os.chdir(args.root)
+    from config import Config
+    Config.UPLOAD_FOLDER = os.path.join(args.root, 'uploads')
+    Config.CONVERTED_FOLDER = os.path.join(args.root, 'converted')
+    Config.MAX_STORAGE_SIZE = 1024 ** 5
+    Config.MAX_CONCURRENT_CONVERSIONS = args.slots
+    Config.SERVER_MODE = args.server_mode
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(Config.CONVERTED_FOLDER, exist_ok=True)
+    Config.IW3_COMMAND = [sys.executable, os.path.join(BENCH_DIR, 'stub_iw3.py'),
+                          '--seconds', str(args.stub_seconds), '--bytes', str(args.stub_bytes),
+                          '--frames', str(args.stub_frames), '--startup-seconds', str(args.stub_startup)]
+    Config.BATCH_MAX_TASKS = args.batch
+    if args.warm:
+        Config.IW3_WORKER_COMMAND = Config.IW3_COMMAND + ['--worker']
+    # 用一整天的停止时间段挡住转换，直到压测进程创建 start_conversions 文件
+    Config.STOP_TIME_START = Config.STOP_TIME_END = None
+    if not os.path.exists(START_CONVERSIONS_FLAG):
+        Config.STOP_WINDOWS = [('daily', dt_time(0, 0), dt_time(0, 0))]
+
+        def release():
+            while not os.path.exists(START_CONVERSIONS_FLAG):
+                time.sleep(0.2)
+            Config.STOP_WINDOWS = []
+        threading.Thread(target=release, daemon=True).start()
+
+    import main
+    main.start_background_services()
+    main.serve_http(host='127.0.0.1', port=args.port)
+
+
+class Server:
+    def __init__(self, args):
+        self.args = args
+        self.process = None
+
+    def start(self):
+        """启动服务，返回到端口可用为止的秒数"""
+        started = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', '--root', self.args.root,
+             '--port', str(self.args.port), '--slots', str(self.args.slots),
+             '--server-mode', self.args.server_mode, '--stub-seconds', str(self.args.stub_seconds),
+             '--stub-bytes', str(self.args.stub_bytes), '--stub-frames', str(self.args.stub_frames),
+             '--stub-startup', str(self.args.stub_startup), '--batch', str(self.args.batch)]
+            + (['--warm'] if self.args.warm else []),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        if not wait_for_port(self.args.port, timeout=300):
+            raise RuntimeError("服务未能启动")
+        return time.perf_counter() - started
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+            time.sleep(1)  # 等端口释放
+
+
+def queue_length(base):
+    return len(requests.get(f"{base}/api/queue").json()['tasks'])
+
+
+def wait_until(predicate, timeout, interval=0.2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def run_fixed(count, worker, concurrency):
+    """并发执行 count 次 worker(session, index)，返回吞吐和延迟"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    counter = iter(range(count))
+
+    def loop():
+        session = requests.Session()
+        local_latencies, local_errors = [], 0
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            start = time.perf_counter()
+            try:
+                worker(session, index)
+                local_latencies.append(time.perf_counter() - start)
+            except Exception:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=loop) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'count': len(latencies),
+        'errors': errors[0],
+        'seconds': round(elapsed, 2),
+        'per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2)
+    }
+
+
+def seed_converted(folder, count, size):
+    os.makedirs(folder, exist_ok=True)
+    data = b'\0' * size
+    now = time.time()
+    for i in range(count):
+        path = os.path.join(folder, f"seed_{i:06d}.mp4")
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.utime(path, (now - count + i, now - count + i))
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_file_server(directory, port):
+    server = ThreadingHTTPServer(('127.0.0.1', port), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_bench(args):
+    args.root = tempfile.mkdtemp(prefix='iw3pipeline_')
+    base = f"http://127.0.0.1:{args.port}"
+    metrics = {}
+    seed_converted(os.path.join(args.root, 'converted'), args.converted, 1024)
+
+    server = Server(args)
+    try:
+        print(f"[startup] 预置 {args.converted} 个已转换文件，启动服务...", flush=True)
+        metrics['startup'] = {'seconds': round(server.start(), 2)}
+
+        payload = os.urandom(args.upload_bytes)
+
+        def upload(session, index):
+            name = f"bench_{index:06d}.mp4"
+            # 每个文件内容不同，避免转换阶段全部命中结果缓存
+            data = index.to_bytes(8, 'little') + payload[8:]
+            r = session.post(f"{base}/upload/init", json={'filename': name, 'total_size': len(data)})
+            r.raise_for_status()
+            r = session.post(f"{base}/upload", data={
+                'filename': name, 'chunk_index': '0', 'total_chunks': '1',
+                'session_id': r.json()['session_id']
+            }, files={'chunk': ('blob', data)})
+            r.raise_for_status()
+
+        print(f"[upload] 上传 {args.tasks} 个任务...", flush=True)
+        metrics['upload'] = run_fixed(args.tasks, upload, args.concurrency)
+
+        print(f"[status] 队列 {queue_length(base)} 个任务，压测 /api/status {args.status_duration} 秒...", flush=True)
+        response_bytes = len(requests.get(f"{base}/api/status").content)
+
+        def status(session):
+            r = session.get(f"{base}/api/status")
+            r.raise_for_status()
+            return len(r.content)
+
+        metrics['status'] = load('/api/status', status, args.concurrency, args.status_duration)
+        metrics['status']['response_bytes'] = response_bytes
+        del metrics['status']['endpoint']
+
+        if args.direct:
+            source_dir = os.path.join(args.root, 'direct_source')
+            os.makedirs(source_dir)
+            with open(os.path.join(source_dir, 'source.mp4'), 'wb') as f:
+                f.write(os.urandom(args.upload_bytes))
+            file_server = start_file_server(source_dir, args.port + 1)
+            expected = queue_length(base) + args.direct
+
+            def direct(session, index):
+                r = session.post(f"{base}/upload_direct", json={
+                    'url': f"http://127.0.0.1:{args.port + 1}/source.mp4?n={index}",
+                    'filename': f"direct_{index:06d}.mp4"
+                })
+                r.raise_for_status()
+
+            print(f"[direct] 提交 {args.direct} 个直链任务...", flush=True)
+            started = time.perf_counter()
+            metrics['direct'] = run_fixed(args.direct, direct, args.concurrency)
+            wait_until(lambda: queue_length(base) >= expected, timeout=600, interval=0.5)
+            metrics['direct']['ingest_seconds'] = round(time.perf_counter() - started, 2)
+            file_server.shutdown()
+
+        queued = queue_length(base)
+        print(f"[restart] 重启服务并恢复 {queued} 个排队任务...", flush=True)
+        server.stop()
+        started = time.perf_counter()
+        port_seconds = server.start()
+        wait_until(lambda: queue_length(base) >= queued, timeout=600, interval=0.2)
+        metrics['restart'] = {'port_seconds': round(port_seconds, 2),
+                              'queue_restored_seconds': round(time.perf_counter() - started, 2)}
+
+        print(f"[convert] 放开转换（{args.slots} 个槽位，模拟耗时 {args.stub_seconds} 秒），运行 {args.convert_duration} 秒...", flush=True)
+        before = len(requests.get(f"{base}/api/status").json()['converted_files'])
+        open(os.path.join(args.root, START_CONVERSIONS_FLAG), 'w').close()
+        time.sleep(args.convert_duration)
+        converted = len(requests.get(f"{base}/api/status").json()['converted_files']) - before
+        metrics['convert'] = {
+            'completed': converted,
+            'per_second': round(converted / args.convert_duration, 2),
+            # 每个槽位每个任务占用的时间中，模拟转换以外的部分（进程启动、入队出队、存储管理、状态写入）
+            'overhead_ms': round((args.slots * args.convert_duration / converted - args.stub_seconds) * 1000, 1)
+            if converted else None
+        }
+    finally:
+        server.stop()
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'params': {key: getattr(args, key) for key in (
+                'tasks', 'converted', 'direct', 'concurrency', 'slots', 'server_mode',
+                'upload_bytes', 'stub_seconds', 'stub_bytes', 'stub_startup', 'warm', 'batch', 'status_duration', 'convert_duration')}
+        },
+        'metrics': metrics
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def flatten(metrics):
+    return {f"{phase}.{key}": value for phase, values in metrics.items()
+            for key, value in values.items() if isinstance(value, (int, float))}
+
+
+def print_report(report, baseline=None):
+    current = flatten(report['metrics'])
+    previous = flatten(baseline['metrics']) if baseline else {}
+    if baseline:
+        print(f"基线: {baseline['meta'].get('commit')} ({baseline['meta'].get('time')})  "
+              f"当前: {report['meta'].get('commit')}")
+    for key, value in current.items():
+        line = f"{key:<32} {value:>12}"
+        if key in previous:
+            old = previous[key]
+            change = f"{(value - old) / old * 100:+.1f}%" if old else 'n/a'
+            line += f"   基线 {old:>12}  {change}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IW3 Web GUI 端到端流水线压测（模拟转换器）')
+    parser.add_argument('--tasks', type=int, default=10000, help='上传的任务数（队列规模）')
+    parser.add_argument('--converted', type=int, default=5000, help='预置的已转换文件数')
+    parser.add_argument('--direct', type=int, default=100, help='直链任务数')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--slots', type=int, default=2, help='转换槽位数')
+    parser.add_argument('--server-mode', choices=['development', 'production'], default='development')
+    parser.add_argument('--upload-bytes', type=int, default=64 * 1024, help='每个上传文件的大小')
+    parser.add_argument('--stub-seconds', type=float, default=0.0, help='模拟转换耗时')
+    parser.add_argument('--stub-bytes', type=int, default=64 * 1024, help='模拟转换输出大小')
+    parser.add_argument('--stub-frames', type=int, default=20, help='模拟转换输出的进度行数')
+    parser.add_argument('--stub-startup', type=float, default=1.0, help='模拟常驻进程启动（加载模型）耗时')
+    parser.add_argument('--warm', action='store_true', help='使用常驻 iw3 进程（IW3_WORKER_COMMAND）')
+    parser.add_argument('--batch', type=int, default=1, help='BATCH_MAX_TASKS（每批最多合并的任务数，1 表示不合并）')
+    parser.add_argument('--status-duration', type=float, default=10)
+    parser.add_argument('--convert-duration', type=float, default=20)
+    parser.add_argument('--port', type=int, default=18100)
+    parser.add_argument('--output', help='把结果保存为 JSON（作为基线）')
+    parser.add_argument('--compare', help='与之前保存的基线 JSON 比较')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--root', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        run_server(args)
+        return
+
+    report = run_bench(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
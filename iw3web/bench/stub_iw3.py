@@ -0,0 +1,108 @@
+# stub_iw3.py
+"""
+模拟 iw3 转换器，用于在没有 iw3 / GPU 的环境中测量 Web GUI 本身的开销。
+接受与 iw3-cli.bat 相同的 -i / -o / --yes 参数（其他参数忽略），
+按 --seconds 等待，期间输出 tqdm 风格的进度行，最后写出 --bytes 字节的输出文件。
+-i 为目录时（批量转换）与 iw3 一样逐个转换其中的文件，输出到 -o 目录，文件名为 <原文件名>_LRF_Full_SBS.mp4。
+
+在 config.py 中设置:
+    IW3_COMMAND = [sys.executable, 'bench/stub_iw3.py', '--seconds', '2', '--bytes', '1048576']
+
+--startup-seconds 模拟启动时导入 torch、加载模型的耗时：单次运行时每个文件都要付出，
+加 --worker 作为常驻进程运行（与 iw3_worker.py 协议相同）时只在启动时付出一次:
+    IW3_WORKER_COMMAND = [sys.executable, 'bench/stub_iw3.py', '--worker', '--startup-seconds', '5', '--seconds', '2']
+"""
+
+import os
+import sys
+import time
+import argparse
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='iw3 模拟转换器')
+    parser.add_argument('-i', dest='input')
+    parser.add_argument('-o', dest='output')
+    parser.add_argument('--yes', action='store_true')
+    parser.add_argument('--seconds', type=float, default=0.0, help='模拟转换耗时')
+    parser.add_argument('--bytes', type=int, default=1024, help='输出文件大小')
+    parser.add_argument('--frames', type=int, default=100, help='输出的进度行数（总帧数）')
+    parser.add_argument('--fail', action='store_true', help='模拟转换失败（返回码 1）')
+    parser.add_argument('--worker', action='store_true', help='作为常驻进程运行')
+    parser.add_argument('--startup-seconds', type=float, default=0.0, help='启动耗时（模拟导入 torch、加载模型）')
+    parser.add_argument('--crash-after', type=int, default=0, help='常驻进程处理这么多个任务后直接退出（模拟崩溃）')
+    return parser
+
+
+def main():
+    args, _ = create_parser().parse_known_args()
+    if args.worker:
+        return serve_worker(args)
+    if not args.input or not args.output:
+        print("缺少 -i / -o 参数", flush=True)
+        return 2
+    time.sleep(args.startup_seconds)
+    return convert(args)
+
+
+def serve_worker(worker_args):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from iw3_worker import serve
+    time.sleep(worker_args.startup_seconds)
+    defaults = [arg for arg in sys.argv[1:] if arg != '--worker']
+    jobs = [0]
+
+    def run_job(job_args):
+        jobs[0] += 1
+        if worker_args.crash_after and jobs[0] > worker_args.crash_after:
+            os._exit(3)
+        args, _ = create_parser().parse_known_args(defaults + list(job_args) + ['--startup-seconds', '0'])
+        return convert(args)
+
+    serve(run_job)
+    return 0
+
+
+def convert(args):
+    if os.path.isdir(args.input):
+        os.makedirs(args.output, exist_ok=True)
+        for name in sorted(os.listdir(args.input)):
+            output = os.path.join(args.output, os.path.splitext(name)[0] + '_LRF_Full_SBS.mp4')
+            returncode = convert_file(os.path.join(args.input, name), output, args)
+            if returncode:
+                return returncode
+        return 0
+    return convert_file(args.input, args.output, args)
+
+
+def convert_file(input_path, output_path, args):
+    if not os.path.isfile(input_path):
+        print(f"输入文件不存在: {input_path}", flush=True)
+        return 1
+
+    name = os.path.basename(input_path)
+    started = time.monotonic()
+    for frame in range(1, args.frames + 1):
+        if args.seconds:
+            time.sleep(args.seconds / args.frames)
+        elapsed = time.monotonic() - started
+        rate = frame / elapsed if elapsed else 0.0
+        remaining = (args.frames - frame) / rate if rate else 0
+        percent = frame * 100 // args.frames
+        print(f"{name}: {percent:3d}%|{'#' * (percent // 10):<10}| {frame}/{args.frames} "
+              f"[{int(elapsed) // 60:02d}:{int(elapsed) % 60:02d}<{int(remaining) // 60:02d}:{int(remaining) % 60:02d}, "
+              f"{rate:.2f}it/s]", flush=True)
+
+    if args.fail:
+        return 1
+    with open(output_path, 'wb') as f:
+        remaining = args.bytes
+        block = b'\0' * min(remaining, 1024 * 1024)
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
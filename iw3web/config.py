@@ -8,6 +8,16 @@ class Config:
     CONVERTED_FOLDER = r'C:\TOOL\nunif-windows\iw3web\converted'
     MAX_CONTENT_LENGTH = 1 * 1024 * 1024 * 1024  # 当前设置1GB单最大文件大小
     MAX_STORAGE_SIZE = 20 * 1024 * 1024 * 1024  # 当前设置20GB最大存储空间
+    STORAGE_RECONCILE_INTERVAL = 6 * 3600  # 存储索引全量校准间隔（秒），平时只做增量更新
+    UPLOAD_SESSION_TTL = 24 * 3600  # 未完成的分块上传超过该时间（秒）没有新分块则丢弃
+    # 网页分块上传：服务端下发的分块大小和浏览器同时上传的块数（高延迟链路可调大并发数）
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    UPLOAD_MAX_PARALLEL_CHUNKS = 4
+    # 直链下载（/upload_direct）：同时下载的任务数、每个任务的分段连接数、最小分段大小、失败重试次数
+    DIRECT_DOWNLOAD_MAX_JOBS = 2
+    DIRECT_DOWNLOAD_SEGMENTS = 4
+    DIRECT_DOWNLOAD_MIN_SEGMENT = 4 * 1024 * 1024
+    DIRECT_DOWNLOAD_RETRIES = 5
     # 是否启用 OneDrive 存储模式
     USE_ONEDRIVE_STORAGE = False  # 默认关闭，安全起见
 
@@ -25,14 +35,85 @@ class Config:
     # Microsoft Graph API 的基础 URL
     GRAPH_API_BASE_URL = 'https://graph.microsoft.com/v1.0' #这个不用改
 
+    # 文件夹路径 / 文件名 -> OneDrive ID 的缓存有效期（秒），遇到 404 或删除时会立即失效
+    ONEDRIVE_ID_CACHE_TTL = 600
+    # 下载链接缓存有效期（秒）：@microsoft.graph.downloadUrl 约 1 小时后失效，提前 10 分钟过期；共享链接长期有效
+    ONEDRIVE_DOWNLOAD_URL_TTL = 50 * 60
+    ONEDRIVE_SHARE_LINK_TTL = 24 * 3600
+
     # Token 存储路径 (用于持久化刷新Token)
     TOKEN_PATH = os.path.join(os.path.dirname(__file__), 'onedrive_token.json')
+    # 未完成的 OneDrive 分段上传会话（uploadUrl），重启后在过期前可以续传
+    ONEDRIVE_UPLOAD_SESSIONS_PATH = os.path.join(os.path.dirname(__file__), 'onedrive_upload_sessions.json')
+    ONEDRIVE_UPLOAD_CHUNK_SIZE = 10 * 1024 * 1024  # 分段上传块大小，必须是 320KiB 的整数倍
+    ONEDRIVE_UPLOAD_WORKERS = 2  # 同时上传到 OneDrive 的文件数（上传与转换互不阻塞）
+    ONEDRIVE_UPLOAD_MAX_BACKOFF = 600  # 上传失败重试的最长等待时间（秒）
     # 修改这里可以让这段时间不新开始任务（已经开始的任务仍会正常进行）
     STOP_TIME_START = dt_time(23, 0)   # 23:00
     STOP_TIME_END = dt_time(3, 0)      # 03:00 (次日)
+    # 多个每周停止时间段，填写后代替上面的 STOP_TIME_START / STOP_TIME_END。每项为 (星期, 开始, 结束)：
+    # 星期可以是 'daily' / 'weekdays' / 'weekends' / 'mon'~'sun' 或它们的列表，结束早于开始表示跨天，例如
+    # STOP_WINDOWS = [('weekdays', dt_time(23, 0), dt_time(7, 0)), (['sat', 'sun'], dt_time(14, 0), dt_time(18, 0))]
+    STOP_WINDOWS = []
+    # 停止时间段开始前，只启动预计能在（剩余时间 - 该余量）秒内完成的任务，其余任务留在队列中
+    STOP_WINDOW_MARGIN = 300
+    CONVERSION_TIME_RATIO = 2.0  # 预计转换耗时 = 视频时长 × 该系数（初始值，之后按实际转换耗时自动修正）
     MIN_SLEEP = 10 # 最小 sleep 时间（秒），防止误差
+    # 转换命令：None 时使用项目上级目录的 iw3-cli.bat；也可以填写命令列表（后面会追加 -i 输入 -o 输出 --yes 和额外参数），
+    # 例如压测时用模拟转换器 [sys.executable, 'bench/stub_iw3.py', '--seconds', '1']
+    IW3_COMMAND = None
+    # 常驻 iw3 进程（iw3_worker.py）：设置后每个转换槽位启动一个常驻进程，torch 和深度模型只加载一次，
+    # 任务通过标准输入 / 输出发送，不再每个文件启动 iw3-cli.bat。例如
+    # IW3_WORKER_COMMAND = [r'C:\TOOL\nunif-windows\python\python.exe', r'C:\TOOL\nunif-windows\iw3web\iw3_worker.py']
+    # IW3_WORKER_CWD = r'C:\TOOL\nunif-windows\nunif'
+    IW3_WORKER_COMMAND = None
+    IW3_WORKER_CWD = None
+    IW3_WORKER_MAX_JOBS = 50  # 每处理这么多任务重启一次常驻进程（0 表示不重启）
+    IW3_WORKER_STARTUP_TIMEOUT = 300  # 等待常驻进程启动（加载模型）的最长时间（秒）
+    IW3_WORKER_PING_INTERVAL = 60  # 空闲超过该时间（秒）后，下一个任务前先做健康检查
+    IW3_WORKER_PING_TIMEOUT = 10
+    # 暂停 / 恢复转换的方式：'auto'（Windows 用 pssuspend，其他系统用 posix）、
+    # 'pssuspend'（需要 pssuspend.exe）、'psutil'（逐个进程暂停，不需要外部程序）、'posix'（向进程组发送 SIGSTOP / SIGCONT）
+    PROCESS_CONTROL_BACKEND = 'auto'
+    # 同时运行的转换任务数（每个任务一个 iw3 进程，显存/CPU 充足时可以调大）
+    MAX_CONCURRENT_CONVERSIONS = 1
+    # 转换队列调度：'fifo' 按加入顺序；'sjf' 预计时长短的视频优先（排队越久越靠前，长视频不会一直被插队）
+    SCHEDULER_POLICY = 'fifo'
+    SCHEDULER_PRIORITY_STEP = 1800  # 优先级每高 1 级，相当于提前多少秒加入队列
+    SCHEDULER_SJF_WEIGHT = 1.0  # sjf 模式下视频每长 1 秒，相当于晚多少秒加入队列
+    SCHEDULER_BYTES_PER_SECOND = 1024 * 1024  # 读不到视频时长时，按该码率（字节/秒）由文件大小估算时长
+    # 批量转换：队首是小文件时，从队首附近再取参数相同的小文件，以暂存目录为输入一次调用 iw3，省掉每个文件的模型加载
+    BATCH_MAX_TASKS = 1  # 每批最多几个任务（1 表示不合并）
+    BATCH_MAX_FILE_SIZE = 200 * 1024 * 1024  # 只合并不超过该大小的文件
+    BATCH_SCAN_DEPTH = 50  # 在队首多少个任务中查找可合并的任务
+    FFPROBE_PATH = 'ffprobe'  # 用于读取视频时长
+    TASK_HISTORY_LIMIT = 500  # 任务表中保留的已结束任务数（/api/tasks 可查询其状态和各阶段时间）
+    QUEUE_DISPLAY_LIMIT = 200  # 页面上显示 / 推送的队首任务数（完整队列通过 /api/queue 获取）
+    # 资源准入控制：上传、直链下载和开始转换前检查磁盘 / 内存 / CPU，不足时返回 507 / 429 并带 Retry-After
+    RESOURCE_MIN_FREE_DISK = 2 * 1024 * 1024 * 1024  # 每个目录所在磁盘至少保留的剩余空间
+    RESOURCE_MAX_MEMORY_PERCENT = 95  # 内存占用超过该百分比时拒绝（None 表示不限制）
+    RESOURCE_MAX_CPU_PERCENT = None  # CPU 占用超过该百分比时推迟开始新转换（None 表示不限制）
+    RESOURCE_OUTPUT_SIZE_RATIO = 2.0  # 开始转换前按 输入大小 × 该系数 预留输出空间
+    RESOURCE_RETRY_AFTER = 30  # 拒绝时建议客户端等待的秒数
+    RESOURCE_SAMPLE_INTERVAL = 1  # 内存 / CPU 采样间隔（秒）
+    # iw3 进度：推送到前端的最短间隔、进度行写入日志的最短间隔（秒）
+    PROGRESS_PUBLISH_INTERVAL = 1
+    PROGRESS_LOG_INTERVAL = 30
+    # 状态日志累计多少条记录后压缩成新的 conversion_state.json 快照
+    STATE_COMPACT_EVERY = 1000
+    # 日志：app.log 超过 LOG_MAX_BYTES 时轮转，保留 LOG_BACKUP_COUNT 个旧文件；内存中保留最近 LOG_RING_SIZE 条供 /api/logs 查询
+    LOG_FILE = 'app.log'
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT = 3
+    LOG_RING_SIZE = 10000
     # 网页端口
     FLASK_PORT = 8000  
+    # HTTP 服务模式：'development' 使用 Flask 自带服务器；'production' 使用 waitress（需 pip install waitress）
+    SERVER_MODE = 'development'
+    SERVER_THREADS = 16  # 生产模式工作线程数（SSE 长连接也占用线程）
+    SERVER_CONNECTION_LIMIT = 200  # 生产模式最大同时连接数
+    SERVER_CHANNEL_TIMEOUT = 120  # 生产模式空闲连接超时（秒）
+    SSE_MAX_CONNECTIONS = None  # 生产模式同时打开的状态推送连接上限，超过时页面改为轮询；None 表示 SERVER_THREADS - 4（留线程处理普通请求）；开发模式不限制
 
 # 确保目录存在
 os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
@@ -0,0 +1,134 @@
+# conversion_slots.py
+
+import threading
+from config import Config
+
+
+class ConversionSlot:
+    """一个转换槽位，同一时间最多运行一个 iw3 进程"""
+
+    def __init__(self, slot_id):
+        self.slot_id = slot_id
+        self.pid = None
+        self.processing = False
+        self.status = '空闲'
+        # 当前任务元数据（用于暂停/终止时定位进程和清理文件）
+        self.input_path = None
+        self.original_filename = None
+        self.stored_filename = None
+        self.additional_args = ''
+        self.terminated = False
+        self.finishing = False  # 转换已结束、正在更新任务状态（服务关闭时不再放回队列）
+        self.progress = None  # iw3 输出解析出的进度（帧数 / FPS / 剩余时间）
+        self.task = None  # 完整的队列任务（中断时原样放回队列，保留优先级等字段）
+        self.batch = []  # 批量转换时与 task 一起转换的其他任务
+
+    def assign(self, task, batch=()):
+        self.processing = True
+        self.status = '正在转换'
+        self.pid = None
+        self.terminated = False
+        self.finishing = False
+        self.progress = None
+        self.task = task
+        self.batch = list(batch)
+        self.input_path = task['input_path']
+        self.original_filename = task['original_filename']
+        self.stored_filename = task.get('stored_filename')
+        self.additional_args = task.get('additional_args', '')
+
+    def release(self, status):
+        self.processing = False
+        self.finishing = False
+        self.status = status
+        self.pid = None
+        self.progress = None
+        self.task = None
+        self.batch = []
+        self.input_path = None
+        self.original_filename = None
+        self.stored_filename = None
+        self.additional_args = ''
+
+    def tasks(self):
+        """槽位中正在处理的所有任务（单个任务或一批）"""
+        return ([self.task] if self.task else []) + self.batch
+
+    def to_task(self):
+        """把槽位中正在处理的任务还原成队列任务"""
+        task = dict(self.task or {})
+        task.update({
+            'input_path': self.input_path,
+            'original_filename': self.original_filename,
+            'stored_filename': self.stored_filename or self.original_filename,
+            'additional_args': self.additional_args
+        })
+        return task
+
+    def to_dict(self):
+        return {
+            'slot_id': self.slot_id,
+            'processing': self.processing,
+            'status': self.status,
+            'current_file': self.original_filename,
+            'task_id': self.task.get('task_id') if self.task else None,
+            'batch': [task['original_filename'] for task in self.batch],
+            'pid': self.pid,
+            'progress': self.progress
+        }
+
+
+class SlotPool:
+    """固定数量的转换槽位，替代原来全局唯一的 PID / 任务元数据"""
+
+    def __init__(self, size):
+        self.lock = threading.RLock()
+        self.slots = [ConversionSlot(i) for i in range(max(1, int(size)))]
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get(self, slot_id):
+        try:
+            slot_id = int(slot_id)
+        except (TypeError, ValueError):
+            return None
+        if 0 <= slot_id < len(self.slots):
+            return self.slots[slot_id]
+        return None
+
+    def find_by_file(self, original_filename):
+        """按文件名查找正在处理该文件的槽位"""
+        with self.lock:
+            for slot in self.slots:
+                if slot.processing and any(task['original_filename'] == original_filename for task in slot.tasks()):
+                    return slot
+        return None
+
+    def find_by_task(self, task_id):
+        with self.lock:
+            for slot in self.slots:
+                if slot.processing and any(task.get('task_id') == task_id for task in slot.tasks()):
+                    return slot
+        return None
+
+    def active_slots(self):
+        with self.lock:
+            return [slot for slot in self.slots if slot.processing]
+
+    def set_pid(self, slot, pid):
+        with self.lock:
+            slot.pid = pid
+
+    def clear_pid(self, slot, pid):
+        with self.lock:
+            if slot.pid == pid:
+                slot.pid = None
+
+    def snapshot(self):
+        with self.lock:
+            return [slot.to_dict() for slot in self.slots]
+
+
+# 全局实例
+slot_pool = SlotPool(Config.MAX_CONCURRENT_CONVERSIONS)
@@ -1,266 +1,378 @@
 import subprocess
 import os
+import uuid
+import shutil
 import threading
 from config import Config
 import time # 用于时间戳
-import random
 from onedrive_client import one_drive_client # 导入新客户端
-from datetime import datetime, time as dt_time, timedelta
-import main
+from conversion_slots import slot_pool
+from log_sink import log_context, current_log_context
+from storage_index import storage_index
+from upload_stage import upload_stage
+from progress_parser import ProgressParser
+from status_events import status_events
+from process_control import process_control
+from warm_workers import warm_workers, WarmWorkerError
+from metrics import conversion_seconds, manage_storage_seconds, storage_evictions, storage_evicted_bytes
+from datetime import datetime
 # 创建线程锁，保护共享资源（文件系统 + 存储管理）
 storage_lock = threading.RLock()  # 使用 RLock 允许同一线程重入
-def get_seconds_until_resume():
+# 存储管理删除旧文件后的回调（参数为文件名），main 注册后用于同步 converted_files
+eviction_callbacks = []
+
+def _notify_evicted(filename):
+    for callback in eviction_callbacks:
+        try:
+            callback(filename)
+        except Exception as e:
+            print(f"[存储管理] 删除回调失败 {filename}: {e}")
+def _publish_progress(slot, progress):
+    """记录槽位进度并推送给前端（ProgressParser 已做限频）"""
+    if slot is None:
+        return
+    with slot_pool.lock:
+        if not slot.processing:
+            return
+        slot.progress = progress
+    status_events.publish({'type': 'progress', 'slot_id': slot.slot_id, 'progress': progress})
+
+def _output_handler(slot, task):
     """
-    如果当前在暂停时间段内，返回距离恢复运行时间还需多少秒。
-    如果不在暂停时间段，返回 0。
+    处理 iw3 输出的一行（日志带上任务名，来源标记为 iw3）。
+    tqdm 进度行（\r 刷新，文本模式下每次刷新都是一行）只解析进度，每 PROGRESS_LOG_INTERVAL 秒才写一次日志
     """
-    now = datetime.now().time()
-    start = Config.STOP_TIME_START
-    end = Config.STOP_TIME_END
-
-    if start < end:
-        # 同一天内暂停（如 02:00 ~ 05:00）
-        if start <= now < end:
-            # 计算今天 end 时间距离 now 的秒数
-            resume_dt = datetime.combine(datetime.today(), end)
-            now_dt = datetime.now()
-            delta = (resume_dt - now_dt).total_seconds()
-            return max(Config.MIN_SLEEP, delta)  # 至少 sleep MIN_SLEEP 秒
-        else:
-            return 0
-    else:
-        # 跨天暂停（如 23:00 ~ 05:00）
-        now_dt = datetime.now()
-        if now >= start or now < end:
-            # 当前在暂停期
-            if now >= start:
-                # 今天 23:00 之后，恢复时间是明天 05:00
-                resume_dt = datetime.combine(datetime.today() + timedelta(days=1), end)
-            else:
-                # 凌晨 00:00 ~ 05:00，恢复时间就是今天 05:00
-                resume_dt = datetime.combine(datetime.today(), end)
-            delta = (resume_dt - now_dt).total_seconds()
-            return max(Config.MIN_SLEEP, delta)
-        else:
-            return 0
-def convert_file(input_path, output_path, additional_args=""):
-    """使用指定脚本转换单个文件（线程安全）"""
-    try:
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    parser = ProgressParser(on_update=lambda progress: _publish_progress(slot, progress),
+                            interval=Config.PROGRESS_PUBLISH_INTERVAL)
+    last_logged = [0]
 
+    def handle(line):
+        line = line.strip()
+        if parser.feed(line):
+            now = time.monotonic()
+            if now - last_logged[0] < Config.PROGRESS_LOG_INTERVAL:
+                return
+            last_logged[0] = now
+        with log_context(task=task, source='iw3'):
+            print(line)
+    return handle
+
+def _run_process(args, slot):
+    """每个任务启动一次 iw3（iw3-cli.bat 或 IW3_COMMAND），返回退出码"""
+    if Config.IW3_COMMAND:
+        # 自定义转换命令（例如 bench/stub_iw3.py 模拟转换器），在当前工作目录运行
+        cmd, cwd = list(Config.IW3_COMMAND), None
+    else:
         cli_script = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'iw3-cli.bat'))
         if not os.path.isfile(cli_script):
-            return False, f"转换脚本不存在: {cli_script}"
+            raise FileNotFoundError(f"转换脚本不存在: {cli_script}")
+        cmd, cwd = [cli_script], os.path.dirname(cli_script)
+    cmd += args
 
-        cmd = [cli_script, '-i', input_path, '-o', output_path, "--yes"]
-        if additional_args:
-            cmd.extend(additional_args.split())
-
-        # ✅ === 时间暂停逻辑 ===
-        print(f"[时间检查] 检查是否在停止时间段 {Config.STOP_TIME_START} ~ {Config.STOP_TIME_END}")
-        while True:
-            wait_seconds = get_seconds_until_resume()  # 确保这个函数已定义
-            if wait_seconds <= 0:
-                break
-            wait_timedelta = timedelta(seconds=wait_seconds)
-            print(f"[等待中] 当前处于停止时间段，还需等待 {str(wait_timedelta)} 后恢复...")
-            try:
-                time.sleep(wait_seconds)
-            except KeyboardInterrupt:
-                print("\n\n⚠️ 用户中断等待，强制退出转换任务")
-                return False, "用户中断等待"
-        print("[时间检查] 当前时间已允许执行转换任务")
-
-        print(f"[转换] 执行命令: {' '.join(cmd)}")
-
-        # ✅ 修改：使用 PIPE 但通过异步线程读取，防止阻塞
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,      # ❌ 不能用 DEVNULL（否则无法读取）
-            stderr=subprocess.STDOUT,    # 合并 stderr 到 stdout
-            stdin=subprocess.DEVNULL,
-            text=True,
-            cwd=os.path.dirname(cli_script),
-            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP,
-            bufsize=1  # 行缓冲
-        )
-
-        # ✅ 异步读取输出的函数
-        def _forward_output(pipe):
-            try:
-                for line in iter(pipe.readline, ''):
-                    print(line.strip())
-                pipe.close()
-            except (OSError, ValueError):
-                pass  # 进程结束或管道关闭
+    print(f"[转换] 执行命令: {' '.join(cmd)}")
 
-        # ✅ 开启单独线程实时输出日志
-        output_thread = threading.Thread(target=_forward_output, args=(process.stdout,), daemon=True)
-        output_thread.start()
+    # ✅ 修改：使用 PIPE 但通过异步线程读取，防止阻塞
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,      # ❌ 不能用 DEVNULL（否则无法读取）
+        stderr=subprocess.STDOUT,    # 合并 stderr 到 stdout
+        stdin=subprocess.DEVNULL,
+        text=True,
+        cwd=cwd,
+        bufsize=1,  # 行缓冲
+        **process_control.popen_kwargs()  # 独立的进程组，便于整体暂停 / 恢复
+    )
 
-        # ✅ 记录 PID
-        with main.conversion_pid_lock:
-            main.current_conversion_pid = process.pid
-            print(f"[转换] 已启动进程，PID: {process.pid}")
+    # ✅ 异步读取输出的函数
+    def _forward_output(pipe, handle):
+        try:
+            for line in iter(pipe.readline, ''):
+                handle(line)
+            pipe.close()
+        except (OSError, ValueError):
+            pass  # 进程结束或管道关闭
+
+    # ✅ 开启单独线程实时输出日志
+    task_name, _ = current_log_context()
+    output_thread = threading.Thread(target=_forward_output, args=(process.stdout, _output_handler(slot, task_name)),
+                                     daemon=True)
+    output_thread.start()
+
+    try:
+        # ✅ 记录 PID 到所属槽位
+        if slot is not None:
+            slot_pool.set_pid(slot, process.pid)
+        print(f"[转换] 已启动进程，PID: {process.pid}")
 
         # ✅ 等待进程结束（无需再 readline，已由线程处理）
+        started = time.perf_counter()
         process.wait()
+        conversion_seconds.labels('ok' if process.returncode == 0 else 'failed').observe(time.perf_counter() - started)
+    finally:
+        # ✅ 转换结束（或出错）后清除 PID
+        if slot is not None:
+            slot_pool.clear_pid(slot, process.pid)
+    return process.returncode
 
-        # ✅ 转换结束后清除 PID
-        with main.conversion_pid_lock:
-            if main.current_conversion_pid == process.pid:
-                main.current_conversion_pid = None
+def _run_warm_worker(args, slot):
+    """把任务交给槽位的常驻 iw3 进程，返回退出码"""
+    worker = warm_workers.get(slot.slot_id if slot is not None else 0)
+    task_name, _ = current_log_context()
 
-        if process.returncode != 0:
-            error_msg = f"[转换失败] 文件: {input_path}, 错误码: {process.returncode}"
+    def on_start(pid):
+        if slot is not None:
+            slot_pool.set_pid(slot, pid)
+        print(f"[转换] 已交给常驻进程，PID: {pid}")
+
+    started = time.perf_counter()
+    try:
+        returncode, error = worker.run(args, _output_handler(slot, task_name), on_start)
+    finally:
+        if slot is not None and worker.pid is not None:
+            slot_pool.clear_pid(slot, worker.pid)
+    conversion_seconds.labels('ok' if returncode == 0 else 'failed').observe(time.perf_counter() - started)
+    if error:
+        print(f"[转换] 常驻进程返回错误: {error}")
+    return returncode
+
+def _run_iw3(args, slot):
+    """运行一次 iw3（常驻进程或单次进程），返回退出码；常驻进程无法启动时抛出 WarmWorkerError"""
+    if Config.IW3_WORKER_COMMAND:
+        # 常驻 iw3 进程：模型已加载，只发送参数
+        print(f"[转换] 常驻进程参数: {' '.join(args)}")
+        return _run_warm_worker(args, slot)
+    return _run_process(args, slot)
+
+def _store_output(input_path, output_path):
+    """转换成功后删除源文件，并根据配置把输出交给上传阶段或登记到本地存储索引"""
+    filename = os.path.basename(output_path)
+
+    if Config.USE_ONEDRIVE_STORAGE and one_drive_client:
+        with storage_lock:
+            if os.path.isfile(input_path):
+                try:
+                    os.remove(input_path)
+                    print(f"[删除源文件] {input_path}")
+                except Exception as e:
+                    print(f"[警告] 删除源文件失败 {input_path}: {e}")
+
+        # === 交给上传阶段（独立线程池上传、失败自动重试），转换线程立即处理下一个任务 ===
+        upload_stage.submit(output_path, filename)
+    else:
+        # 本地存储模式
+        with storage_lock:
+            if os.path.isfile(input_path):
+                try:
+                    os.remove(input_path)
+                    print(f"[删除源文件] {input_path}")
+                except Exception as e:
+                    print(f"[警告] 删除源文件失败 {input_path}: {e}")
+            try:
+                storage_index.add(filename, os.path.getsize(output_path), os.path.getmtime(output_path))
+            except OSError as e:
+                print(f"[存储索引] 读取文件信息失败 {output_path}: {e}")
+
+def convert_file(input_path, output_path, additional_args="", slot=None):
+    """使用指定脚本转换单个文件（线程安全），slot 为执行该任务的转换槽位"""
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        args = ['-i', input_path, '-o', output_path, "--yes"]
+        if additional_args:
+            args.extend(additional_args.split())
+
+        try:
+            returncode = _run_iw3(args, slot)
+        except WarmWorkerError as e:
+            error_msg = f"[转换失败] {e}"
+            print(error_msg)
+            return False, error_msg
+
+        if returncode != 0:
+            error_msg = f"[转换失败] 文件: {input_path}, 错误码: {returncode}"
             print(error_msg)
             return False, error_msg
         if os.path.isfile(output_path):
             # ✅ 转换成功后，根据配置决定存储位置
-            filename = os.path.basename(output_path)
-            
-            if Config.USE_ONEDRIVE_STORAGE and one_drive_client:
-                with storage_lock:
-                    if os.path.isfile(input_path):
-                        try:
-                            os.remove(input_path)
-                            print(f"[删除源文件] {input_path}")
-                        except Exception as e:
-                            print(f"[警告] 删除源文件失败 {input_path}: {e}")
-
-                # === 上传到 OneDrive（无限重试） ===
-                base_delay = 2
-                max_wait = 600
-                attempt = 1
-                while True:
-                    print(f"[上传] 尝试 {attempt}: {filename}")
-                    try:
-                        success, msg = one_drive_client.upload_file(output_path, filename)
-                        if success:
-                            print(f"[上传成功] {filename}")
-                            break
-                        else:
-                            print(f"[上传失败] 第{attempt}次尝试失败: {msg}")
-                    except Exception as e:
-                        print(f"[上传异常] 第{attempt}次尝试发生异常: {str(e)}")
-
-                    wait_time = base_delay * (2 ** (attempt - 1))
-                    wait_time = min(wait_time + random.uniform(0, 1), max_wait)
-
-                    print(f"等待 {wait_time:.2f} 秒后重试... (按 Ctrl+C 可中断)")
-                    try:
-                        time.sleep(wait_time)
-                    except KeyboardInterrupt:
-                        print(f"\n\n⚠️ 用户手动中断上传流程: {filename}")
-                        return False, "用户中断上传"
-
-                    attempt += 1
-
-                # 上传成功后删除本地文件
-                with storage_lock:
-                    if os.path.isfile(output_path):
-                        try:
-                            os.remove(output_path)
-                            print(f"[删除本地转换文件] {output_path}")
-                        except Exception as e:
-                            print(f"[警告] 删除本地转换文件失败 {output_path}: {e}")
-            else:
-                # 本地存储模式
-                with storage_lock:
-                    if os.path.isfile(input_path):
-                        try:
-                            os.remove(input_path)
-                            print(f"[删除源文件] {input_path}")
-                        except Exception as e:
-                            print(f"[警告] 删除源文件失败 {input_path}: {e}")
-                manage_storage()
-
+            _store_output(input_path, output_path)
             return True, "转换成功"
         else:
             return False, f"[转换失败] 文件: {input_path}"
 
 
     except Exception as e:
-        # ✅ 出错时清理 PID
-        try:
-            with main.conversion_pid_lock:
-                if 'process' in locals() and main.current_conversion_pid == process.pid:
-                    main.current_conversion_pid = None
-        except:
-            pass
         error_msg = f"[转换异常] {str(e)}"
         print(error_msg)
         return False, error_msg
 
-def manage_storage():
+def _stage_input(input_path, staged_path):
+    """把输入文件放进暂存目录：优先硬链接（不占空间，原文件留在原处，中断后队列仍能恢复），不支持时复制"""
+    try:
+        os.link(input_path, staged_path)
+    except OSError:
+        shutil.copyfile(input_path, staged_path)
+
+def convert_batch(items, additional_args="", slot=None, output_path_for=None):
     """
-    管理存储空间，当超过20GB时删除最旧的已转换文件
-    此函数是线程安全的，使用 storage_lock 保护
+    一次 iw3 调用转换多个参数相同的文件，结果按任务分别返回。
+    输入按序号重新命名（0000.mp4、0001.mkv ...）放进 UPLOAD_FOLDER 下的暂存目录，iw3 以该目录为输入、
+    输出到 CONVERTED_FOLDER 下的暂存目录。iw3 的输出文件名为 <输入文件名>_<参数相关的后缀>.<格式>，
+    按第一个 "_" 之前的部分精确对应回序号和任务，移动到各任务的输出路径，再逐个删除源文件 / 上传 / 登记存储索引。
+    输出保留 iw3 实际使用的扩展名（容器格式由 iw3 决定，可能与源文件不同）。
+    iw3 中途失败或被终止时，已经生成输出的任务仍算成功，但最后写入的那个输出可能不完整，丢弃。
+    :param items: [(task_id, input_path, output_path)]
+    :param output_path_for: (task_id, 扩展名) -> 输出路径，扩展名与 output_path 不同时调用（main 用它重新分配不冲突的文件名）
+    :return: {task_id: (success, message, 实际输出路径)}
     """
-    with storage_lock:
+    batch_id = uuid.uuid4().hex[:8]
+    input_dir = os.path.join(Config.UPLOAD_FOLDER, f"_batch_{batch_id}")
+    output_dir = os.path.join(Config.CONVERTED_FOLDER, f"_batch_{batch_id}")
+    staged = {f"{index:04d}": item for index, item in enumerate(items)}  # 暂存文件名（不含扩展名）-> 任务
+    results = {}
+    try:
+        os.makedirs(input_dir)
+        os.makedirs(output_dir)
+        for stem, (_, input_path, _) in staged.items():
+            _stage_input(input_path, os.path.join(input_dir, stem + os.path.splitext(input_path)[1]))
+
+        args = ['-i', input_dir, '-o', output_dir, "--yes"]
+        if additional_args:
+            args.extend(additional_args.split())
+        print(f"[批量转换] {len(items)} 个文件，暂存目录: {input_dir}")
         try:
-            total_size = 0
-            files_to_delete = [] # 存储 (name, size, timestamp) 用于删除
-
-            if Config.USE_ONEDRIVE_STORAGE and one_drive_client:
-                # ✅ OneDrive 模式：统计 OneDrive 上的文件
-                files = one_drive_client.list_files_in_folder()
-                # 将时间字符串转换为时间戳以便排序
-                import datetime
-                for file in files:
-                    try:
-                        dt = datetime.datetime.fromisoformat(file['lastModifiedDateTime'].replace('Z', '+00:00'))
-                        files_to_delete.append((file['name'], file['size'], dt.timestamp()))
-                        total_size += file['size']
-                    except Exception as e:
-                        print(f"[存储管理] 解析时间失败 {file['name']}: {e}")
-                        continue
+            returncode = _run_iw3(args, slot)
+        except WarmWorkerError as e:
+            error_msg = f"[转换失败] {e}"
+            print(error_msg)
+            return {task_id: (False, error_msg, output_path) for task_id, _, output_path in items}
 
-                # 按时间戳排序 (最旧的在前)
-                files_to_delete.sort(key=lambda x: x[2])
+        outputs = {}  # task_id -> [输出文件]
+        for name in os.listdir(output_dir):
+            path = os.path.join(output_dir, name)
+            item = staged.get(os.path.splitext(name)[0].split('_', 1)[0])
+            if item is not None and os.path.isfile(path):
+                outputs.setdefault(item[0], []).append(path)
+        if returncode != 0 and outputs:
+            newest = max((path for paths in outputs.values() for path in paths), key=os.path.getmtime)
+            for paths in outputs.values():
+                if newest in paths:
+                    paths.remove(newest)
 
-                print(f"[存储管理] OneDrive 总大小: {total_size / (1024**3):.2f}GB")
-                while total_size > Config.MAX_STORAGE_SIZE and files_to_delete:
-                    filename, size, _ = files_to_delete.pop(0)
-                    # 调用 OneDrive 客户端删除
-                    if one_drive_client.delete_file(filename):
-                        total_size -= size
-                        print(f"[存储管理] 已删除 OneDrive 旧文件: {filename}")
-                    else:
-                        print(f"[存储管理] 删除 OneDrive 文件失败: {filename}")
-                        continue
+        for task_id, input_path, output_path in items:
+            produced = sorted(outputs.get(task_id, []))
+            if not produced:
+                error_msg = f"[转换失败] 文件: {input_path}, 错误码: {returncode}（批量）"
+                print(error_msg)
+                results[task_id] = (False, error_msg, output_path)
+                continue
+            ext = os.path.splitext(produced[0])[1]
+            if ext.lower() != os.path.splitext(output_path)[1].lower():
+                output_path = output_path_for(task_id, ext) if output_path_for else os.path.splitext(output_path)[0] + ext
+            os.replace(produced[0], output_path)
+            _store_output(input_path, output_path)
+            results[task_id] = (True, "转换成功（批量）", output_path)
+    except Exception as e:
+        error_msg = f"[转换异常] {str(e)}"
+        print(error_msg)
+        for task_id, _, output_path in items:
+            results.setdefault(task_id, (False, error_msg, output_path))
+    finally:
+        shutil.rmtree(input_dir, ignore_errors=True)
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+def storage_mode():
+    return 'onedrive' if Config.USE_ONEDRIVE_STORAGE and one_drive_client else 'local'
+
+def scan_storage():
+    """
+    全量扫描已转换文件，返回 {name: (size, mtime)}。
+    本地模式 name 为相对 CONVERTED_FOLDER 的路径；OneDrive 模式为文件名。
+    """
+    scanned = {}
+    if storage_mode() == 'onedrive':
+        for file in one_drive_client.list_files_in_folder():
+            try:
+                dt = datetime.fromisoformat(file['lastModifiedDateTime'].replace('Z', '+00:00'))
+                scanned[file['name']] = (file['size'], dt.timestamp())
+            except Exception as e:
+                print(f"[存储管理] 解析时间失败 {file['name']}: {e}")
+    elif os.path.exists(Config.CONVERTED_FOLDER):
+        for root, dirs, files in os.walk(Config.CONVERTED_FOLDER):
+            dirs[:] = [d for d in dirs if not d.startswith('_batch_')]  # 批量转换的暂存目录
+            for file in files:
+                filepath = os.path.join(root, file)
+                try:
+                    stat = os.stat(filepath)
+                    scanned[os.path.relpath(filepath, Config.CONVERTED_FOLDER)] = (stat.st_size, stat.st_mtime)
+                except Exception as e:
+                    print(f"[存储管理] 读取文件信息失败 {filepath}: {e}")
+    return scanned
+
+def reconcile_storage():
+    """全量扫描并校准存储索引（启动时和后台定期调用）"""
+    scan_generation = storage_index.begin_scan()
+    scanned = scan_storage()
+    storage_index.reconcile(scanned, scan_generation, storage_mode())
+    storage_index.save()
+    print(f"[存储索引] 校准完成: {len(scanned)} 个文件, 总大小 {storage_index.total_bytes / (1024**3):.2f}GB")
+    return scanned
 
+def storage_index_worker():
+    """后台线程：定期保存存储索引，并按 STORAGE_RECONCILE_INTERVAL 全量校准"""
+    last_reconcile = time.time()
+    while True:
+        time.sleep(60)
+        try:
+            if time.time() - last_reconcile >= Config.STORAGE_RECONCILE_INTERVAL:
+                reconcile_storage()
+                last_reconcile = time.time()
             else:
-                # ✅ 本地模式：原有逻辑 (保持不变)
-                # 遍历已转换文件夹
-                if os.path.exists(Config.CONVERTED_FOLDER):
-                    for root, dirs, files in os.walk(Config.CONVERTED_FOLDER):
-                        for file in files:
-                            filepath = os.path.join(root, file)
-                            if os.path.isfile(filepath):
-                                try:
-                                    file_size = os.path.getsize(filepath)
-                                    # 获取文件的修改时间 (时间戳)
-                                    file_mtime = os.path.getmtime(filepath)
-                                    files_to_delete.append((filepath, file_size, file_mtime))
-                                    total_size += file_size
-                                except Exception as e:
-                                    print(f"[存储管理] 读取文件信息失败 {filepath}: {e}")
-                                    continue
-
-                # 按修改时间排序 (最旧的在前)
-                files_to_delete.sort(key=lambda x: x[2])
-
-                print(f"[存储管理] 本地总大小: {total_size / (1024**3):.2f}GB")
-                while total_size > Config.MAX_STORAGE_SIZE and files_to_delete:
-                    filepath, size, _ = files_to_delete.pop(0)
+                storage_index.save()
+        except Exception as e:
+            print(f"[存储索引] 后台校准失败: {e}")
+
+def manage_storage():
+    """
+    管理存储空间，当超过 MAX_STORAGE_SIZE 时删除最旧的已转换文件。
+    总大小和淘汰顺序来自增量维护的存储索引，不再遍历目录或列出 OneDrive。
+    此函数是线程安全的，使用 storage_lock 保护
+    """
+    with storage_lock, manage_storage_seconds.time():
+        try:
+            onedrive_mode = storage_mode() == 'onedrive'
+            location = 'OneDrive' if onedrive_mode else '本地'
+            print(f"[存储管理] {location}总大小: {storage_index.total_bytes / (1024**3):.2f}GB")
+
+            failed = set()
+            while storage_index.total_bytes > Config.MAX_STORAGE_SIZE:
+                oldest = storage_index.oldest(skip=failed)
+                if oldest is None:
+                    break
+                name, size = oldest
+                if onedrive_mode:
+                    # 调用 OneDrive 客户端删除
+                    deleted = one_drive_client.delete_file(name)
+                else:
+                    filepath = os.path.join(Config.CONVERTED_FOLDER, name)
                     try:
-                        os.remove(filepath)
-                        total_size -= size
-                        print(f"[存储管理] 已删除本地旧文件: {filepath}")
+                        if os.path.exists(filepath):
+                            os.remove(filepath)
+                        deleted = True
                     except Exception as e:
                         print(f"[存储管理] 删除本地文件失败 {filepath}: {e}")
-                        continue
+                        deleted = False
+
+                if deleted:
+                    storage_index.remove(name)
+                    storage_evictions.labels('deleted').inc()
+                    storage_evicted_bytes.inc(size)
+                    print(f"[存储管理] 已删除{location}旧文件: {name}")
+                    _notify_evicted(os.path.basename(name))
+                else:
+                    print(f"[存储管理] 删除{location}文件失败: {name}")
+                    storage_evictions.labels('failed').inc()
+                    failed.add(name)
 
         except Exception as e:
-            print(f"[存储管理] 发生异常: {e}")
\ No newline at end of file
+            print(f"[存储管理] 发生异常: {e}")
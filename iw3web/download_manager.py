@@ -0,0 +1,394 @@
+# download_manager.py
+
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+from collections import deque
+import requests
+from config import Config
+from status_events import status_events
+from resource_monitor import resource_monitor
+
+
+class DownloadJob:
+    """
+    一个直链下载任务。
+    服务器支持 Range 时把文件分成多段并行下载，各段直接写入预分配文件的对应偏移；
+    每段已下载的字节数记录在 direct_<id>.json 中，失败重试或服务重启后从断点继续。
+    内容哈希按“从文件开头连续已下载的部分”增量计算，下载完成时基本已算完。
+    """
+
+    def __init__(self, job_id, url, filename, additional_args, total_size=None, segments=None, accept_ranges=None):
+        self.job_id = job_id
+        self.url = url
+        self.filename = filename
+        self.additional_args = additional_args
+        self.total_size = total_size
+        self.accept_ranges = accept_ranges
+        self.segments = segments or []  # [[start, end, done_bytes], ...]（闭区间）
+        base_path = os.path.join(Config.UPLOAD_FOLDER, f"direct_{job_id}")
+        self.part_path = base_path + '.part'
+        self.meta_path = base_path + '.json'
+        self.final_path = os.path.join(Config.UPLOAD_FOLDER, f"direct_{job_id}_{filename}")
+        self.state = '排队中'
+        self.error = None
+        self.lock = threading.Lock()
+        self.speed = 0
+        self.last_sample = (time.time(), 0)
+        self.last_publish = 0
+        # 增量内容哈希（不持久化，重启后从头补算）
+        self.hasher = hashlib.sha256()
+        self.hash_offset = 0
+        self.hash_lock = threading.Lock()
+        self.content_hash = None
+
+    @property
+    def paths(self):
+        return (self.part_path, self.meta_path)
+
+    @property
+    def downloaded(self):
+        with self.lock:
+            return sum(done for _, _, done in self.segments)
+
+    def contiguous_bytes(self):
+        """从文件开头开始连续已下载的字节数"""
+        with self.lock:
+            contiguous = 0
+            for start, end, done in self.segments:
+                if start != contiguous:
+                    break
+                contiguous = start + done
+                if start + done <= end:
+                    break
+            return contiguous
+
+    def advance_hash(self):
+        """把新增的连续已下载部分读入哈希（数据以无缓冲方式写入，计数更新时已在操作系统缓存中）"""
+        with self.hash_lock:
+            target = self.contiguous_bytes()
+            if target <= self.hash_offset:
+                return
+            with open(self.part_path, 'rb') as f:
+                f.seek(self.hash_offset)
+                while self.hash_offset < target:
+                    block = f.read(min(1024 * 1024, target - self.hash_offset))
+                    if not block:
+                        break
+                    self.hasher.update(block)
+                    self.hash_offset += len(block)
+
+    def reset_hash(self):
+        with self.hash_lock:
+            self.hasher = hashlib.sha256()
+            self.hash_offset = 0
+
+    def save(self):
+        with self.lock:
+            meta = {
+                'job_id': self.job_id,
+                'url': self.url,
+                'filename': self.filename,
+                'additional_args': self.additional_args,
+                'total_size': self.total_size,
+                'accept_ranges': self.accept_ranges,
+                'segments': [list(segment) for segment in self.segments]
+            }
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+
+    @classmethod
+    def load(cls, meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        job = cls(**meta)
+        if not os.path.isfile(job.part_path):
+            job.segments = []  # 数据文件丢失，只能重新下载
+        return job
+
+    def to_dict(self):
+        downloaded = self.downloaded
+        return {
+            'id': self.job_id,
+            'url': self.url,
+            'filename': self.filename,
+            'state': self.state,
+            'downloaded': downloaded,
+            'total_size': self.total_size,
+            'progress': round(downloaded / self.total_size * 100, 1) if self.total_size else None,
+            'speed': round(self.speed),
+            'segments': len(self.segments),
+            'error': self.error
+        }
+
+
+class DownloadManager:
+    """
+    /upload_direct 的下载管理器：
+    - 最多 DIRECT_DOWNLOAD_MAX_JOBS 个任务同时下载，其余排队
+    - 每个任务最多 DIRECT_DOWNLOAD_SEGMENTS 个连接（Range 分段）
+    - 相同 URL 正在下载时不重复下载，直接返回已有任务
+    """
+
+    def __init__(self, max_jobs, max_segments):
+        self.max_jobs = max_jobs
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        self.jobs = {}  # job_id -> DownloadJob（未完成）
+        self.by_url = {}  # url -> job_id
+        self.finished = deque(maxlen=20)  # 最近完成 / 失败的任务，供状态页展示
+        self.pending = queue.Queue()
+        self.threads = []
+        self.completed_callbacks = []  # 下载完成后调用 callback(job)
+
+    # === 提交 / 查询 ===
+
+    def submit(self, url, filename, additional_args):
+        """提交下载任务，返回 (job, created)；相同 URL 正在下载时返回已有任务"""
+        with self.lock:
+            job_id = self.by_url.get(url)
+            if job_id:
+                return self.jobs[job_id], False
+            job_id = f"{int(time.time())}_{os.urandom(4).hex()}"
+            job = DownloadJob(job_id, url, filename, additional_args)
+            self.jobs[job_id] = job
+            self.by_url[url] = job_id
+        job.save()
+        self.pending.put(job)
+        self._publish()
+        return job, True
+
+    def restore(self):
+        """启动时恢复未完成的下载任务"""
+        if not os.path.exists(Config.UPLOAD_FOLDER):
+            return
+        restored = 0
+        for item in os.listdir(Config.UPLOAD_FOLDER):
+            if not (item.startswith('direct_') and item.endswith('.json')):
+                continue
+            try:
+                job = DownloadJob.load(os.path.join(Config.UPLOAD_FOLDER, item))
+            except Exception as e:
+                print(f"[直链下载] 读取下载任务失败 {item}: {e}")
+                continue
+            with self.lock:
+                self.jobs[job.job_id] = job
+                self.by_url[job.url] = job.job_id
+            self.pending.put(job)
+            restored += 1
+        print(f"[直链下载] 恢复了 {restored} 个未完成的下载任务")
+
+    def owned_paths(self):
+        """未完成任务占用的文件（清理孤立文件时需要保留）"""
+        with self.lock:
+            return {os.path.abspath(path) for job in self.jobs.values() for path in job.paths}
+
+    def pending_bytes(self):
+        """已知大小的未完成下载还要写入的字节数（资源准入检查时从剩余空间中扣除）"""
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if job.total_size]
+        return sum(max(0, job.total_size - job.downloaded) for job in jobs)
+
+    def snapshot(self):
+        with self.lock:
+            active = list(self.jobs.values())
+            finished = list(self.finished)
+        return [job.to_dict() for job in active + finished]
+
+    def _publish(self, job=None):
+        """发布下载状态；下载过程中每个任务最多每秒发布一次"""
+        now = time.time()
+        if job is not None:
+            if now - job.last_publish < 1:
+                return
+            elapsed = now - job.last_sample[0]
+            downloaded = job.downloaded
+            if elapsed > 0:
+                job.speed = (downloaded - job.last_sample[1]) / elapsed
+            job.last_sample = (now, downloaded)
+            job.last_publish = now
+            job.advance_hash()
+        status_events.publish({'type': 'downloads', 'downloads': self.snapshot()})
+
+    # === 下载线程 ===
+
+    def start(self):
+        if self.threads:
+            return
+        for _ in range(self.max_jobs):
+            thread = threading.Thread(target=self._worker_loop, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _worker_loop(self):
+        while True:
+            job = self.pending.get()
+            job.state = '下载中'
+            job.last_sample = (time.time(), job.downloaded)
+            self._publish()
+            try:
+                self._download(job)
+                job.advance_hash()
+                job.content_hash = job.hasher.hexdigest()
+                os.replace(job.part_path, job.final_path)
+                if os.path.exists(job.meta_path):
+                    os.remove(job.meta_path)
+                job.state = '已完成'
+                print(f"[直链下载] 下载完成: {job.filename} ({job.total_size} bytes)")
+            except Exception as e:
+                job.state = '下载失败'
+                job.error = str(e)
+                print(f"[直链下载] 下载失败 {job.url}: {e}")
+                for path in job.paths:
+                    if os.path.exists(path):
+                        os.remove(path)
+            else:
+                # 回调（加入转换队列）失败时文件已改名为最终文件，需要单独清理，否则会成为无人认领的孤立文件
+                try:
+                    for callback in self.completed_callbacks:
+                        callback(job)
+                except Exception as e:
+                    job.state = '下载失败'
+                    job.error = f"加入转换队列失败: {e}"
+                    print(f"[直链下载] 下载完成但加入转换队列失败 {job.final_path}: {e}")
+                    if os.path.exists(job.final_path):
+                        os.remove(job.final_path)
+            finally:
+                job.speed = 0
+                with self.lock:
+                    self.jobs.pop(job.job_id, None)
+                    self.by_url.pop(job.url, None)
+                    self.finished.appendleft(job)
+                self._publish()
+
+    def _probe(self, job):
+        """用 Range: bytes=0-0 探测文件大小以及服务器是否支持分段"""
+        with requests.get(job.url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=30) as r:
+            r.raise_for_status()
+            if r.status_code == 206 and '/' in r.headers.get('Content-Range', ''):
+                total = r.headers['Content-Range'].rsplit('/', 1)[1]
+                if total != '*':
+                    return int(total), True
+            length = r.headers.get('Content-Length')
+            return (int(length) if length and r.status_code == 200 else None), False
+
+    def _plan_segments(self, job):
+        if job.accept_ranges and job.total_size:
+            count = max(1, min(self.max_segments, job.total_size // Config.DIRECT_DOWNLOAD_MIN_SEGMENT))
+            size = -(-job.total_size // count)
+            job.segments = [[start, min(start + size, job.total_size) - 1, 0]
+                            for start in range(0, job.total_size, size)]
+        else:
+            job.segments = [[0, (job.total_size or 0) - 1, 0]]
+        with open(job.part_path, 'wb') as f:
+            if job.total_size:
+                f.truncate(job.total_size)
+        job.save()
+
+    def _download(self, job):
+        if not job.segments:
+            total_size, accept_ranges = self._probe(job)
+            # 知道大小后先确认磁盘放得下，避免下载到一半才失败
+            rejection = resource_monitor.check_download(total_size)
+            if rejection is not None:
+                raise Exception(rejection.message)
+            job.total_size, job.accept_ranges = total_size, accept_ranges
+            self._plan_segments(job)
+            print(f"[直链下载] {job.filename}: 大小 {job.total_size}, "
+                  f"{'分 ' + str(len(job.segments)) + ' 段并行下载' if job.accept_ranges else '服务器不支持分段，单连接下载'}")
+
+        if not job.accept_ranges:
+            self._download_single(job)
+            self._verify(job)
+            return
+
+        errors = []
+        threads = []
+        for index in range(len(job.segments)):
+            thread = threading.Thread(target=self._download_segment, args=(job, index, errors), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        job.save()
+        if errors:
+            raise Exception(errors[0])
+        self._verify(job)
+
+    def _verify(self, job):
+        if job.total_size is not None and job.downloaded != job.total_size:
+            raise Exception(f"下载大小不符: {job.downloaded}/{job.total_size} bytes")
+
+    def _download_segment(self, job, index, errors):
+        start, end, _ = job.segments[index]
+        attempt = 0
+        while True:
+            done = job.segments[index][2]
+            if start + done > end:
+                return
+            try:
+                headers = {'Range': f"bytes={start + done}-{end}"}
+                with requests.get(job.url, headers=headers, stream=True, timeout=30) as r:
+                    if r.status_code != 206:
+                        raise Exception(f"分段请求返回 {r.status_code}")
+                    self._write_stream(job, r, index, start + done)
+                if job.segments[index][2] == done:
+                    raise Exception("连接提前结束，没有收到数据")
+                attempt = 0
+            except Exception as e:
+                attempt += 1
+                if attempt > Config.DIRECT_DOWNLOAD_RETRIES:
+                    errors.append(f"分段 {index} 下载失败: {e}")
+                    return
+                wait_time = min(2 ** attempt, 60)
+                print(f"[直链下载] 分段 {index} 下载中断，{wait_time} 秒后从 {start + job.segments[index][2]} 继续: {e}")
+                time.sleep(wait_time)
+
+    def _download_single(self, job):
+        """服务器不支持 Range：单连接下载，失败后只能从头开始"""
+        attempt = 0
+        while True:
+            try:
+                with job.lock:
+                    job.segments[0][2] = 0
+                job.reset_hash()
+                with requests.get(job.url, stream=True, timeout=30) as r:
+                    r.raise_for_status()
+                    self._write_stream(job, r, 0, 0)
+                if job.total_size is None:
+                    job.total_size = job.segments[0][2]
+                    job.segments[0][1] = job.total_size - 1
+                return
+            except Exception as e:
+                attempt += 1
+                if attempt > Config.DIRECT_DOWNLOAD_RETRIES:
+                    raise
+                wait_time = min(2 ** attempt, 60)
+                print(f"[直链下载] 下载中断，{wait_time} 秒后重新下载: {e}")
+                time.sleep(wait_time)
+
+    def _write_stream(self, job, response, index, offset):
+        last_save = time.time()
+        with open(job.part_path, 'r+b', buffering=0) as f:
+            f.seek(offset)
+            for chunk in response.iter_content(chunk_size=256 * 1024):
+                if not chunk:
+                    continue
+                view = memoryview(chunk)
+                while view:
+                    view = view[f.write(view):]  # 无缓冲写入可能只写入一部分
+                with job.lock:
+                    job.segments[index][2] += len(chunk)
+                self._publish(job)
+                if time.time() - last_save >= 2:
+                    job.save()  # 数据已无缓冲写入，再记录进度，重启后不会多报
+                    last_save = time.time()
+
+
+# 全局实例（下载线程由 main 启动）
+download_manager = DownloadManager(Config.DIRECT_DOWNLOAD_MAX_JOBS, Config.DIRECT_DOWNLOAD_SEGMENTS)
@@ -0,0 +1,109 @@
+# iw3_worker.py
+"""
+常驻 iw3 转换进程：启动时导入 iw3 / torch 一次，之后逐个处理 Web GUI 发来的任务，
+深度模型在参数相同的任务之间复用，省掉每个文件的解释器启动、torch 导入和模型加载。
+
+需要用 nunif 的 Python 运行，工作目录为 nunif 源码目录（与 iw3-cli.bat 相同）。在 config.py 中设置:
+    IW3_WORKER_COMMAND = [r'C:\\TOOL\\nunif-windows\\python\\python.exe', r'C:\\TOOL\\nunif-windows\\iw3web\\iw3_worker.py']
+    IW3_WORKER_CWD = r'C:\\TOOL\\nunif-windows\\nunif'
+
+协议（每行一个 JSON，标准输入接收请求，标准输出发送响应；iw3 自身的输出全部转到标准错误）:
+    -> {"type": "ready", "pid": 1234}                      启动完成
+    <- {"type": "job", "id": "...", "args": ["-i", ...]}   转换任务，args 与 iw3.cli 的命令行参数相同
+    -> {"type": "done", "id": "...", "returncode": 0, "message": "..."}
+    <- {"type": "ping"}  -> {"type": "pong", "jobs": 3}     健康检查
+    <- {"type": "exit"}                                    处理完当前任务后退出（标准输入关闭时同样退出）
+bench/stub_iw3.py --worker 实现了相同的协议，用于没有 iw3 的环境。
+"""
+
+import os
+import sys
+import json
+import inspect
+import traceback
+
+
+class Iw3Runner:
+    """在当前进程内运行 iw3.cli，深度模型名称相同时复用已加载的模型"""
+
+    def __init__(self):
+        import torch  # noqa: F401  启动时导入一次
+        try:
+            from iw3.utils import create_parser, set_state_args, iw3_main
+            self.create_parser = create_parser
+            self.set_state_args = set_state_args
+            self.iw3_main = iw3_main
+            self.reuse_model = 'depth_model' in inspect.signature(set_state_args).parameters
+        except ImportError:
+            # 旧版本 iw3：每个任务按命令行方式运行，仍然省掉解释器启动和 torch 导入
+            self.create_parser = None
+            self.reuse_model = False
+        self.depth_model = None
+        self.depth_model_name = None
+
+    def run(self, args):
+        if self.create_parser is None:
+            import runpy
+            sys.argv = ['iw3.cli'] + list(args)
+            runpy.run_module('iw3.cli', run_name='__main__', alter_sys=True)
+            return 0
+
+        parsed = self.create_parser().parse_args(args)
+        kwargs = {}
+        if self.reuse_model and self.depth_model is not None and self.depth_model_name == parsed.depth_model:
+            kwargs['depth_model'] = self.depth_model
+        self.set_state_args(parsed, **kwargs)
+        self.iw3_main(parsed)
+        state = getattr(parsed, 'state', None) or {}
+        if self.reuse_model and state.get('depth_model') is not None:
+            self.depth_model = state['depth_model']
+            self.depth_model_name = parsed.depth_model
+        return 0
+
+
+def serve(run_job, protocol=None):
+    """
+    协议主循环（真实 iw3 和 bench 中的模拟转换器共用）。
+    run_job(args) 返回退出码，抛出的异常作为失败信息返回，不会让进程退出。
+    """
+    if protocol is None:
+        # 标准输出只用于协议，iw3 / tqdm 的打印全部转到标准错误
+        protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'w', buffering=1, encoding='utf-8')
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def send(message):
+        protocol.write(json.dumps(message, ensure_ascii=False) + '\n')
+        protocol.flush()
+
+    jobs = 0
+    send({'type': 'ready', 'pid': os.getpid()})
+    for line in sys.stdin:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        kind = message.get('type')
+        if kind == 'ping':
+            send({'type': 'pong', 'jobs': jobs})
+        elif kind == 'exit':
+            break
+        elif kind == 'job':
+            try:
+                returncode, error = run_job(message['args']), None
+            except SystemExit as e:
+                returncode, error = e.code if isinstance(e.code, int) else 1, None
+            except Exception as e:
+                traceback.print_exc()
+                returncode, error = 1, f"{type(e).__name__}: {e}"
+            jobs += 1
+            sys.stderr.flush()
+            send({'type': 'done', 'id': message.get('id'), 'returncode': returncode, 'message': error})
+
+
+def main():
+    runner = Iw3Runner()
+    serve(runner.run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# log_sink.py
+
+import os
+import threading
+import itertools
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from config import Config
+
+# 当前线程的日志上下文（任务名 / 来源），由 log_context 设置
+_context = threading.local()
+
+
+@contextmanager
+def log_context(task=None, source=None):
+    """在 with 块内打印的日志自动带上任务名和来源"""
+    previous = (getattr(_context, 'task', None), getattr(_context, 'source', None))
+    if task is not None:
+        _context.task = task
+    if source is not None:
+        _context.source = source
+    try:
+        yield
+    finally:
+        _context.task, _context.source = previous
+
+
+def current_log_context():
+    return getattr(_context, 'task', None), getattr(_context, 'source', None)
+
+
+class LogSink:
+    """
+    非阻塞日志：
+    - emit() 只把结构化记录放进内存（最近记录环形缓冲 + 待写队列），不做任何磁盘 I/O
+    - 后台线程批量追加写入日志文件，超过 max_bytes 时按 app.log -> app.log.1 -> ... 轮转
+    - 待写队列有上限，写盘跟不上时丢弃最旧的记录并计数
+    """
+
+    def __init__(self, filename, max_bytes, backup_count, ring_size):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.ring = deque(maxlen=ring_size)
+        self.pending = deque(maxlen=ring_size)
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.dropped = 0
+        self.writer_thread = None
+        self.file = None
+
+    def emit(self, message, level='INFO', source=None, task=None):
+        ctx_task, ctx_source = current_log_context()
+        record = {
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'level': level,
+            'source': source or ctx_source or 'app',
+            'task': task or ctx_task,
+            'message': message
+        }
+        with self.cond:
+            self.seq += 1
+            record['seq'] = self.seq
+            self.ring.append(record)
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(record)
+            self.cond.notify()
+
+    def since(self, seq=0, limit=500, task=None):
+        """返回序号大于 seq 的记录（最多 limit 条），以及当前最新序号"""
+        with self.cond:
+            last_seq = self.seq
+            if not self.ring:
+                return [], last_seq
+            first_seq = self.ring[0]['seq']
+            start = max(0, seq - first_seq + 1)
+            records = itertools.islice(self.ring, start, None)
+            if task:
+                records = (r for r in records if r['task'] == task)
+            return list(itertools.islice(records, limit)), last_seq
+
+    # === 后台写盘 ===
+
+    def start(self):
+        if self.writer_thread is None:
+            self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+            self.writer_thread.start()
+
+    @staticmethod
+    def format_record(record):
+        task = f" [{record['task']}]" if record['task'] else ''
+        return f"[{record['time']}] [{record['level']}] [{record['source']}]{task} {record['message']}\n"
+
+    def _writer_loop(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                batch = list(self.pending)
+                self.pending.clear()
+            try:
+                self._write_batch(''.join(self.format_record(r) for r in batch))
+            except Exception:
+                pass  # 避免日志写入失败导致崩溃
+
+    def _write_batch(self, text):
+        if self.file is None:
+            self.file = open(self.filename, 'a', encoding='utf-8')
+        self.file.write(text)
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.filename}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.filename}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.filename, f"{self.filename}.1")
+        else:
+            os.remove(self.filename)
+
+
+class SinkStream:
+    """替代 sys.stdout / sys.stderr：按行切分后交给 LogSink（每个线程单独缓存未结束的行）"""
+
+    def __init__(self, sink, level='INFO'):
+        self.sink = sink
+        self.level = level
+        self.local = threading.local()
+
+    def write(self, message):
+        buffer = getattr(self.local, 'buffer', '') + message
+        *lines, self.local.buffer = buffer.split('\n')
+        for line in lines:
+            if line.strip():
+                self.sink.emit(line.rstrip(), level=self.level)
+        return len(message)
+
+    def flush(self):
+        buffer = getattr(self.local, 'buffer', '')
+        if buffer.strip():
+            self.sink.emit(buffer.rstrip(), level=self.level)
+        self.local.buffer = ''
+
+
+# 全局实例（写盘线程由 main 启动）
+log_sink = LogSink(Config.LOG_FILE, Config.LOG_MAX_BYTES, Config.LOG_BACKUP_COUNT, Config.LOG_RING_SIZE)
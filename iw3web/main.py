@@ -1,35 +1,87 @@
 import os
+import io
 import threading
-import queue
 import time
 import re
 import json
-import requests
-import subprocess
+import shutil
 import psutil
-import main as current_module
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash, jsonify, Response, abort
+from flask import Flask, Request, render_template, request, redirect, url_for, send_file, flash, jsonify, Response, abort
 from werkzeug.utils import secure_filename
 from config import Config
 import signal
 import sys
 
-current_conversion_pid = None
-# 当前正在处理的任务元数据（用于终止时清理）
-current_task_metadata = {
-    'input_path': None,
-    'original_filename': None,
-    'additional_args': ''
-}
-current_task_lock = threading.Lock()
-conversion_pid_lock = threading.Lock()
 task_control_lock = threading.Lock()
-from converter import convert_file, manage_storage
+# 服务关闭中：在 task_control_lock 内设置，之后工作线程不再取新任务（正在转换的任务已放回队列）
+shutdown_event = threading.Event()
+from converter import convert_file, convert_batch, manage_storage, eviction_callbacks, reconcile_storage, storage_index_worker, storage_mode
+from storage_index import storage_index
+from upload_stage import upload_stage
+from download_manager import download_manager
+from result_cache import result_cache
+from task_scheduler import task_scheduler, conversion_time_model
+from stop_windows import stop_schedule
+from task_registry import task_registry
+from conversion_slots import slot_pool
+from upload_sessions import upload_sessions
+from state_store import state_store
+from log_sink import log_sink, log_context, SinkStream
+from status_events import status_events
 from onedrive_client import one_drive_client
+from process_control import process_control, ProcessControlError
+from resource_monitor import resource_monitor
+from warm_workers import warm_workers
+from metrics import (metrics, upload_chunks, upload_bytes, upload_chunk_seconds, upload_finalize_seconds,
+                     tasks_enqueued, queue_depth, queue_wait_seconds, conversions, conversions_active,
+                     storage_used_bytes, storage_limit_bytes, process_control_seconds)
+
+# 不超过该大小的请求体（分块上传的单个块 + 表单开销）直接在内存中解析
+UPLOAD_CHUNK_MEMORY_LIMIT = Config.UPLOAD_CHUNK_SIZE + 1024 * 1024
+
+class ChunkUploadRequest(Request):
+    """分块上传的块直接保存在内存中，避免 Werkzeug 先写入临时文件、再由我们写一次磁盘"""
+
+    @property
+    def max_content_length(self):
+        # 分块上传接口的请求体不超过一个分块，超出时在读取请求体之前就返回 413；其他接口仍按 MAX_CONTENT_LENGTH
+        if self.endpoint == 'upload_chunk':
+            return UPLOAD_CHUNK_MEMORY_LIMIT
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_CHUNK_MEMORY_LIMIT:
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
 app = Flask(__name__)
+app.request_class = ChunkUploadRequest
 app.config.from_object(Config)
 app.secret_key = 'your-secret-key-here'
 
+# 已接受但尚未写完的上传 / 下载数据，准入检查时从剩余空间中扣除
+resource_monitor.pending_sources += [upload_sessions.pending_bytes, download_manager.pending_bytes]
+
+# 由已有状态得出的指标在抓取时计算
+queue_depth.set_function(lambda: len(task_scheduler))
+conversions_active.set_function(lambda: len(slot_pool.active_slots()))
+storage_used_bytes.set_function(lambda: storage_index.total_bytes)
+storage_limit_bytes.set_function(lambda: Config.MAX_STORAGE_SIZE)
+
+# SSE 状态推送的保活间隔（秒）
+SSE_KEEPALIVE = 15
+# 当前打开的 SSE 连接数（生产模式下每个连接占用一个工作线程，超过 sse_connection_limit() 时拒绝）
+sse_connections = 0
+sse_connections_lock = threading.Lock()
+
+def sse_connection_limit():
+    """SSE 连接上限：开发模式每个请求一个线程，不限制；生产模式默认比工作线程数少 4 个"""
+    if Config.SERVER_MODE != 'production':
+        return None
+    if Config.SSE_MAX_CONNECTIONS is not None:
+        return Config.SSE_MAX_CONNECTIONS
+    return max(1, Config.SERVER_THREADS - 4)
+
 # 支持的文件扩展名
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mkv'}
 
@@ -38,39 +90,85 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# 文件队列和线程锁
-conversion_queue = queue.Queue()
+# 线程锁（转换队列见 task_scheduler）
 worker_wakeup_event = threading.Event()
-status_lock = threading.Lock()
+status_lock = threading.RLock()
 status_info = {
     'processing': False,
     'current_file': None,
     'current_status': '空闲',
-    'uploaded_files': [],
-    'converted_files': []
+    # 已转换文件：有序字典（旧 -> 新），增删和查找都是 O(1)；待转换列表由 task_registry 生成
+    'converted_files': {}
 }
 
-# 状态持久化文件
-STATE_FILE = 'conversion_state.json'
+def refresh_overall_status(last_status=None):
+    """
+    根据各槽位汇总 processing / current_file / current_status。
+    调用方需持有 status_lock，且不能同时持有 slot_pool.lock（锁顺序：slot_pool.lock 先于 status_lock 释放）
+    """
+    active = slot_pool.active_slots()
+    status_info['processing'] = bool(active)
+    if not active:
+        status_info['current_file'] = None
+        if last_status is not None:
+            status_info['current_status'] = last_status
+    elif len(active) == 1:
+        status_info['current_file'] = active[0].original_filename
+        status_info['current_status'] = active[0].status
+    else:
+        status_info['current_file'] = ', '.join(slot.original_filename for slot in active)
+        status_info['current_status'] = f'正在转换 {len(active)} 个任务'
+    status_events.publish({
+        'type': 'status',
+        'current_status': status_info['current_status'],
+        'current_file': status_info['current_file'],
+        'slots': slot_pool.snapshot()
+    })
 
-def load_persistent_state():
-    """从文件加载持久化状态"""
-    try:
-        if os.path.exists(STATE_FILE):
-            with open(STATE_FILE, 'r', encoding='utf-8') as f:
-                state = json.load(f)
-                return state
-    except Exception as e:
-        print(f"加载持久化状态失败: {e}")
-    return None
+# === 文件列表变更：同时更新内存状态、写入状态日志并推送增量 ===
+def add_converted_file(name):
+    with status_lock:
+        if name not in status_info['converted_files']:
+            status_info['converted_files'][name] = None
+            state_store.converted_add(name)
+            status_events.publish({'type': 'converted_add', 'name': name})
 
-def save_persistent_state(state):
-    """保存持久化状态到文件"""
-    try:
-        with open(STATE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"保存持久化状态失败: {e}")
+def remove_converted_file(name):
+    with status_lock:
+        if name in status_info['converted_files']:
+            del status_info['converted_files'][name]
+            state_store.converted_remove(name)
+            status_events.publish({'type': 'converted_remove', 'name': name})
+
+def set_converted_files(names):
+    """names 为最新在前的列表"""
+    with status_lock:
+        status_info['converted_files'] = dict.fromkeys(reversed(names))
+        state_store.converted_set(names)
+        status_events.publish({'type': 'converted_set', 'names': list(names)})
+
+# 存储管理删除旧文件后，同步从已转换列表移除
+eviction_callbacks.append(remove_converted_file)
+
+def status_snapshot():
+    """完整状态 + 对应的版本号（在 status_lock 内读取，保证两者一致）"""
+    with status_lock:
+        return {
+            'version': status_events.version,
+            'current_status': status_info.get('current_status', 'idle'),
+            'current_file': status_info.get('current_file', ''),
+            'uploaded_files': [{'task_id': t['task_id'], 'filename': t['filename']} for t in task_registry.queued()],
+            'converted_files': list(reversed(status_info['converted_files'])),
+            'slots': slot_pool.snapshot(),
+            'onedrive_cache': one_drive_client.cache_stats() if one_drive_client else None,
+            'upload_stage': upload_stage.snapshot(),
+            'downloads': download_manager.snapshot(),
+            'result_cache': result_cache.stats(),
+            'resources': resource_monitor.snapshot(),
+            'queue': task_scheduler.snapshot(Config.QUEUE_DISPLAY_LIMIT),
+            'queue_total': len(task_scheduler),
+            'schedule': {**stop_schedule.snapshot(), 'time_ratio': round(conversion_time_model.current_ratio(), 2)}
+        }
 
 def cleanup_temp_files():
     """清理临时文件"""
@@ -86,67 +184,81 @@ def cleanup_temp_files():
                 except Exception as e:
                     print(f"删除临时文件失败 {filename}: {e}")
     
-    # 清理转换文件夹中的临时文件
+    # 清理转换文件夹中的临时文件和批量转换的暂存输出目录
     if os.path.exists(Config.CONVERTED_FOLDER):
         for filename in os.listdir(Config.CONVERTED_FOLDER):
-            if filename.startswith('_tmp_'):
+            if filename.startswith(('_tmp_', '_batch_')):
                 file_path = os.path.join(Config.CONVERTED_FOLDER, filename)
                 try:
                     if os.path.isfile(file_path):
                         os.remove(file_path)
                         print(f"已删除临时转换文件: {filename}")
+                    elif os.path.isdir(file_path):
+                        shutil.rmtree(file_path)
+                        print(f"已删除批量转换暂存目录: {filename}")
                 except Exception as e:
                     print(f"删除临时文件失败 {filename}: {e}")
 
 def restore_processing_queue():
-    """恢复处理队列 AND uploaded_files"""
-    state = load_persistent_state()
-    if state and 'queue' in state:
+    """恢复任务表和处理队列（读取状态快照并重放状态日志）"""
+    state = state_store.load()
+    task_registry.load(state['tasks'])
+    queued_ids = set()
+    if state['queue']:
         restored_count = 0
         for task_data in state['queue']:
             try:
                 if os.path.exists(task_data['input_path']):
-                    task = {
-                        'input_path': task_data['input_path'],
-                        'original_filename': task_data['original_filename'],
-                        'stored_filename': task_data['stored_filename'],
-                        'additional_args': task_data.get('additional_args', '')
-                    }
-                    conversion_queue.put(task)
+                    # 保留优先级 / 加入时间 / 排序调整量等字段，按原来的位置恢复
+                    task = dict(task_data)
+                    task.setdefault('stored_filename', os.path.basename(task_data['input_path']))
+                    task.setdefault('additional_args', '')
+                    if task.get('task_id') not in state['tasks']:
+                        task_registry.create(task)  # 旧版状态文件中没有任务表
+                    task_scheduler.put(task)
+                    queued_ids.add(task['task_id'])
+                    if 'task_id' not in task_data:
+                        # 旧版状态文件中的任务：补写调度字段，下次重启时顺序不变
+                        state_store.queue_update(task['input_path'], task_id=task['task_id'],
+                                                 enqueued_at=task['enqueued_at'], priority=task['priority'])
                     restored_count += 1
                 else:
                     print(f"跳过不存在的文件: {task_data['original_filename']}")
+                    state_store.queue_remove(task_data['input_path'])
             except Exception as e:
                 print(f"恢复任务失败: {e}")
         
         print(f"恢复了 {restored_count} 个待处理任务")
-
-        # ✅ 新增：恢复 uploaded_files
-        if 'uploaded_files' in state:
-            with status_lock:
-                status_info['uploaded_files'] = state['uploaded_files'].copy()
-            print(f"恢复了 {len(state['uploaded_files'])} 个已上传文件列表")
     else:
         print("无持久化队列数据，跳过恢复")
+
+    # 上次没有正常关闭：转换到一半的任务已不在队列中，输入文件也可能不完整
+    for record in task_registry.snapshot(limit=len(state['tasks'])):
+        if record['task_id'] in queued_ids:
+            continue
+        if record['state'] == 'queued':
+            task_registry.transition(record['task_id'], 'cancelled', '服务重启时输入文件已不存在')
+        elif record['state'] == 'converting':
+            task_registry.transition(record['task_id'], 'failed', '服务异常退出，转换被中断')
 def cleanup_orphaned_upload_files():
     """
     启动时清理 UPLOAD_FOLDER 中未被 queue 记录的文件和临时上传目录。
-    - 保留 queue 中 input_path 指向的文件
-    - 删除其他所有文件和以 _upload_ 开头的目录（分块上传残留）
+    - 保留 queue 中 input_path 指向的文件，以及可续传的上传会话（_upload_*.part/.json/.bitmap）
+    - 删除其他所有文件、以 _upload_ 开头的目录（旧版分块上传残留）和 _batch_ 暂存目录（批量转换被中断）
     """
     print("正在清理 UPLOAD_FOLDER 中的孤立文件和无效上传目录...")
 
-    # 1. 加载持久化状态中的 queue
-    state = load_persistent_state()
-    valid_input_paths = set()
-    if state and 'queue' in state:
+    # 1. 加载持久化状态中的 queue，以及仍可续传的上传会话文件
+    state = state_store.snapshot()
+    valid_input_paths = upload_sessions.owned_paths() | download_manager.owned_paths()
+    if state['queue']:
         for task in state['queue']:
             input_path = task.get('input_path')
             if input_path and os.path.exists(input_path):
                 # 规范化路径，避免因大小写或符号链接导致误删
                 valid_input_paths.add(os.path.abspath(input_path))
     
-    print(f"队列中记录的有效输入文件数: {len(valid_input_paths)}")
+    print(f"需要保留的文件数（队列输入文件 + 上传会话文件 + 直链下载文件）: {len(valid_input_paths)}")
 
     # 2. 遍历 UPLOAD_FOLDER
     upload_folder = Config.UPLOAD_FOLDER
@@ -170,11 +282,10 @@ def cleanup_orphaned_upload_files():
                     print(f"❌ 无法删除文件 {item}: {e}")
 
         # 情况2: 是目录，且是分块上传临时目录（以 _upload_ 开头）
-        elif os.path.isdir(item_path) and item.startswith('_upload_'):
-            # 这类目录不应出现在 queue 的 input_path 中（input_path 指向合并后的文件）
-            # 所以直接删除整个目录
+        elif os.path.isdir(item_path) and item.startswith(('_upload_', '_batch_')):
+            # 这类目录不应出现在 queue 的 input_path 中（input_path 指向合并后的文件；
+            # _batch_ 是批量转换的暂存目录，其中只是输入文件的硬链接 / 副本），所以直接删除整个目录
             try:
-                import shutil
                 shutil.rmtree(item_path)
                 print(f"🗑️ 删除孤立上传会话目录: {item}")
                 deleted_count += 1
@@ -182,10 +293,61 @@ def cleanup_orphaned_upload_files():
                 print(f"❌ 无法删除目录 {item}: {e}")
 
     print(f"清理完成，共删除 {deleted_count} 个孤立文件/目录")
+def on_uploaded(filename):
+    """上传阶段上传成功后：更新任务状态，加入已转换列表，检查存储空间，并在后台预生成下载链接"""
+    record = task_registry.find_by_output(filename)
+    if record and record['state'] == 'uploading':
+        task_registry.transition(record['task_id'], 'done')
+    add_converted_file(filename)
+    manage_storage()
+    one_drive_client.prewarm_download_link(filename)
+
+upload_stage.uploaded_callbacks.append(on_uploaded)
+eviction_callbacks.append(result_cache.forget_output)
+
+def converted_output_exists(filename):
+    """输出位置（本地 / OneDrive / 上传队列）是否已有该文件名"""
+    return storage_index.get(filename) is not None or upload_stage.contains(filename) or \
+        os.path.exists(os.path.join(Config.CONVERTED_FOLDER, filename))
+
+def stat_converted_output(filename):
+    """
+    已转换文件的 (size, mtime)，不存在时返回 None（供结果缓存校验记录）。
+    OneDrive 模式只返回大小：已上传的从存储索引读取，还在上传队列中的读取本地文件。
+    """
+    if storage_mode() == 'onedrive':
+        entry = storage_index.get(filename)
+        if entry:
+            return entry[0], None
+        if upload_stage.contains(filename):
+            try:
+                return os.path.getsize(os.path.join(Config.CONVERTED_FOLDER, filename)), None
+            except OSError:
+                return None
+        return None
+    try:
+        stat = os.stat(os.path.join(Config.CONVERTED_FOLDER, filename))
+        return stat.st_size, stat.st_mtime
+    except OSError:
+        return None
+
+def reuse_cached_result(cached_name, input_path):
+    """
+    结果缓存命中：删除输入文件，直接沿用已有的输出文件名（本地和 OneDrive 模式相同）。
+    不复制文件，也不用硬链接：存储索引按文件名累计大小，多一个名字就会重复计算同一份数据。
+    :return: 最终的输出文件名
+    """
+    if os.path.exists(input_path):
+        try:
+            os.remove(input_path)
+        except Exception as e:
+            print(f"[警告] 删除源文件失败 {input_path}: {e}")
+    return cached_name
+
 def restore_converted_files_to_onedrive():
     """
     启动时检查本地 converted 文件夹中是否有未上传到 OneDrive 的文件，
-    并尝试上传（无限重试），上传成功后删除本地文件，加入 converted_files 列表。
+    交给上传阶段上传（上传成功后删除本地文件，加入 converted_files 列表）。
     """
     if not Config.USE_ONEDRIVE_STORAGE or not one_drive_client:
         print("OneDrive 未启用，跳过上传恢复")
@@ -202,7 +364,7 @@ def restore_converted_files_to_onedrive():
         print(f"获取 OneDrive 文件列表失败，将尝试上传所有本地文件: {e}")
         remote_files = []
 
-    uploaded_count = 0
+    submitted_count = 0
 
     if os.path.exists(Config.CONVERTED_FOLDER):
         for filename in os.listdir(Config.CONVERTED_FOLDER):
@@ -211,216 +373,302 @@ def restore_converted_files_to_onedrive():
             if not os.path.isfile(file_path) or not allowed_file(filename):
                 continue
 
-            # 如果该文件已存在于 OneDrive，跳过
+            # 如果该文件已存在于 OneDrive，或已在上传队列中，跳过
             if filename in remote_files:
                 print(f"文件已存在于 OneDrive，跳过: {filename}")
                 continue
+            if upload_stage.contains(filename):
+                continue
 
-            print(f"发现未上传文件，准备上传到 OneDrive: {filename}")
-
-            # ✅ 无限重试上传
-            attempt = 1
-            while True:
-                try:
-                    success, message = one_drive_client.upload_file(file_path, filename)
-                    if success:
-                        print(f"✅ 上传成功 [{attempt}次尝试]: {filename} - {message}")
-                        # 上传成功，删除本地文件
-                        os.remove(file_path)
-                        print(f"🗑️ 已删除本地文件: {file_path}")
-
-                        # 加入 converted_files（去重）
-                        with status_lock:
-                            if filename not in status_info['converted_files']:
-                                status_info['converted_files'].insert(0, filename)
-
-                        # ✅ 同步持久化状态
-                        state = load_persistent_state() or {}
-                        if 'converted_files' not in state:
-                            state['converted_files'] = []
-                        if filename not in state['converted_files']:
-                            state['converted_files'].insert(0, filename)
-                        save_persistent_state(state)
-
-                        uploaded_count += 1
-                        break  # 成功则跳出无限循环
-
-                    else:
-                        print(f"❌ 上传失败 [{attempt}次尝试]: {filename} - {message}")
-
-                except Exception as e:
-                    print(f"❌ 上传异常 [{attempt}次尝试]: {filename}, 错误: {str(e)}")
-
-                # ✅ 指数退避：最多等待 10 分钟（600 秒）
-                wait_time = 2 ** attempt
-                max_wait = 600  # 10 分钟
-                wait_time = min(wait_time, max_wait)
-
-                print(f"等待 {wait_time} 秒后重试... (按 Ctrl+C 可中断)")
-                try:
-                    time.sleep(wait_time)
-                except KeyboardInterrupt:
-                    print(f"\n⚠️ 用户中断上传尝试: {filename}")
-                    break  # 允许用户手动中断
-
-                attempt += 1
+            print(f"发现未上传文件，加入上传队列: {filename}")
+            upload_stage.submit(file_path, filename)
+            submitted_count += 1
 
-    print(f"恢复上传完成，成功上传 {uploaded_count} 个文件到 OneDrive")
+    print(f"恢复上传检查完成，{submitted_count} 个文件已加入上传队列")
 
 
 def initialize_converted_files():
-    """根据配置初始化 converted_files 列表"""
+    """
+    根据配置初始化 converted_files 列表。
+    同时全量扫描一次存储位置，建立 manage_storage 使用的存储索引。
+    """
     global status_info
 
     print("正在初始化已转换文件列表...")
+    onedrive_mode = Config.USE_ONEDRIVE_STORAGE and one_drive_client
+    location = 'OneDrive' if onedrive_mode else '本地'
 
-    if Config.USE_ONEDRIVE_STORAGE and one_drive_client:
-        # ✅ 从 OneDrive 获取文件列表
-        try:
-            file_items = one_drive_client.list_files_in_folder(Config.ONEDRIVE_FOLDER_PATH)
-            # 按 lastModifiedDateTime 降序排序（最新的在前）
-            sorted_items = sorted(
-                file_items,
-                key=lambda x: x['lastModifiedDateTime'],
-                reverse=True
-            )
-            remote_files = [item['name'] for item in sorted_items]
-            print(f"[OneDrive] 加载远程已转换文件 ({len(remote_files)} 个): {remote_files}")
-
-            # 更新内存状态
-            with status_lock:
-                status_info['converted_files'] = remote_files
-
-            # ✅ 同时更新持久化状态（如 JSON 文件）
-            state = load_persistent_state() or {}
-            state['converted_files'] = remote_files
-            save_persistent_state(state)
-
-        except Exception as e:
-            print(f"[OneDrive] 初始化 converted_files 时获取文件列表失败，将使用空列表: {e}")
+    # 先加载上次保存的索引，扫描失败时仍可据此淘汰旧文件
+    loaded = storage_index.load('onedrive' if onedrive_mode else 'local')
+    try:
+        reconcile_storage()
+    except Exception as e:
+        if not loaded:
+            print(f"[{location}] 初始化 converted_files 时获取文件列表失败，将使用空列表: {e}")
             with status_lock:
-                status_info['converted_files'] = []
+                status_info['converted_files'] = {}
+                status_events.publish({'type': 'converted_set', 'names': []})
+            return
+        print(f"[{location}] 获取文件列表失败，使用上次保存的存储索引: {e}")
+
+    # 按修改时间倒序排列（最新的在前）；本地模式只列出 converted/ 顶层文件
+    converted = [
+        name for name in storage_index.names_by_mtime(newest_first=True)
+        if (onedrive_mode or os.path.dirname(name) == '') and allowed_file(name)
+    ]
+    print(f"[{location}] 加载已转换文件 ({len(converted)} 个): {converted}")
+
+    # 更新内存状态，同时更新持久化状态
+    set_converted_files(converted)
+
+# 后台读取到视频实际时长后，写入状态日志（重启后不再重复读取）
+task_scheduler.duration_callbacks.append(
+    lambda task: state_store.queue_update(task['input_path'], estimated_duration=task['estimated_duration'],
+                                          duration_probed=True))
+
+def enqueue_task(task, uploaded_at=None):
+    """
+    登记任务并加入转换队列（任务表分配 task_id，调度器补全优先级等字段）。
+    先写入状态日志再放进调度器：放进去之后工作线程随时可能取出并 queue_remove，顺序反过来会留下已出队的记录
+    """
+    task_registry.create(task, uploaded_at)
+    task_scheduler.prepare(task)
+    state_store.queue_push(task)
+    task_scheduler.put(task)
+    tasks_enqueued.inc()
+    worker_wakeup_event.set()
+    return task['task_id']
+
+def batchable(task):
+    """能否与其他任务合并转换（BATCH_MAX_TASKS > 1 且输入不超过 BATCH_MAX_FILE_SIZE）"""
+    if Config.BATCH_MAX_TASKS <= 1:
+        return False
+    try:
+        return os.path.getsize(task['input_path']) <= Config.BATCH_MAX_FILE_SIZE
+    except OSError:
+        return False
 
+def next_admissible_tasks():
+    """
+    取下一批可以开始的任务（没有时返回空列表）。
+    - 停止时间段内不出队，任务留在队列中（不再在槽位里 sleep）
+    - 停止时间段开始前，只取预计能在剩余时间内完成的任务；
+      预计耗时超过整个空闲区间的任务永远放不下，不做限制，避免一直排不上
+    - 队首任务可以合并时，再从队首 BATCH_SCAN_DEPTH 个任务中取参数相同的小文件，一起用一次 iw3 转换；
+      整批的预计耗时和输出空间合计检查
+    - 服务关闭中不再取任务（调用方持有 task_control_lock）
+    """
+    if shutdown_event.is_set():
+        return []
+    gap = stop_schedule.gap()
+    if gap is None and stop_schedule.blocked_until():
+        return []
+    # 内存 / CPU / 转换目录的保留空间不足时不开始新任务；否则只取输出放得下的任务
+    rejection = resource_monitor.check_conversion()
+    if rejection is not None:
+        resource_monitor.set_conversion_block(rejection)
+        return []
+    available = resource_monitor.available_bytes(Config.CONVERTED_FOLDER)
+    margin = Config.STOP_WINDOW_MARGIN
+    too_large = []
+    reserved = {'seconds': 0.0, 'bytes': 0}  # 本批已取任务的预计耗时和输出空间
+
+    def admit(task, companion=False):
+        predicted = conversion_time_model.predict(task) if gap is not None else 0.0
+        needed = resource_monitor.output_bytes(task) if available is not None else 0
+        if gap is not None:
+            remaining, length = gap
+            if not (reserved['seconds'] + predicted <= remaining - margin
+                    or (not companion and predicted > length - margin)):
+                return False
+        if available is not None and reserved['bytes'] + needed > available:
+            if not companion:
+                too_large.append(needed)
+            return False
+        reserved['seconds'] += predicted
+        reserved['bytes'] += needed
+        return True
+
+    task = task_scheduler.pop(admit)
+    resource_monitor.set_conversion_block(
+        resource_monitor.disk_rejection(Config.CONVERTED_FOLDER, available, min(too_large))
+        if task is None and too_large else None)
+    if task is None:
+        return []
+    tasks = [task]
+    if batchable(task):
+        additional_args = task['additional_args']
+        tasks += task_scheduler.take(
+            lambda other: other['additional_args'] == additional_args and batchable(other) and admit(other, True),
+            Config.BATCH_MAX_TASKS - 1, Config.BATCH_SCAN_DEPTH)
+    return tasks
+
+def update_waiting_status():
+    """队列中有任务但因停止时间段无法开始时，在空闲状态中说明原因（只在变化时推送）"""
+    if task_scheduler.empty() or slot_pool.active_slots():
+        return
+    resume = stop_schedule.blocked_until()
+    if resume:
+        text = f"停止时间段，{resume.strftime('%m-%d %H:%M')} 后开始新任务"
+    elif resource_monitor.conversion_block:
+        text = f"资源不足，暂不开始新任务: {resource_monitor.conversion_block}"
     else:
-        # ❌ OneDrive 未启用，从本地 converted/ 文件夹读取
-        local_files = []
-        if os.path.exists(Config.CONVERTED_FOLDER):
-            for filename in os.listdir(Config.CONVERTED_FOLDER):
-                file_path = os.path.join(Config.CONVERTED_FOLDER, filename)
-                if os.path.isfile(file_path) and allowed_file(filename):
-                    local_files.append(filename)
-
-            # 按修改时间倒序排列
-            local_files.sort(
-                key=lambda x: os.path.getmtime(os.path.join(Config.CONVERTED_FOLDER, x)),
-                reverse=True
-            )
-            print(f"[本地] 加载已转换文件 ({len(local_files)} 个): {local_files}")
+        text = '距离停止时间段太近，排队中的任务预计无法在此之前完成'
+    with status_lock:
+        if status_info['current_status'] != text:
+            refresh_overall_status(text)
+
+def finish_task(slot, task, success, message, cached_name, output_name):
+    """按转换结果更新任务状态、已转换列表和存储空间，返回该任务的最终状态文字"""
+    # 注意：manage_storage 会持有 storage_lock 回调 remove_converted_file，不能在 status_lock 内调用
+    task_id = task['task_id']
+    input_path = task['input_path']
+    if success:
+        final_status = '转换完成' if not cached_name else '转换完成（复用已有结果）'
+        conversions.labels('cached' if cached_name else 'success').inc()
+        # OneDrive 模式下由上传阶段在上传成功后加入已转换列表（on_uploaded）
+        if storage_mode() == 'local':
+            task_registry.transition(task_id, 'done', message)
+            add_converted_file(output_name)
+            manage_storage()
+        elif cached_name:
+            # 复用的文件已在 OneDrive 上或正在由原任务上传
+            task_registry.transition(task_id, 'done', message)
+            if not upload_stage.contains(output_name):
+                add_converted_file(output_name)
+        else:
+            task_registry.transition(task_id, 'uploading', message)
+    else:
+        final_status = '任务已终止' if slot.terminated else f'转换失败: {message}'
+        task_registry.transition(task_id, 'cancelled' if slot.terminated else 'failed', message)
+        conversions.labels('cancelled' if slot.terminated else 'failed').inc()
+        # 删除原始上传文件（如果存在）
+        if os.path.exists(input_path):
+            try:
+                os.remove(input_path)
+                print(f"[清理] 转换失败，已删除原始文件: {input_path}")
+            except Exception as e:
+                print(f"[警告] 无法删除失败文件 {input_path}: {e}")
+        # ❌ 不再将文件加回 uploaded_files（彻底移除）
+    print(f" [槽位 {slot.slot_id}] 任务完成: {task['original_filename']}, 成功: {success}")
+    return final_status
 
-            with status_lock:
-                status_info['converted_files'] = local_files
-
-            # 更新持久化状态
-            state = load_persistent_state() or {}
-            state['converted_files'] = local_files
-            save_persistent_state(state)
-def save_queue_state():
-    """只保存队列中的任务到持久化状态"""
-    try:
-        # 提取队列中的所有任务
-        temp_queue = queue.Queue()
-        tasks = []
-        while not conversion_queue.empty():
-            task = conversion_queue.get()
-            tasks.append(task)
-            temp_queue.put(task)
-        
-        # 恢复原队列
-        while not temp_queue.empty():
-            conversion_queue.put(temp_queue.get())
-        
-        # 读取旧状态，只更新 queue
-        state = load_persistent_state() or {}
-        state['queue'] = tasks
-        save_persistent_state(state)
-    except Exception as e:
-        print(f"保存队列状态失败: {e}")
-def conversion_worker():
-    print(" conversion_worker 线程已启动，等待任务...")
+def conversion_worker(slot):
+    print(f" conversion_worker 线程已启动 (槽位 {slot.slot_id})，等待任务...")
     while True:
-        task = None
-
-        # === 关键：原子地取出任务并设置元数据 ===
+        # === 关键：原子地取出任务并设置槽位元数据 ===
         with task_control_lock:
-            if not status_info['processing'] and not conversion_queue.empty():
-                try:
-                    task = conversion_queue.get_nowait()
-                    # 设置状态
-                    status_info['processing'] = True
-                    status_info['current_file'] = task['original_filename']
-                    status_info['current_status'] = '正在转换'
-                    if task['original_filename'] in status_info['uploaded_files']:
-                        status_info['uploaded_files'].remove(task['original_filename'])
-                    # 设置当前任务元数据（用于终止）
-                    current_task_metadata['input_path'] = task['input_path']
-                    current_task_metadata['original_filename'] = task['original_filename']
-                    current_task_metadata['additional_args'] = task.get('additional_args', '')
-                except queue.Empty:
-                    pass
+            tasks = next_admissible_tasks()
+            if tasks:
+                with slot_pool.lock:
+                    slot.assign(tasks[0], batch=tasks[1:])
+                # 设置状态
+                for task in tasks:
+                    state_store.queue_remove(task['input_path'])
+                    task_registry.transition(task['task_id'], 'converting')
+                    queue_wait_seconds.observe(max(0.0, time.time() - task['enqueued_at']))
+                with status_lock:
+                    refresh_overall_status()
 
-        if task is None:
+        if not tasks:
+            update_waiting_status()
             worker_wakeup_event.wait(timeout=0.5)
             worker_wakeup_event.clear()
             continue
 
-        print(f" 开始处理任务: {task['original_filename']}")
-        # 注意：不再在这里设置 current_task_metadata！已在上面设置
-
-        input_path = task['input_path']
-        original_filename = task['original_filename']
-        output_path = os.path.join(Config.CONVERTED_FOLDER, original_filename)
-        additional_args = task['additional_args']
-
-        success, message = convert_file(input_path, output_path, additional_args)
+        print(f" [槽位 {slot.slot_id}] 开始处理任务: {', '.join(task['original_filename'] for task in tasks)}")
+
+        results = []  # (task, success, message, cached_name, output_name)
+        pending = []  # 需要实际转换的 (task, output_path)
+        for task in tasks:
+            # 同名文件不覆盖已有输出，也不与其他任务冲突（自动加序号）
+            output_filename = task_registry.reserve_output(task['task_id'], task['original_filename'],
+                                                           converted_output_exists)
+            task['output_filename'] = output_filename
+            output_path = os.path.join(Config.CONVERTED_FOLDER, output_filename)
+
+            # 相同内容 + 相同参数已经转换过时直接复用结果
+            cached_name = result_cache.lookup(task.get('content_hash'), task['additional_args'], stat_converted_output)
+            if not cached_name:
+                pending.append((task, output_path))
+                continue
+            with log_context(task=task['original_filename']):
+                try:
+                    output_name = reuse_cached_result(cached_name, task['input_path'])
+                    task_registry.set_output(task['task_id'], output_name)
+                    success, message = True, f"复用已有转换结果: {cached_name}"
+                    print(f"[结果缓存] 命中，跳过转换: {task['original_filename']} -> {output_name}")
+                except Exception as e:
+                    output_name, success, message = output_filename, False, f"复用转换结果失败: {e}"
+            results.append((task, success, message, cached_name, output_name))
+
+        if pending:
+            started = time.monotonic()
+            if len(pending) == 1:
+                task, output_path = pending[0]
+                with log_context(task=task['original_filename']):
+                    outcome = {task['task_id']: convert_file(task['input_path'], output_path,
+                                                             task['additional_args'], slot=slot) + (output_path,)}
+            else:
+                with log_context(task=f"批量 {len(pending)} 个文件"):
+                    # iw3 输出的格式与源文件不同时，按实际扩展名重新分配输出文件名
+                    outcome = convert_batch([(task['task_id'], task['input_path'], output_path)
+                                             for task, output_path in pending],
+                                            pending[0][0]['additional_args'], slot=slot,
+                                            output_path_for=lambda task_id, ext: os.path.join(
+                                                Config.CONVERTED_FOLDER,
+                                                task_registry.change_output_extension(task_id, ext, converted_output_exists)))
+            elapsed = time.monotonic() - started
+            total_duration = sum(task.get('estimated_duration') or 0 for task, _ in pending)
+            for task, output_path in pending:
+                success, message, output_path = outcome[task['task_id']]
+                task['output_filename'] = os.path.basename(output_path)
+                if success:
+                    # 批量转换按预计时长分摊实际耗时
+                    share = (task.get('estimated_duration') or 0) / total_duration if total_duration else 1 / len(pending)
+                    conversion_time_model.observe(task, elapsed * share)
+                    stat = stat_converted_output(task['output_filename'])
+                    if stat:
+                        result_cache.put(task.get('content_hash'), task['additional_args'], task['output_filename'], *stat)
+                results.append((task, success, message, None, task['output_filename']))
+
+        # 服务正在关闭时，槽位中的任务已由 save_current_task_if_processing 放回队列，随后结束的常驻进程会让转换失败：
+        # 失败的任务保持 queued，不删除输入文件、不标记失败；已经成功的任务从放回的队列中移除，照常完成。
+        # 否则标记 finishing，之后开始的关闭不再把这些任务放回队列
+        with task_control_lock:
+            requeued = shutdown_event.is_set()
+            if not requeued:
+                with slot_pool.lock:
+                    slot.finishing = True
+        if requeued:
+            for task, success, *_ in results:
+                if success:
+                    task_scheduler.remove(task['task_id'])
+                    state_store.queue_remove(task['input_path'])
+                    task_registry.transition(task['task_id'], 'converting', '转换在服务关闭前已完成')
+            results = [result for result in results if result[1]]
+
+        # 处理完成后，逐个更新任务状态，再释放槽位
+        final_statuses = [finish_task(slot, *result) for result in results]
+        if requeued:
+            final_status = '已中断'
+        elif len(final_statuses) == 1:
+            final_status = final_statuses[0]
+        elif slot.terminated:
+            final_status = '任务已终止'
+        else:
+            succeeded = sum(1 for _, success, *_ in results if success)
+            final_status = f'批量转换完成: {succeeded}/{len(results)} 个成功'
 
-        # 处理完成后，清除 processing 状态（不需要清除 metadata，因为 terminate 只在 processing=True 时有效）
+        # 注意锁顺序：不要在持有 status_lock 时再获取 slot_pool.lock
+        with slot_pool.lock:
+            slot.release(final_status)
         with status_lock:
-            if success:
-                status_info['current_status'] = '转换完成'
-                if original_filename not in status_info['converted_files']:
-                    status_info['converted_files'].insert(0, original_filename)
-                manage_storage()
-            else:
-                status_info['current_status'] = f'转换失败: {message}'
-                # 删除原始上传文件（如果存在）
-                if os.path.exists(input_path):
-                    try:
-                        os.remove(input_path)
-                        print(f"[清理] 转换失败，已删除原始文件: {input_path}")
-                    except Exception as e:
-                        print(f"[警告] 无法删除失败文件 {input_path}: {e}")
-                # ❌ 不再将文件加回 uploaded_files（彻底移除）
-            status_info['processing'] = False
-            status_info['current_file'] = None
-
-        # 清除当前任务元数据（可选，但建议做）
-        with current_task_lock:
-            current_task_metadata['input_path'] = None
-            current_task_metadata['original_filename'] = None
-
-        conversion_queue.task_done()
-        print(f" 任务完成: {original_filename}, 成功: {success}")
-        save_queue_state()
-        # 保存状态...
-        state = load_persistent_state() or {}
-        state.update({
-            'processing': False,
-            'current_file': None,
-            'current_status': status_info['current_status'],
-            'uploaded_files': status_info['uploaded_files'].copy(),
-            'converted_files': status_info['converted_files'].copy()
-        })
-        save_persistent_state(state)
+            refresh_overall_status(final_status)
+
+        # 保存状态...（关闭时保留 save_current_task_if_processing 写入的“已中断”）
+        if not requeued:
+            state_store.set_status(final_status)
 @app.route('/upload_direct', methods=['POST'])
 def upload_direct():
     data = request.get_json()
@@ -444,51 +692,98 @@ def upload_direct():
     if ext not in ['mp4', 'avi', 'mkv']:
         return jsonify({"error": f"不支持的文件格式: .{ext}，仅支持 .mp4, .avi, .mkv"}), 400
 
-    # 构建下载路径...
-    temp_download_path = os.path.join(Config.UPLOAD_FOLDER, f"direct_{os.getpid()}_{filename}")
+    # 大小要等下载线程探测后才知道，这里先确认保留空间和内存
+    rejection = resource_monitor.check_download()
+    if rejection is not None:
+        body, code, headers = rejection.response()
+        return jsonify(body), code, headers
 
-    def download_and_enqueue():
-        try:
-            # 下载文件（流式下载，避免内存溢出）
-            with requests.get(url, stream=True, timeout=30) as r:
-                r.raise_for_status()
-                with open(temp_download_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-
-            # 下载成功，加入转换队列
-            task = {
-                'input_path': temp_download_path,
-                'original_filename': filename,          # ✅ 必须添加
-                'additional_args': additional_args      # ✅ 保持一致
-            }
-            conversion_queue.put(task)
-            print(f"[直链上传] 已加入队列: {filename}")
-            save_queue_state()
+    # 交给下载管理器（有并发上限、分段并行下载、失败续传；相同 URL 正在下载时不重复下载）
+    job, created = download_manager.submit(url, filename, additional_args)
+    if not created:
+        return jsonify({"message": "该链接正在下载中", "filename": job.filename, "download_id": job.job_id}), 200
 
-        except Exception as e:
-            print(f"[直链上传] 下载失败 {url}: {str(e)}")
-            # 可选：记录失败任务到数据库或日志
-            if os.path.exists(temp_download_path):
-                os.remove(temp_download_path)
+    return jsonify({"message": "直链任务已接收，正在后台下载", "filename": filename, "download_id": job.job_id}), 200
+
+def on_direct_downloaded(job):
+    """直链下载完成，加入转换队列"""
+    task = {
+        'input_path': job.final_path,
+        'original_filename': job.filename,          # ✅ 必须添加
+        'additional_args': job.additional_args,     # ✅ 保持一致
+        'content_hash': job.content_hash
+    }
+    enqueue_task(task)
+    print(f"[直链上传] 已加入队列: {job.filename}")
+
+download_manager.completed_callbacks.append(on_direct_downloaded)
+
+def create_upload_session(original_filename, total_size, chunk_size, total_chunks):
+    """
+    校验参数并创建上传会话
+    :return: (session, error_response)
+    """
+    if not allowed_file(original_filename):
+        return None, (jsonify({'error': '不支持的文件格式。只允许 mp4, avi, mkv 格式。'}), 400)
+    if total_size <= 0 or chunk_size <= 0 or (total_size + chunk_size - 1) // chunk_size != total_chunks:
+        return None, (jsonify({'error': 'total_size、chunk_size 与 total_chunks 不一致'}), 400)
+    if total_size > Config.MAX_CONTENT_LENGTH:
+        return None, (jsonify({'error': f'文件过大，最大允许 {Config.MAX_CONTENT_LENGTH // (1024 * 1024)}MB'}), 413)
+    rejection = resource_monitor.check_upload(total_size)
+    if rejection is not None:
+        body, code, headers = rejection.response()
+        return None, (jsonify(body), code, headers)
+
+    session_id = f"{int(time.time())}_{os.urandom(4).hex()}"
+    try:
+        return upload_sessions.create(session_id, original_filename, total_size, chunk_size, total_chunks), None
+    except Exception as e:
+        return None, (jsonify({'error': f'创建上传文件失败: {str(e)}'}), 500)
 
-    # 异步下载，不阻塞响应
-    thread = threading.Thread(target=download_and_enqueue)
-    thread.start()
+def upload_session_response(session):
+    """上传会话信息 + 服务端建议的并发数，供前端并行续传"""
+    data = session.to_dict()
+    data['max_parallel'] = Config.UPLOAD_MAX_PARALLEL_CHUNKS
+    return data
+
+@app.route('/upload/init', methods=['POST'])
+def upload_init():
+    """
+    创建分块上传会话，由服务端决定分块大小。
+    请求 JSON: {filename, total_size}
+    返回: session_id、chunk_size、total_chunks、max_parallel（同时上传的最大块数）和缺失区间
+    之后各块可以按任意顺序、并发地 POST 到 /upload。
+    """
+    data = request.get_json(silent=True) or {}
+    original_filename = data.get('filename')
+    try:
+        total_size = int(data.get('total_size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'total_size 必须是整数'}), 400
+    if not original_filename:
+        return jsonify({'error': '缺少 filename'}), 400
+
+    chunk_size = Config.UPLOAD_CHUNK_SIZE
+    total_chunks = max(1, (total_size + chunk_size - 1) // chunk_size)
+    session, error = create_upload_session(original_filename, total_size, chunk_size, total_chunks)
+    if error:
+        return error
+    return jsonify(upload_session_response(session)), 200
 
-    return jsonify({"message": "直链任务已接收，正在后台下载", "filename": filename}), 200
 # --- ✅ 优化 1: 启用分块上传 ---
 @app.route('/upload', methods=['POST'])
 def upload_chunk():
     """
-    处理分块上传。
+    处理分块上传。每个块直接写入按总大小预分配的文件，不再单独保存块文件和最后合并。
+    各块可以乱序、并发上传，完成判定在会话锁内进行，只会入队一次。
     前端需要发送:
         - chunk: 文件块数据 (POST body)
         - filename: 原始文件名
         - chunk_index: 当前块的索引 (从0开始)
         - total_chunks: 总块数
-        - session_id: (可选) 会话ID，首次上传时留空，服务端返回
+        - total_size: 文件总大小（字节），首个请求必须提供，用于预分配
+        - chunk_size: 分块大小（字节，最后一块可以更小），首个请求必须提供
+        - session_id: 会话ID，由 /upload/init 返回；为空时由首个分块创建会话（此时不能并发上传）
     """
     if 'chunk' not in request.files:
         return jsonify({'error': '没有上传文件块'}), 400
@@ -511,42 +806,64 @@ def upload_chunk():
     if not allowed_file(original_filename):
         return jsonify({'error': '不支持的文件格式。只允许 mp4, avi, mkv 格式。'}), 400
 
-    # 如果没有 session_id，说明是第一个分块，生成新的
-    if not session_id:
-        session_id = f"{int(time.time())}_{os.urandom(4).hex()}"
-        new_session = True
+    if session_id:
+        session = upload_sessions.get(session_id)
+        if session is None:
+            finished_task_id = upload_sessions.finished_task(session_id)
+            if finished_task_id is not None:
+                # 会话已完成（完成后迟到或重试的分块），幂等返回成功
+                return jsonify({
+                    'message': '上传已完成，已加入转换队列',
+                    'filename': original_filename,
+                    'task_id': finished_task_id,
+                    'session_id': session_id
+                }), 200
+            return jsonify({'error': f'上传会话不存在或已过期: {session_id}'}), 404
     else:
-        new_session = False
+        # 没有 session_id，说明是第一个分块，按声明的总大小创建会话并预分配文件
+        try:
+            total_size = int(request.form.get('total_size', ''))
+            chunk_size = int(request.form.get('chunk_size', ''))
+        except ValueError:
+            return jsonify({'error': '首个分块必须提供整数 total_size 和 chunk_size'}), 400
 
-    # 创建或使用已有临时目录
-    temp_dir = os.path.join(Config.UPLOAD_FOLDER, f"_upload_{session_id}")
-    os.makedirs(temp_dir, exist_ok=True)
+        session, error = create_upload_session(original_filename, total_size, chunk_size, total_chunks)
+        if error:
+            return error
+        session_id = session.session_id
 
-    # 保存当前分块
-    chunk_filename = f"chunk_{chunk_index:04d}"
-    chunk_path = os.path.join(temp_dir, chunk_filename)
-    file.save(chunk_path)  # 保存当前块
+    if total_chunks != session.total_chunks:
+        return jsonify({'error': 'total_chunks 与上传会话不一致'}), 400
 
-    # 检查是否所有块都已上传
-    uploaded_chunks = len([f for f in os.listdir(temp_dir) if f.startswith('chunk_')])
-    
-    if uploaded_chunks == total_chunks:
-        # 所有块都已上传，合并文件
+    # 把当前分块写入预分配文件的对应偏移
+    started = time.perf_counter()
+    try:
+        ok, message = session.write_chunk(chunk_index, file.stream)
+    except Exception as e:
+        upload_chunks.labels('error').inc()
+        return jsonify({'error': f'写入文件块失败: {str(e)}'}), 500
+    if not ok:
+        upload_chunks.labels('rejected').inc()
+        return jsonify({'error': message}), 400
+    upload_chunk_seconds.observe(time.perf_counter() - started)
+    upload_chunks.labels('ok' if message != 'duplicate' else 'duplicate').inc()
+    if message != 'duplicate':
+        upload_bytes.inc(session.expected_chunk_length(chunk_index))
+
+    if session.mark_completed():
+        # 所有块都已上传：内容哈希已随上传增量算完，重命名即可得到完整文件
+        content_hash = session.content_hash()
         stored_filename = f"upload_{int(time.time() * 1000)}_{os.urandom(4).hex()}{os.path.splitext(original_filename)[1].lower()}"
         final_path = os.path.join(Config.UPLOAD_FOLDER, stored_filename)
-        
+
         try:
-            with open(final_path, 'wb') as final_file:
-                for i in range(total_chunks):
-                    chunk_file = os.path.join(temp_dir, f"chunk_{i:04d}")
-                    if os.path.exists(chunk_file):
-                        with open(chunk_file, 'rb') as cf:
-                            final_file.write(cf.read())
-                        os.remove(chunk_file) # 删除块文件
-            # 合并成功后，删除临时目录
-            os.rmdir(temp_dir)
+            with upload_finalize_seconds.time():
+                session.finalize(final_path)
         except Exception as e:
-            return jsonify({'error': f'合并文件失败: {str(e)}'}), 500
+            session.discard()
+            return jsonify({'error': f'保存文件失败: {str(e)}'}), 500
+        finally:
+            upload_sessions.remove(session_id)
 
         # 将任务添加到转换队列
         additional_args = request.form.get('additional_args', '')
@@ -554,29 +871,34 @@ def upload_chunk():
             'input_path': final_path,
             'original_filename': original_filename,
             'stored_filename': stored_filename,
-            'additional_args': additional_args
+            'additional_args': additional_args,
+            'content_hash': content_hash
         }
-        conversion_queue.put(task)
-        save_queue_state()
-        # 更新状态 (使用锁)
-        with status_lock:
-            if original_filename not in status_info['uploaded_files']:
-                status_info['uploaded_files'].insert(0, original_filename)
+        task_id = enqueue_task(task)
+        upload_sessions.mark_finished(session_id, task_id)
 
         # 返回 session_id 和成功信息
         return jsonify({
-            'message': '上传并合并完成，已加入转换队列',
+            'message': '上传完成，已加入转换队列',
             'filename': original_filename,
+            'task_id': task_id,
             'session_id': session_id  # 返回 session_id，便于前端知道是哪个上传
         }), 200
     else:
         # 告诉前端继续上传
         return jsonify({
             'message': f'块 {chunk_index + 1}/{total_chunks} 上传成功',
-            'uploaded_chunks': uploaded_chunks,
+            'uploaded_chunks': session.received_count,
             'total_chunks': total_chunks,
             'session_id': session_id  # ✅ 关键：返回 session_id，后续请求必须带上
         }), 200
+@app.route('/api/upload/<session_id>', methods=['GET'])
+def upload_session_status(session_id):
+    """查询上传会话已收到/缺失的分块，用于刷新页面或断网后续传"""
+    session = upload_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': f'上传会话不存在或已过期: {session_id}'}), 404
+    return jsonify(upload_session_response(session))
 # --- ✅ 优化 2: 启用分块/流式下载 ---
 @app.route('/download/<path:filename>')
 def download_converted(filename):
@@ -616,45 +938,92 @@ def index():
         return redirect(url_for('index'))
 
     return render_template('index.html', 
-                         status_info=status_info,
+                         status_info=status_snapshot(),
                          additional_args=request.form.get('additional_args', ''))
 
+def cancel_queued_task(task_id):
+    """从队列中删除尚未开始的任务及其输入文件，任务不在队列中时返回 False"""
+    task = task_scheduler.remove(task_id)
+    if task is None:
+        return False
+    try:
+        os.remove(task['input_path'])
+    except FileNotFoundError:
+        pass  # 已被清理
+    except OSError as e:
+        print(f"[警告] 删除排队文件失败 {task['input_path']}: {e}")
+    state_store.queue_remove(task['input_path'])
+    task_registry.transition(task_id, 'cancelled', '已从队列删除')
+    return True
+
+@app.route('/delete/task/<task_id>')
+def delete_task(task_id):
+    cancel_queued_task(task_id)
+    return redirect(url_for('index'))
+
 @app.route('/delete/uploaded/<path:filename>')
 def delete_uploaded(filename):
-    task_to_remove = None
-    with status_lock:
-        for task in list(conversion_queue.queue):
-            if task['original_filename'] == filename:
-                task_to_remove = task
-                break
-    
-    if task_to_remove:
-        # 从队列移除
-        temp_queue = queue.Queue()
-        while not conversion_queue.empty():
-            item = conversion_queue.get()
-            if item != task_to_remove:
-                temp_queue.put(item)
-        while not temp_queue.empty():
-            conversion_queue.put(temp_queue.get())
-        
-        # 删除文件
-        if os.path.exists(task_to_remove['input_path']):
-            os.remove(task_to_remove['input_path'])
-        
-        save_queue_state()  # 队列状态已保存
-    
-    # 更新 uploaded_files 并持久化
-    with status_lock:
-        if filename in status_info['uploaded_files']:
-            status_info['uploaded_files'].remove(filename)
-            # ✅ 关键：保存整个状态，包括 updated uploaded_files
-            state = load_persistent_state() or {}
-            state['uploaded_files'] = status_info['uploaded_files'].copy()
-            save_persistent_state(state)
-            
+    """按文件名删除排队中的任务（旧接口，同名任务只删除一个；新代码请用 /delete/task/<task_id>）"""
+    task = task_scheduler.find(filename)
+    if task:
+        cancel_queued_task(task['task_id'])
     return redirect(url_for('index'))
 
+# === 任务表：按 ID 查询 / 取消 ===
+@app.route('/api/tasks', methods=['GET'])
+def list_tasks():
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify({'tasks': task_registry.snapshot(limit)})
+
+@app.route('/api/tasks/<task_id>', methods=['GET'])
+def get_task(task_id):
+    record = task_registry.get(task_id)
+    if record is None:
+        return jsonify({"error": f"任务不存在: {task_id}"}), 404
+    return jsonify(record)
+
+@app.route('/api/tasks/<task_id>', methods=['DELETE'])
+def cancel_task(task_id):
+    if cancel_queued_task(task_id):
+        return jsonify({"message": "已从队列删除", "task_id": task_id})
+    record = task_registry.get(task_id)
+    if record is None:
+        return jsonify({"error": f"任务不存在: {task_id}"}), 404
+    if record['state'] == 'converting':
+        return jsonify({"error": "任务正在转换，请使用 /api/terminate 终止"}), 409
+    return jsonify({"error": f"任务已结束: {record['state']}"}), 409
+
+# === 转换队列：查看 / 调整顺序 / 修改优先级 ===
+@app.route('/api/queue', methods=['GET'])
+def get_queue():
+    return jsonify({'tasks': task_scheduler.snapshot()})
+
+@app.route('/api/queue/move', methods=['POST'])
+def move_queued_task():
+    data = request.get_json(silent=True) or {}
+    direction = data.get('direction')
+    if direction not in ('up', 'down', 'top', 'bottom'):
+        return jsonify({"error": "direction 必须是 up / down / top / bottom"}), 400
+    changed = task_scheduler.move(data.get('task_id'), direction)
+    if changed is None:
+        return jsonify({"error": "任务不在队列中"}), 404
+    for task in changed:
+        state_store.queue_update(task['input_path'], sort_adjust=task['sort_adjust'])
+    return jsonify({'tasks': task_scheduler.snapshot()})
+
+@app.route('/api/queue/priority', methods=['POST'])
+def set_queued_task_priority():
+    data = request.get_json(silent=True) or {}
+    try:
+        priority = int(data.get('priority'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "priority 必须是整数"}), 400
+    task = task_scheduler.set_priority(data.get('task_id'), priority)
+    if task is None:
+        return jsonify({"error": "任务不在队列中"}), 404
+    state_store.queue_update(task['input_path'], priority=task['priority'])
+    return jsonify({'tasks': task_scheduler.snapshot()})
+
 @app.route('/delete/converted/<path:filename>')
 def delete_converted(filename):
     safe_filename = os.path.basename(filename) # 防止路径遍历攻击
@@ -678,159 +1047,213 @@ def delete_converted(filename):
             else:
                 print(f"[删除] 本地文件不存在，跳过: {file_path}")
 
-        # ✅ 无论哪种模式，都需要从状态信息中移除
-        with status_lock:
-            if safe_filename in status_info['converted_files']:
-                status_info['converted_files'].remove(safe_filename)
+        # ✅ 无论哪种模式，都需要从状态信息、存储索引和结果缓存中移除
+        storage_index.remove(safe_filename)
+        result_cache.forget_output(safe_filename)
+        remove_converted_file(safe_filename)
 
     except Exception as e:
         print(f"[删除] 操作失败 {safe_filename}: {str(e)}")
         # 可以选择记录错误，但不中断流程
 
     return redirect(url_for('index'))
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 文本格式的指标（上传、队列、转换、OneDrive、存储管理）"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/status', methods=['GET'])
 def api_status():
-    # 使用 .get() 防止键不存在时报错，提供默认值
-    return jsonify({
-        'current_status': status_info.get('current_status', 'idle'),
-        'current_file': status_info.get('current_file', ''),
-        'uploaded_files': status_info.get('uploaded_files', []),
-        'converted_files': status_info.get('converted_files', [])
-    })
-# === 新增：暂停转换 ===
-@app.route('/api/pause', methods=['POST'])
-def pause_conversion():
-    with conversion_pid_lock:
-        pid = current_module.current_conversion_pid
+    return jsonify(status_snapshot())
+
+def format_sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/api/events', methods=['GET'])
+def api_events():
+    """
+    Server-Sent Events 状态推送。
+    连接时（或客户端版本过旧时）先发送一次 snapshot，之后只推送增量 change；
+    没有变更时每 SSE_KEEPALIVE 秒发送一次注释保持连接。
+    断线重连时浏览器会带上 Last-Event-ID，只补发缺失的变更。
+    """
+    global sse_connections
+    try:
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('since', -1))
+    except ValueError:
+        since = -1
 
-        if pid is None:
-            return jsonify({"error": "当前没有正在运行的转换任务"}), 400
+    # 长连接会一直占用工作线程，限制数量，避免占满线程池；被拒绝的页面改为轮询 /api/status
+    limit = sse_connection_limit()
+    with sse_connections_lock:
+        if limit is not None and sse_connections >= limit:
+            return jsonify({"error": "状态推送连接数已达上限，请使用 /api/status 轮询"}), 503, {'Retry-After': '30'}
+        sse_connections += 1
 
+    def stream():
+        global sse_connections
         try:
-            parent = psutil.Process(pid)
-            if not parent.is_running():
-                current_module.current_conversion_pid = None
-                return jsonify({"error": "转换进程已结束或不存在"}), 400
+            version = since
+            changes = status_events.changes_since(version) if version >= 0 else None
+            while True:
+                if changes is None:
+                    snapshot = status_snapshot()
+                    version = snapshot['version']
+                    yield format_sse('snapshot', snapshot, version)
+                else:
+                    for change_version, change in changes:
+                        version = change_version
+                        yield format_sse('change', change, change_version)
+                if status_events.wait(version, timeout=SSE_KEEPALIVE) == version:
+                    yield ': keepalive\n\n'
+                changes = status_events.changes_since(version)
+        finally:
+            with sse_connections_lock:
+                sse_connections -= 1
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
-            # ✅ 获取父进程 + 所有子进程（递归）
-            processes_to_suspend = [parent] + parent.children(recursive=True)
-            pssuspend_path = os.path.join(os.path.dirname(__file__), 'pssuspend.exe')
-            if not os.path.isfile(pssuspend_path):
-                return jsonify({"error": f"pssuspend.exe 未找到: {pssuspend_path}"}), 500
+@app.route('/api/logs', methods=['GET'])
+def api_logs():
+    """
+    增量读取最近的日志记录。
+    参数: since=上次返回的 last_seq（默认 0），limit=最多返回条数，task=只看某个任务的日志
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', 500)), 5000)
+    except ValueError:
+        return jsonify({"error": "since 和 limit 必须是整数"}), 400
+    records, last_seq = log_sink.since(since, limit, request.args.get('task'))
+    return jsonify({
+        'records': records,
+        'last_seq': records[-1]['seq'] if records else last_seq,
+        'dropped': log_sink.dropped
+    })
 
-            success_count = 0
-            for proc in processes_to_suspend:
-                try:
-                    # 检查进程是否还活着
-                    if not proc.is_running():
-                        continue
-                    # 执行暂停
-                    result = subprocess.run(
-                        [pssuspend_path, str(proc.pid)],
-                        capture_output=True,
-                        text=True,
-                        timeout=10
-                    )
-                    if result.returncode == 0:
-                        print(f"[暂停] 成功暂停进程 {proc.pid} ({proc.name()})")
-                        success_count += 1
-                    else:
-                        error_msg = result.stderr.strip() or result.stdout.strip()
-                        print(f"[警告] 暂停进程 {proc.pid} 失败: {error_msg}")
-                except Exception as e:
-                    print(f"[警告] 无法暂停进程 {proc.pid}: {e}")
+def resolve_target_slot():
+    """
+    根据请求中的 slot_id、task_id 或 filename 找到要操作的槽位。
+    两者都未提供时，只有一个任务在运行才允许省略（兼容旧客户端）。
+    :return: (slot, error_message)
+    """
+    data = request.get_json(silent=True) or {}
+    slot_id = data.get('slot_id', request.args.get('slot_id'))
+    task_id = data.get('task_id', request.args.get('task_id'))
+    filename = data.get('filename', request.args.get('filename'))
+
+    if slot_id is not None and slot_id != '':
+        slot = slot_pool.get(slot_id)
+        if slot is None:
+            return None, f"槽位不存在: {slot_id}"
+        return slot, None
+    if task_id:
+        slot = slot_pool.find_by_task(task_id)
+        if slot is None:
+            return None, f"任务不在转换中: {task_id}"
+        return slot, None
+    if filename:
+        slot = slot_pool.find_by_file(filename)
+        if slot is None:
+            return None, f"没有正在转换的任务: {filename}"
+        return slot, None
+
+    active = slot_pool.active_slots()
+    if len(active) == 1:
+        return active[0], None
+    if not active:
+        return None, "当前没有正在运行的转换任务"
+    return None, "有多个任务正在运行，请指定 slot_id 或 filename"
+
+def suspend_slot_processes(slot, resume=False):
+    """暂停/恢复槽位中的 iw3 进程树（方式由 PROCESS_CONTROL_BACKEND 决定），返回 (响应体, HTTP 状态码)"""
+    action = '恢复' if resume else '暂停'
+    with slot_pool.lock:
+        pid = slot.pid
 
-            if success_count > 0:
-                with status_lock:
-                    status_info['current_status'] = '已暂停'
-                return jsonify({"message": f"已暂停 {success_count} 个进程"}), 200
-            else:
-                return jsonify({"error": "未能暂停任何进程"}), 500
+        if pid is None:
+            return {"error": "当前没有被暂停的转换任务" if resume else "当前没有正在运行的转换任务"}, 400
 
+        try:
+            if not psutil.Process(pid).is_running():
+                raise psutil.NoSuchProcess(pid)
         except psutil.NoSuchProcess:
-            current_module.current_conversion_pid = None
-            return jsonify({"error": "转换进程已结束或不存在"}), 400
+            slot.pid = None
+            return {"error": "转换进程已结束或不存在"}, 400
+
+        started = time.perf_counter()
+        try:
+            target = process_control.resume(pid) if resume else process_control.suspend(pid)
+        except ProcessControlError as e:
+            return {"error": f"{action}失败: {e}"}, 500
         except Exception as e:
-            return jsonify({"error": f"暂停异常: {str(e)}"}), 500
+            return {"error": f"{action}异常: {str(e)}"}, 500
+        elapsed = time.perf_counter() - started
+        process_control_seconds.labels('resume' if resume else 'suspend').observe(elapsed)
+
+        slot.status = '正在转换' if resume else '已暂停'
+        print(f"[{action}] 已{action}{target}（{process_control.name}，{elapsed * 1000:.1f} ms）")
+        return {
+            "message": f"已{action}{target}",
+            "slot_id": slot.slot_id,
+            "backend": process_control.name,
+            "elapsed_ms": round(elapsed * 1000, 1)
+        }, 200
+
+# === 新增：暂停转换 ===
+@app.route('/api/pause', methods=['POST'])
+def pause_conversion():
+    slot, error = resolve_target_slot()
+    if slot is None:
+        return jsonify({"error": error}), 400
+
+    body, code = suspend_slot_processes(slot, resume=False)
+    with status_lock:
+        refresh_overall_status()
+    return jsonify(body), code
 
 
 # === 恢复转换 ===
 @app.route('/api/resume', methods=['POST'])
 def resume_conversion():
-    with conversion_pid_lock:
-        pid = current_module.current_conversion_pid
-
-        if pid is None:
-            return jsonify({"error": "当前没有被暂停的转换任务"}), 400
-
-        try:
-            parent = psutil.Process(pid)
-            if not parent.is_running():
-                current_module.current_conversion_pid = None
-                return jsonify({"error": "转换进程已结束或不存在"}), 400
-
-            # ✅ 获取父进程 + 所有子进程（递归）
-            processes_to_resume = [parent] + parent.children(recursive=True)
-            pssuspend_path = os.path.join(os.path.dirname(__file__), 'pssuspend.exe')
-            if not os.path.isfile(pssuspend_path):
-                return jsonify({"error": f"pssuspend.exe 未找到: {pssuspend_path}"}), 500
-
-            success_count = 0
-            for proc in processes_to_resume:
-                try:
-                    if not proc.is_running():
-                        continue
-                    # 执行恢复
-                    result = subprocess.run(
-                        [pssuspend_path, '-r', str(proc.pid)],
-                        capture_output=True,
-                        text=True,
-                        timeout=10
-                    )
-                    if result.returncode == 0:
-                        print(f"[恢复] 成功恢复进程 {proc.pid} ({proc.name()})")
-                        success_count += 1
-                    else:
-                        error_msg = result.stderr.strip() or result.stdout.strip()
-                        print(f"[警告] 恢复进程 {proc.pid} 失败: {error_msg}")
-                except Exception as e:
-                    print(f"[警告] 无法恢复进程 {proc.pid}: {e}")
+    slot, error = resolve_target_slot()
+    if slot is None:
+        return jsonify({"error": error}), 400
 
-            if success_count > 0:
-                with status_lock:
-                    status_info['current_status'] = '正在转换'
-                return jsonify({"message": f"已恢复 {success_count} 个进程"}), 200
-            else:
-                return jsonify({"error": "未能恢复任何进程"}), 500
-
-        except psutil.NoSuchProcess:
-            current_module.current_conversion_pid = None
-            return jsonify({"error": "转换进程已结束或不存在"}), 400
-        except Exception as e:
-            return jsonify({"error": f"恢复异常: {str(e)}"}), 500
-# === 新增：终止当前转换任务 ===
+    body, code = suspend_slot_processes(slot, resume=True)
+    with status_lock:
+        refresh_overall_status()
+    return jsonify(body), code
+# === 新增：终止指定转换任务 ===
 @app.route('/api/terminate', methods=['POST'])
 def terminate_conversion():
     # 先检查是否真的有任务在运行
-    with status_lock:
-        if not status_info['processing']:
-            return jsonify({"error": "当前没有正在运行的转换任务"}), 400
+    slot, error = resolve_target_slot()
+    if slot is None:
+        return jsonify({"error": error}), 400
 
     # ✅ 关键：在 task_control_lock 内读取 metadata 并终止，防止被 worker 切换
-    with task_control_lock:
+    with task_control_lock, slot_pool.lock:
         # 再次确认仍在 processing（双重保险）
-        with status_lock:
-            if not status_info['processing']:
-                return jsonify({"error": "任务已在终止前完成"}), 400
+        if not slot.processing:
+            return jsonify({"error": "任务已在终止前完成"}), 400
 
-        pid = current_module.current_conversion_pid
+        pid = slot.pid
         if pid is None:
             return jsonify({"error": "当前没有有效的转换进程 PID"}), 400
 
         try:
             parent = psutil.Process(pid)
             if not parent.is_running():
-                current_module.current_conversion_pid = None
+                slot.pid = None
                 return jsonify({"error": "转换进程已结束"}), 400
 
             children = parent.children(recursive=True)
@@ -843,6 +1266,13 @@ def terminate_conversion():
                 except psutil.NoSuchProcess:
                     pass
 
+            if slot.status == '已暂停':
+                # 被暂停的进程要恢复后才会处理终止信号
+                try:
+                    process_control.resume(pid)
+                except ProcessControlError:
+                    pass
+
             gone, alive = psutil.wait_procs(all_procs, timeout=3)
             for proc in alive:
                 try:
@@ -850,25 +1280,25 @@ def terminate_conversion():
                 except psutil.NoSuchProcess:
                     pass
 
-            current_module.current_conversion_pid = None
+            slot.pid = None
+            slot.terminated = True
+            slot.status = '任务已终止'
 
-            # ✅ 在同一锁内读取 metadata，确保是“当前正在处理”的任务
-            input_path_to_delete = current_task_metadata['input_path']
-            original_filename = current_task_metadata['original_filename']
-            tmp_output_to_delete = os.path.join(Config.CONVERTED_FOLDER, f"_tmp_{original_filename}") if original_filename else None
-
-            # 清空 metadata
-            current_task_metadata['input_path'] = None
-            current_task_metadata['original_filename'] = None
+            # ✅ 在同一锁内读取槽位元数据，确保是“当前正在处理”的任务
+            # 批量转换时一起终止整批任务
+            inputs_to_delete = [slot.input_path] + [task['input_path'] for task in slot.batch]
+            output_filename = (slot.task or {}).get('output_filename') or slot.original_filename
+            tmp_output_to_delete = os.path.join(Config.CONVERTED_FOLDER, f"_tmp_{output_filename}") if output_filename else None
 
             deleted_files = []
-            if input_path_to_delete and os.path.exists(input_path_to_delete):
-                try:
-                    os.remove(input_path_to_delete)
-                    deleted_files.append(input_path_to_delete)
-                    print(f"[清理] 已删除输入文件: {input_path_to_delete}")
-                except Exception as e:
-                    print(f"[清理] 删除输入文件失败: {e}")
+            for input_path_to_delete in inputs_to_delete:
+                if input_path_to_delete and os.path.exists(input_path_to_delete):
+                    try:
+                        os.remove(input_path_to_delete)
+                        deleted_files.append(input_path_to_delete)
+                        print(f"[清理] 已删除输入文件: {input_path_to_delete}")
+                    except Exception as e:
+                        print(f"[清理] 删除输入文件失败: {e}")
 
             if tmp_output_to_delete and os.path.exists(tmp_output_to_delete):
                 try:
@@ -878,138 +1308,116 @@ def terminate_conversion():
                 except Exception as e:
                     print(f"[清理] 删除临时输出文件失败: {e}")
 
-            # ✅ 新增：从 uploaded_files 中移除被终止的文件名
-            if original_filename:
-                with status_lock:
-                    if original_filename in status_info['uploaded_files']:
-                        status_info['uploaded_files'].remove(original_filename)
-
-            # 更新状态
-            with status_lock:
-                status_info['processing'] = False
-                status_info['current_file'] = None
-                status_info['current_status'] = '任务已终止'
-
-            # 同步到持久化状态
-            state = load_persistent_state() or {}
-            state.update({
-                'processing': False,
-                'current_file': None,
-                'current_status': '任务已终止',
-                'uploaded_files': status_info['uploaded_files'].copy(),
-                'converted_files': status_info['converted_files'].copy()
-            })
-            save_persistent_state(state)
-
             worker_wakeup_event.set()
-            return jsonify({
+            result = {
                 "message": f"已终止 {len(all_procs)} 个进程，并清理了 {len(deleted_files)} 个临时文件",
+                "slot_id": slot.slot_id,
                 "deleted_files": deleted_files
-            }), 200
+            }
 
         except psutil.NoSuchProcess:
-            current_module.current_conversion_pid = None
+            slot.pid = None
             return jsonify({"error": "转换进程已结束"}), 400
         except Exception as e:
             return jsonify({"error": f"终止异常: {str(e)}"}), 500
-def save_current_task_if_processing():
-    """如果当前有正在处理的任务，将其放回队列并持久化"""
-    with status_lock:
-        processing = status_info['processing']
-        current_file = status_info['current_file']
-
-    if not processing or not current_file:
-        return
-
-    print("检测到正在转换的任务，正在保存回队列...")
-
-    # 安全读取 current_task_metadata
-    with current_task_lock:
-        meta = current_task_metadata.copy()
-
-    if not meta['original_filename']:
-        print("警告：无法获取当前任务元数据，跳过保存")
-        return
 
-    # 构造任务
-    task = {
-        'input_path': meta['input_path'],
-        'original_filename': meta['original_filename'],
-        'stored_filename': os.path.basename(meta['input_path']) if meta['input_path'] else meta['original_filename'],
-        'additional_args': meta['additional_args']
-    }
-
-    # 放回队列头部（优先处理）
-    temp_queue = queue.Queue()
-    temp_queue.put(task)
-    while not conversion_queue.empty():
-        temp_queue.put(conversion_queue.get())
-    while not temp_queue.empty():
-        conversion_queue.put(temp_queue.get())
-
-    print(f"已将任务 '{meta['original_filename']}' 保存回队列")
-
-    # 保存完整状态（包括 uploaded_files，注意：正在处理的文件不应在 uploaded_files 中）
+    # 槽位和任务状态由 worker 在进程退出后更新
     with status_lock:
-        # 确保 uploaded_files 不包含当前文件（它正在处理，不属于“排队”）
-        safe_uploaded = [f for f in status_info['uploaded_files'] if f != meta['original_filename']]
-        state = {
-            'queue': list(conversion_queue.queue),
-            'uploaded_files': safe_uploaded,
-            'converted_files': status_info['converted_files'].copy(),
-            'processing': False,  # 强制设为 False，因为即将退出
-            'current_file': None,
-            'current_status': '已中断'
-        }
-    save_persistent_state(state)
-    print("持久化状态已更新，包含中断的任务")
-if __name__ == '__main__':
-    # === 1. 日志重定向 ===
-    from datetime import datetime
-    LOG_FILE = 'app.log'
-    MAX_LOG_LINES = 10000
-
-    class LimitedLogWriter:
-        def __init__(self, filename, max_lines=10000):
-            self.filename = filename
-            self.max_lines = max_lines
-            self.ensure_log_exists()
-
-        def ensure_log_exists(self):
-            if not os.path.exists(self.filename):
-                with open(self.filename, 'w', encoding='utf-8') as f:
-                    f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 日志开始\n")
-
-        def write(self, message):
-            if message.strip() == "":
-                return
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            log_line = f"[{timestamp}] {message.rstrip()}\n"
-
-            lines = []
-            if os.path.exists(self.filename):
-                try:
-                    with open(self.filename, 'r', encoding='utf-8') as f:
-                        lines = f.readlines()
-                except:
-                    lines = []
-
-            lines.append(log_line)
-            if len(lines) > self.max_lines:
-                lines = lines[-self.max_lines:]
+        refresh_overall_status()
 
-            try:
-                with open(self.filename, 'w', encoding='utf-8') as f:
-                    f.writelines(lines)
-            except Exception as e:
-                pass  # 避免日志写入失败导致崩溃
+    return jsonify(result), 200
+def save_current_task_if_processing():
+    """
+    如果有正在处理的任务，将它们放回队列头部并持久化。
+    全程持有 task_control_lock 并先设置 shutdown_event：空闲的槽位不会再把放回的任务取走
+    （否则重启后这些任务会显示为转换被中断，而不是排队中）
+    """
+    with task_control_lock:
+        shutdown_event.set()
+        with slot_pool.lock:
+            # 安全读取各槽位的任务元数据
+            tasks = []
+            for slot in slot_pool.slots:
+                if slot.processing and slot.original_filename and not slot.finishing:
+                    tasks.append(slot.to_task())
+                    tasks.extend(dict(task) for task in slot.batch)  # 批量转换中的其他任务
+
+        if not tasks:
+            return
+
+        print(f"检测到 {len(tasks)} 个正在转换的任务，正在保存回队列...")
+
+        # 放回队列头部（优先处理），倒序放入使第一个槽位的任务排在最前
+        # 持久化，任务状态由 converting 改回 queued
+        for task in reversed(tasks):
+            task_scheduler.put(task, front=True)
+            state_store.queue_push(task, front=True)
+
+        for task in tasks:
+            task_registry.transition(task['task_id'], 'queued', '服务关闭，已放回队列')
+
+    interrupted = {task['original_filename'] for task in tasks}
+    print(f"已将任务 {sorted(interrupted)} 保存回队列")
+    state_store.set_status('已中断')
+    print("持久化状态已更新，包含中断的任务")
+def serve_http(host='0.0.0.0', port=None):
+    """
+    启动 HTTP 服务（阻塞）。
+    - development: Werkzeug 开发服务器，每个连接一个线程，不限数量
+    - production: waitress，固定 SERVER_THREADS 个工作线程，支持 keep-alive，
+      请求体超过限制时在缓冲之前拒绝，send_file 通过 wsgi.file_wrapper 直接输出文件
+    """
+    port = port or app.config['FLASK_PORT']
+    if Config.SERVER_MODE == 'production':
+        from waitress import serve
+        print(f"[服务] 生产模式 (waitress)，端口 {port}，工作线程 {Config.SERVER_THREADS}")
+        serve(
+            app,
+            host=host,
+            port=port,
+            threads=Config.SERVER_THREADS,
+            connection_limit=Config.SERVER_CONNECTION_LIMIT,
+            channel_timeout=Config.SERVER_CHANNEL_TIMEOUT,
+            # 整体上限与 MAX_CONTENT_LENGTH 相同；分块上传接口更小的上限由 ChunkUploadRequest 检查
+            max_request_body_size=Config.MAX_CONTENT_LENGTH,
+            ident='IW3WebGUI'
+        )
+    else:
+        print(f"[服务] 开发模式 (Werkzeug)，端口 {port}")
+        # 启动 Flask（不使用 reloader）
+        app.run(host=host, port=port, debug=False, threaded=True, use_reloader=False)
+
+def start_background_services():
+    """恢复状态并启动上传 / 下载 / 存储索引 / 转换工作线程（不含 HTTP 服务）"""
+    # 清理 & 恢复状态
+    print("正在清理临时文件...")
+    cleanup_temp_files()
+    print("正在恢复处理队列...")
+    restore_processing_queue()
+    upload_sessions.restore()
+    download_manager.restore()
+    cleanup_orphaned_upload_files()
+    print("正在初始化已转换文件列表...")
+    initialize_converted_files()
+    if storage_mode() == 'onedrive':
+        upload_stage.restore()
+        upload_stage.start()
+    download_manager.start()
+    upload_restore_thread = threading.Thread(target=restore_converted_files_to_onedrive, daemon=True)
+    upload_restore_thread.start()
+    threading.Thread(target=storage_index_worker, daemon=True).start()
+
+    # 启动工作线程（每个转换槽位一个）
+    for slot in slot_pool.slots:
+        worker_thread = threading.Thread(target=conversion_worker, args=(slot,), daemon=True)
+        worker_thread.start()
 
-        def flush(self):
-            pass
 
-    # 重定向标准输出和错误
-    sys.stdout = LimitedLogWriter(LOG_FILE, MAX_LOG_LINES)
-    sys.stderr = LimitedLogWriter(LOG_FILE, MAX_LOG_LINES)
+if __name__ == '__main__':
+    # === 1. 日志重定向（后台线程异步写盘） ===
+    log_sink.start()
+    sys.stdout = SinkStream(log_sink, level='INFO')
+    sys.stderr = SinkStream(log_sink, level='ERROR')
 
     print("=== 应用启动 ===")
 
@@ -1028,6 +1436,12 @@ if __name__ == '__main__':
     except ImportError:
         print("缺少依赖：请运行 `pip install pystray pillow`")
         sys.exit(1)
+    if Config.SERVER_MODE == 'production':
+        try:
+            import waitress
+        except ImportError:
+            print("缺少依赖：生产模式需要 waitress，请运行 `pip install waitress`")
+            sys.exit(1)
 
     def create_image():
         return Image.open("static/images/icon.png")
@@ -1036,30 +1450,18 @@ if __name__ == '__main__':
         webbrowser.open(f"http://localhost:{app.config['FLASK_PORT']}")
 
     def exit_app(icon, item):
+        # 先放回队列（同时阻止工作线程取新任务、清理被放回的任务），再结束常驻 iw3 进程
         save_current_task_if_processing()
+        storage_index.save()
+        warm_workers.stop_all()
         icon.stop()
         print("用户通过托盘退出程序")
         os._exit(0)  # 强制退出（确保 Flask 线程终止）
 
     # === 4. 启动后台服务 ===
     def run_flask():
-        # 清理 & 恢复状态
-        print("正在清理临时文件...")
-        cleanup_temp_files()
-        print("正在恢复处理队列...")
-        restore_processing_queue()
-        cleanup_orphaned_upload_files()
-        print("正在初始化已转换文件列表...")
-        initialize_converted_files()
-        upload_restore_thread = threading.Thread(target=restore_converted_files_to_onedrive, daemon=True)
-        upload_restore_thread.start()
-
-        # 启动工作线程
-        worker_thread = threading.Thread(target=conversion_worker, daemon=True)
-        worker_thread.start()
-
-        # 启动 Flask（不使用 reloader）
-        app.run(host='0.0.0.0', port=app.config['FLASK_PORT'], debug=False, threaded=True, use_reloader=False)
+        start_background_services()
+        serve_http()
 
     flask_thread = Thread(target=run_flask, daemon=True)
     flask_thread.start()
@@ -0,0 +1,276 @@
+# metrics.py
+
+import time
+import bisect
+import threading
+from abc import ABC, abstractmethod
+
+# 直方图默认分桶（秒）：请求级耗时、转换级耗时
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _CounterValue:
+    __slots__ = ('lock', 'value')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramValue:
+    __slots__ = ('lock', 'bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最后一个是 +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    """with histogram.time(): ... 记录代码块耗时"""
+    __slots__ = ('target', 'started')
+
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.target.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Metric(ABC):
+    """
+    一个指标（可带标签）。labels(...) 返回对应标签值的子指标并缓存，热路径上只是一次字典查找 + 一个小锁；
+    不带标签的指标直接调用 inc / set / observe。
+    """
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+        self.function = None
+        if not self.labelnames:
+            self._default = self.labels()
+
+    @abstractmethod
+    def _new_child(self):
+        """一组标签值对应的子指标（_CounterValue / _GaugeValue / _HistogramValue）"""
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}，收到 {values}")
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self):
+        """[(后缀, 标签名, 标签值, 附加标签, 值)]"""
+        with self.lock:
+            children = sorted(self.children.items())
+        for values, child in children:
+            yield '', values, None, child.value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set_function(self, function):
+        """抓取时再计算当前值（队列长度、存储占用等已有状态，不需要在变化时逐个更新）"""
+        self.function = function
+
+    def _samples(self):
+        if self.function is None:
+            yield from super()._samples()
+            return
+        try:
+            value = self.function()
+        except Exception as e:
+            print(f"[指标] 计算 {self.name} 失败: {e}")
+            return
+        yield '', (), None, value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def _samples(self):
+        with self.lock:
+            children = sorted(self.children.items())
+        for values, child in children:
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', values, ('le', _format_value(float(bound))), cumulative
+            yield '_sum', values, None, total
+            yield '_count', values, None, cumulative
+
+
+class MetricsRegistry:
+    """进程内指标表，render() 输出 Prometheus 文本格式（text/plain; version=0.0.4）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"指标重复注册: {metric.name}")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# 全局实例
+metrics = MetricsRegistry()
+
+# === 任务生命周期各阶段的指标（各模块直接导入使用；由已有状态得出的仪表在 main 中设置计算函数）===
+
+# 上传
+upload_chunks = metrics.counter('iw3web_upload_chunks_total', '收到的上传分块数', ['result'])
+upload_bytes = metrics.counter('iw3web_upload_bytes_total', '写入的上传分块字节数')
+upload_chunk_seconds = metrics.histogram('iw3web_upload_chunk_seconds', '写入一个上传分块的耗时')
+upload_finalize_seconds = metrics.histogram('iw3web_upload_finalize_seconds', '所有分块到齐后生成完整文件的耗时')
+
+# 队列
+tasks_enqueued = metrics.counter('iw3web_tasks_enqueued_total', '加入转换队列的任务数')
+queue_depth = metrics.gauge('iw3web_queue_depth', '转换队列中的任务数')
+queue_wait_seconds = metrics.histogram('iw3web_queue_wait_seconds', '任务从加入队列到开始转换的等待时间',
+                                       buckets=DURATION_BUCKETS)
+
+# 转换
+conversions = metrics.counter('iw3web_conversions_total', '结束的转换任务数', ['result'])
+conversions_active = metrics.gauge('iw3web_conversions_active', '正在转换的任务数')
+conversion_seconds = metrics.histogram('iw3web_conversion_seconds', 'iw3 进程的运行时间', ['result'],
+                                       buckets=DURATION_BUCKETS)
+
+process_control_seconds = metrics.histogram('iw3web_process_control_seconds', '暂停 / 恢复转换进程的耗时', ['action'])
+
+warm_worker_restarts = metrics.counter('iw3web_warm_worker_restarts_total', '常驻 iw3 进程的重启次数', ['reason'])
+admission_rejections = metrics.counter('iw3web_admission_rejections_total', '因资源不足被拒绝 / 推迟的上传、下载和转换',
+                                       ['kind', 'reason'])
+
+# OneDrive
+onedrive_requests = metrics.counter('iw3web_onedrive_requests_total', 'OneDrive 请求数（status 为 error 表示网络异常）',
+                                    ['method', 'status'])
+onedrive_request_seconds = metrics.histogram('iw3web_onedrive_request_seconds', 'OneDrive 请求耗时', ['method'])
+onedrive_retries = metrics.counter('iw3web_onedrive_retries_total', 'OneDrive 重试次数', ['reason'])
+
+# 存储管理
+storage_used_bytes = metrics.gauge('iw3web_storage_used_bytes', '已转换文件占用的存储空间')
+storage_limit_bytes = metrics.gauge('iw3web_storage_limit_bytes', '存储空间上限（MAX_STORAGE_SIZE）')
+storage_evictions = metrics.counter('iw3web_storage_evictions_total', '存储管理删除的旧文件数', ['result'])
+storage_evicted_bytes = metrics.counter('iw3web_storage_evicted_bytes_total', '存储管理删除的旧文件字节数')
+manage_storage_seconds = metrics.histogram('iw3web_manage_storage_seconds', '一次存储管理的耗时')
@@ -5,8 +5,115 @@ import os
 import msal
 import requests
 from config import Config
-from threading import RLock
+from threading import RLock, Lock, Event, Thread
 import time
+from datetime import datetime
+from metrics import onedrive_requests, onedrive_request_seconds, onedrive_retries
+
+
+class IdCache:
+    """
+    带 TTL 的 ID 缓存（文件夹路径 -> 文件夹 ID，(文件夹 ID, 文件名) -> 文件 ID）。
+    命中时省掉一次 Graph 查询；404 / 删除时由调用方 invalidate。
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = RLock()
+        self.entries = {}  # key -> (value, expires_at)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] > time.time():
+                self.hits += 1
+                return entry[0]
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, ttl=None):
+        if value is None:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.time() + (self.ttl if ttl is None else ttl))
+
+    def peek(self, key):
+        """读取但不计入命中统计（失效处理时使用）"""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry[0] if entry else None
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        with self.lock:
+            for key in [k for k in self.entries if predicate(k)]:
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0.0
+            }
+
+
+class UploadSessionStore:
+    """未完成的分段上传会话（uploadUrl + 源文件大小 / 修改时间 + 过期时间），保存在 JSON 文件中"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = RLock()
+        self.sessions = None
+
+    def _load(self):
+        if self.sessions is None:
+            self.sessions = {}
+            try:
+                if os.path.exists(self.path):
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        self.sessions = json.load(f)
+            except Exception as e:
+                print(f"[OneDrive] 读取上传会话失败: {e}")
+            now = time.time()
+            self.sessions = {k: v for k, v in self.sessions.items() if v.get('expires_at', 0) > now}
+        return self.sessions
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.sessions, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[OneDrive] 保存上传会话失败: {e}")
+
+    def get(self, key):
+        with self.lock:
+            return self._load().get(key)
+
+    def put(self, key, record):
+        with self.lock:
+            self._load()[key] = record
+            self._save()
+
+    def remove(self, key):
+        with self.lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
+
+
+upload_session_store = UploadSessionStore(Config.ONEDRIVE_UPLOAD_SESSIONS_PATH)
+
 
 class OneDriveClient:
     def __init__(self):
@@ -15,6 +122,42 @@ class OneDriveClient:
         self.token_expires_at = 0
         self.session = requests.Session()
         self.session.headers.update({'User-Agent': 'IW3WebGUI/1.0'})
+        self.folder_ids = IdCache(Config.ONEDRIVE_ID_CACHE_TTL)
+        self.item_ids = IdCache(Config.ONEDRIVE_ID_CACHE_TTL)
+        # 文件 ID -> 下载链接；过期时间按链接类型分别设置
+        self.download_links = IdCache(Config.ONEDRIVE_DOWNLOAD_URL_TTL)
+        self.inflight_lock = Lock()
+        self.inflight_links = {}  # (folder_id, filename) -> {'event', 'result'}
+
+    def cache_stats(self):
+        return {'folders': self.folder_ids.stats(), 'items': self.item_ids.stats(), 'links': self.download_links.stats()}
+
+    def invalidate_folder(self, folder_path, folder_id=None):
+        """文件夹 ID 失效（404 时调用），同时清掉该文件夹下的文件 ID 和下载链接"""
+        self.folder_ids.invalidate(folder_path)
+        if folder_id:
+            with self.item_ids.lock:
+                item_ids = [value for key, (value, _) in self.item_ids.entries.items() if key[0] == folder_id]
+            self.item_ids.invalidate_where(lambda key: key[0] == folder_id)
+            for item_id in item_ids:
+                self.download_links.invalidate(item_id)
+
+    def invalidate_item(self, folder_id, filename):
+        """文件已删除或不存在：清掉文件 ID 和对应的下载链接"""
+        item_id = self.item_ids.peek((folder_id, filename))
+        self.item_ids.invalidate((folder_id, filename))
+        if item_id:
+            self.download_links.invalidate(item_id)
+
+    def _items_url(self, *parts):
+        return f"{Config.GRAPH_API_BASE_URL}/users/{Config.ONEDRIVE_USER_ID}/drive/items/" + ''.join(parts)
+
+    def _file_url(self, folder_id, filename):
+        """优先用缓存的文件 ID 寻址（/items/{id}），否则用 /items/{folder-id}:/{filename}"""
+        item_id = self.item_ids.get((folder_id, filename))
+        if item_id:
+            return self._items_url(item_id), True
+        return self._items_url(folder_id, ':/', filename), False
 
     def _get_token_from_cache(self):
         """从本地文件加载Token"""
@@ -85,17 +228,35 @@ class OneDriveClient:
         headers['Content-Type'] = 'application/json'
         kwargs['headers'] = headers
 
-        response = self.session.request(method, url, **kwargs)
+        response = self._timed_request(method, url, **kwargs)
         if response.status_code == 401: # Unauthorized, 可能是Token过期
             # 尝试强制刷新一次
+            onedrive_retries.labels('token_refresh').inc()
             if self._acquire_token() and self._ensure_valid_token():
                 headers['Authorization'] = f'Bearer {self.access_token}'
                 kwargs['headers'] = headers
-                response = self.session.request(method, url, **kwargs)
+                response = self._timed_request(method, url, **kwargs)
+        return response
+
+    def _timed_request(self, method, url, **kwargs):
+        """发送请求并记录耗时和状态码（网络异常记为 error 后继续抛出）"""
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            onedrive_requests.labels(method, 'error').inc()
+            raise
+        finally:
+            onedrive_request_seconds.labels(method).observe(time.perf_counter() - started)
+        onedrive_requests.labels(method, response.status_code).inc()
         return response
 
     def get_folder_id_by_path(self, path):
-        """根据路径获取文件夹ID (例如: '/IW3Converted')"""
+        """根据路径获取文件夹ID (例如: '/IW3Converted')，结果缓存 ONEDRIVE_ID_CACHE_TTL 秒"""
+        folder_id = self.folder_ids.get(path)
+        if folder_id:
+            return folder_id
+
         # 构建基于用户ID的完整路径
         base_path = f"/users/{Config.ONEDRIVE_USER_ID}/drive"
         
@@ -115,15 +276,39 @@ class OneDriveClient:
             data = response.json()
             folder_id = data.get('id')
             print(f"[OneDrive] 找到文件夹ID: {folder_id}")
+            self.folder_ids.put(path, folder_id)
             return folder_id
         elif response.status_code == 404:
             print(f"[OneDrive] 文件夹未找到: {path}")
+            self.invalidate_folder(path)
             # 可选：打印当前根目录内容，帮助调试
             self.list_root_contents()
             return None
         else:
             print(f"[OneDrive] 获取文件夹ID失败: {response.status_code}, {response.text}")
             return None
+
+    def list_root_contents(self):
+        """打印根目录下的项目名称（文件夹未找到时帮助排查路径）"""
+        url = f"{Config.GRAPH_API_BASE_URL}/users/{Config.ONEDRIVE_USER_ID}/drive/root/children?$select=name"
+        try:
+            response = self._make_request("GET", url)
+            if response.status_code == 200:
+                names = [item.get('name') for item in response.json().get('value', [])]
+                print(f"[OneDrive] 根目录内容: {names}")
+            else:
+                print(f"[OneDrive] 列出根目录失败: {response.status_code}, {response.text}")
+        except Exception as e:
+            print(f"[OneDrive] 列出根目录异常: {e}")
+
+    def _remember_uploaded_item(self, folder_id, response):
+        """上传成功的响应体就是 driveItem，顺便缓存文件 ID"""
+        try:
+            item = response.json()
+            self.item_ids.put((folder_id, item.get('name')), item.get('id'))
+        except Exception:
+            pass
+
     def upload_file(self, local_file_path, target_filename, folder_path=Config.ONEDRIVE_FOLDER_PATH):
         """
         将本地文件上传到 OneDrive 指定文件夹。
@@ -163,8 +348,11 @@ class OneDriveClient:
                 
                 if response.status_code in (200, 201):
                     print(f"[OneDrive] 简单上传成功: {target_filename}")
+                    self._remember_uploaded_item(folder_id, response)
                     return True, "上传成功"
                 else:
+                    if response.status_code == 404:
+                        self.invalidate_folder(folder_path, folder_id)
                     error_msg = f"[OneDrive] 简单上传失败: {response.status_code}, {response.text}"
                     print(error_msg)
                     return False, error_msg
@@ -174,85 +362,177 @@ class OneDriveClient:
                 print(error_msg)
                 return False, error_msg
 
-        # --- 策略 2: 分段上传 (适用于 > 4MB 的文件) ---
+        # --- 策略 2: 分段上传 (适用于 > 4MB 的文件，支持断点续传) ---
         else:
             print(f"[OneDrive] 文件较大 ({file_size} bytes)，使用分段上传")
-            
-            # 1. 创建上传会话
-            session_url = f"{base_url}:/createUploadSession"
-            payload = {
-                "item": {
-                    "@microsoft.graph.conflictBehavior": "rename"  # 可选: rename, replace, fail
-                }
-            }
-            
-            response = self._make_request("POST", session_url, json=payload)
-            if response.status_code != 200:
-                error_msg = f"[OneDrive] 创建上传会话失败: {response.status_code}, {response.text}"
-                print(error_msg)
-                return False, error_msg
+            return self._upload_large_file(local_file_path, target_filename, folder_path, folder_id, file_size, base_url)
 
-            session_data = response.json()
-            upload_url = session_data.get('uploadUrl')
-            if not upload_url:
-                error_msg = "[OneDrive] 创建上传会话成功，但未返回 uploadUrl"
-                print(error_msg)
-                return False, error_msg
+    # === 分段上传 / 断点续传 ===
 
-            expiration = session_data.get('expirationDateTime', 'Unknown')
-            print(f"[OneDrive] 上传会话已创建，过期时间: {expiration}")
+    def _upload_session_key(self, local_file_path, target_filename, folder_path):
+        return f"{os.path.abspath(local_file_path)}|{folder_path}|{target_filename}"
 
-            # 2. 分块上传
-            chunk_size = min(10 * 1024 * 1024, file_size)  # 每块最大 10MB，或文件总大小
-            headers = {'Content-Type': 'application/octet-stream'}
-            uploaded_bytes = 0
+    def _upload_large_file(self, local_file_path, target_filename, folder_path, folder_id, file_size, base_url):
+        """
+        分段上传。uploadUrl 持久化到 ONEDRIVE_UPLOAD_SESSIONS_PATH，
+        失败（或进程重启）后再次调用时先查询会话的 nextExpectedRanges，只补传缺失的部分。
+        """
+        key = self._upload_session_key(local_file_path, target_filename, folder_path)
+        mtime = os.path.getmtime(local_file_path)
+        record = upload_session_store.get(key)
+        if record and (record['file_size'] != file_size or record['mtime'] != mtime
+                       or record['expires_at'] <= time.time() + 60):
+            print(f"[OneDrive] 已保存的上传会话不可用（文件已变化或即将过期），重新创建: {target_filename}")
+            self._cancel_upload_session(record['upload_url'])
+            upload_session_store.remove(key)
+            record = None
+
+        ranges = None
+        if record:
+            ranges = self._query_upload_session(record['upload_url'], file_size)
+            if ranges is None:
+                upload_session_store.remove(key)
+                # 会话已不存在：可能是上次最后一块其实已经成功，只是没收到响应
+                if self._remote_file_size(folder_id, target_filename) == file_size:
+                    print(f"[OneDrive] 远端文件已完整，视为上传成功: {target_filename}")
+                    return True, "上传成功"
+                record = None
+            else:
+                print(f"[OneDrive] 续传上传会话，待上传区间: {ranges}")
 
-            try:
-                with open(local_file_path, 'rb') as f:
-                    while uploaded_bytes < file_size:
-                        chunk = f.read(chunk_size)
-                        if not chunk:
-                            break
-
-                        chunk_end = uploaded_bytes + len(chunk) - 1
-                        content_range = f"bytes {uploaded_bytes}-{chunk_end}/{file_size}"
-                        headers['Content-Range'] = content_range
-
-                        # 发送当前块
-                        chunk_response = self._make_request(
-                            "PUT", 
-                            upload_url, 
-                            data=chunk, 
-                            headers=headers,
-                            timeout=600  # 为大块上传设置较长超时
-                        )
-
-                        if chunk_response.status_code == 202:
-                            # 继续上传
-                            uploaded_bytes = chunk_end + 1
-                            print(f"[OneDrive] 已上传: {uploaded_bytes}/{file_size} ({uploaded_bytes/file_size*100:.1f}%)")
-                        elif chunk_response.status_code in (200, 201):
-                            # 上传完成
-                            print(f"[OneDrive] 分段上传成功: {target_filename}")
-                            return True, "上传成功"
-                        else:
-                            error_msg = f"[OneDrive] 分块上传失败: {chunk_response.status_code}, {chunk_response.text}"
+        if not record:
+            record = self._create_upload_session(base_url, folder_path, folder_id, file_size, mtime)
+            if isinstance(record, tuple):
+                return record  # (False, error_msg)
+            upload_session_store.put(key, record)
+            ranges = [(0, file_size - 1)]
+
+        upload_url = record['upload_url']
+        chunk_size = min(Config.ONEDRIVE_UPLOAD_CHUNK_SIZE, file_size)
+        retries_left = 3  # 单次调用内遇到失败时先查询进度再重试的次数
+
+        try:
+            with open(local_file_path, 'rb') as f:
+                while ranges:
+                    start, end = ranges[0]
+                    chunk_end = min(start + chunk_size, end + 1) - 1
+                    f.seek(start)
+                    chunk = f.read(chunk_end - start + 1)
+                    headers = {
+                        'Content-Type': 'application/octet-stream',
+                        'Content-Range': f"bytes {start}-{chunk_end}/{file_size}"
+                    }
+                    try:
+                        # uploadUrl 本身带有授权信息，不能再附加 Authorization 头
+                        chunk_response = self._timed_request('PUT', upload_url, data=chunk, headers=headers, timeout=600)
+                        status_code = chunk_response.status_code
+                    except requests.RequestException as e:
+                        print(f"[OneDrive] 分块上传异常: {e}")
+                        chunk_response, status_code = None, None
+
+                    if status_code == 202:
+                        ranges = self._parse_ranges(chunk_response.json().get('nextExpectedRanges'), file_size)
+                        uploaded_bytes = file_size - sum(e - s + 1 for s, e in ranges)
+                        print(f"[OneDrive] 已上传: {uploaded_bytes}/{file_size} ({uploaded_bytes/file_size*100:.1f}%)")
+                    elif status_code in (200, 201):
+                        # 上传完成
+                        print(f"[OneDrive] 分段上传成功: {target_filename}")
+                        upload_session_store.remove(key)
+                        self._remember_uploaded_item(folder_id, chunk_response)
+                        return True, "上传成功"
+                    elif status_code == 404:
+                        upload_session_store.remove(key)
+                        error_msg = "[OneDrive] 上传会话已失效，下次将重新创建"
+                        print(error_msg)
+                        return False, error_msg
+                    else:
+                        if chunk_response is not None:
+                            print(f"[OneDrive] 分块上传失败: {status_code}, {chunk_response.text}")
+                        retries_left -= 1
+                        onedrive_retries.labels('chunk').inc()
+                        ranges = self._query_upload_session(upload_url, file_size) if retries_left >= 0 else None
+                        if ranges is None:
+                            error_msg = f"[OneDrive] 分块上传失败，已保存上传会话，下次从断点续传: {target_filename}"
                             print(error_msg)
                             return False, error_msg
+                        print(f"[OneDrive] 按服务器进度继续上传，待上传区间: {ranges}")
 
-                # 如果循环结束但未收到 200/201，说明出错
-                error_msg = "[OneDrive] 分段上传未完成，未知错误"
-                print(error_msg)
-                return False, error_msg
+            # 服务器认为没有缺失的区间，但未返回完成响应
+            error_msg = "[OneDrive] 分段上传未完成，未知错误"
+            print(error_msg)
+            return False, error_msg
 
-            except Exception as e:
-                error_msg = f"[OneDrive] 分段上传过程中发生异常: {str(e)}"
-                print(error_msg)
-                return False, error_msg
+        except Exception as e:
+            error_msg = f"[OneDrive] 分段上传过程中发生异常: {str(e)}"
+            print(error_msg)
+            return False, error_msg
+
+    def _create_upload_session(self, base_url, folder_path, folder_id, file_size, mtime):
+        """创建上传会话，返回持久化记录；失败时返回 (False, error_msg)"""
+        session_url = f"{base_url}:/createUploadSession"
+        payload = {
+            "item": {
+                "@microsoft.graph.conflictBehavior": "rename"  # 可选: rename, replace, fail
+            }
+        }
+
+        response = self._make_request("POST", session_url, json=payload)
+        if response.status_code == 404:
+            self.invalidate_folder(folder_path, folder_id)
+        if response.status_code != 200:
+            error_msg = f"[OneDrive] 创建上传会话失败: {response.status_code}, {response.text}"
+            print(error_msg)
+            return False, error_msg
+
+        session_data = response.json()
+        upload_url = session_data.get('uploadUrl')
+        if not upload_url:
+            error_msg = "[OneDrive] 创建上传会话成功，但未返回 uploadUrl"
+            print(error_msg)
+            return False, error_msg
+
+        expiration = session_data.get('expirationDateTime', 'Unknown')
+        print(f"[OneDrive] 上传会话已创建，过期时间: {expiration}")
+        try:
+            expires_at = datetime.fromisoformat(expiration.replace('Z', '+00:00')).timestamp()
+        except (AttributeError, ValueError):
+            expires_at = time.time() + 24 * 3600  # Graph 会话默认数天后过期，这里保守按 24 小时
+        return {'upload_url': upload_url, 'file_size': file_size, 'mtime': mtime, 'expires_at': expires_at}
+
+    def _query_upload_session(self, upload_url, file_size):
+        """查询上传会话进度，返回缺失区间列表 [(start, end), ...]；会话不存在或查询失败时返回 None"""
+        try:
+            response = self._timed_request('GET', upload_url, timeout=60)
+        except requests.RequestException as e:
+            print(f"[OneDrive] 查询上传会话失败: {e}")
+            return None
+        if response.status_code != 200:
+            print(f"[OneDrive] 上传会话不可用: {response.status_code}")
+            return None
+        return self._parse_ranges(response.json().get('nextExpectedRanges'), file_size)
+
+    def _cancel_upload_session(self, upload_url):
+        try:
+            self._timed_request('DELETE', upload_url, timeout=60)
+        except requests.RequestException:
+            pass
+
+    @staticmethod
+    def _parse_ranges(expected_ranges, file_size):
+        """把 ["0-1023", "4096-"] 解析为 [(0, 1023), (4096, file_size - 1)]"""
+        ranges = []
+        for item in expected_ranges or []:
+            start, _, end = item.partition('-')
+            start = int(start)
+            ranges.append((start, int(end) if end else file_size - 1))
+        return ranges
+
+    def _remote_file_size(self, folder_id, filename):
+        response = self._make_request("GET", self._items_url(folder_id, ':/', filename))
+        if response.status_code == 200:
+            return response.json().get('size')
+        return None
 
-            finally:
-                # 可选：这里可以添加逻辑来清理 uploadUrl（Graph API 通常会在 24 小时后自动清理）
-                pass
     def delete_file(self, filename, folder_path=Config.ONEDRIVE_FOLDER_PATH):
         """删除 OneDrive 指定文件夹中的文件"""
         folder_id = self.get_folder_id_by_path(folder_path)
@@ -260,11 +540,12 @@ class OneDriveClient:
             print(f"[OneDrive] 无法找到目标文件夹的ID: {folder_path}")
             return False
 
-        # 构建删除文件的 URL
-        # 使用 /users/{Config.ONEDRIVE_USER_ID}/drive/items/{parent-id}:/{filename} 这种寻址方式
-        file_url = f"{Config.GRAPH_API_BASE_URL}/users/{Config.ONEDRIVE_USER_ID}/drive/items/{folder_id}:/{filename}"
+        # 构建删除文件的 URL（缓存了文件 ID 时用 /items/{item-id}，
+        # 否则使用 /users/{Config.ONEDRIVE_USER_ID}/drive/items/{parent-id}:/{filename} 这种寻址方式）
+        file_url, _ = self._file_url(folder_id, filename)
         response = self._make_request("DELETE", file_url)
-        
+        self.invalidate_item(folder_id, filename)
+
         if response.status_code == 204:
             # 204 No Content 表示删除成功
             print(f"[OneDrive] 成功删除文件: {filename}")
@@ -277,14 +558,56 @@ class OneDriveClient:
             print(f"[OneDrive] 删除文件失败: {response.status_code}, {response.text}")
             return False
     def create_download_link(self, filename, folder_path=Config.ONEDRIVE_FOLDER_PATH):
-        """为OneDrive中的文件创建临时共享链接 (允许下载)"""
+        """
+        为OneDrive中的文件创建临时共享链接 (允许下载)。
+        链接按文件 ID 缓存（直接下载链接约 1 小时后失效，按 ONEDRIVE_DOWNLOAD_URL_TTL 提前过期）；
+        同一文件的并发请求只向 Graph 查询一次，其余请求等待同一结果。
+        """
         folder_id = self.get_folder_id_by_path(folder_path)
         if not folder_id:
             return None
 
-        # 首先获取文件的 item_id
-        file_url = f"{Config.GRAPH_API_BASE_URL}/users/{Config.ONEDRIVE_USER_ID}/drive/items/{folder_id}:/{filename}"
+        item_id = self.item_ids.get((folder_id, filename))
+        if item_id:
+            download_link = self.download_links.get(item_id)
+            if download_link:
+                return download_link
+
+        key = (folder_id, filename)
+        with self.inflight_lock:
+            pending = self.inflight_links.get(key)
+            owner = pending is None
+            if owner:
+                pending = self.inflight_links[key] = {'event': Event(), 'result': None}
+        if not owner:
+            pending['event'].wait(timeout=60)
+            return pending['result']
+
+        try:
+            pending['result'] = self._fetch_download_link(folder_id, filename, folder_path)
+        finally:
+            with self.inflight_lock:
+                self.inflight_links.pop(key, None)
+            pending['event'].set()
+        return pending['result']
+
+    def prewarm_download_link(self, filename, folder_path=Config.ONEDRIVE_FOLDER_PATH):
+        """后台提前生成下载链接（新上传的文件），用户点击下载时直接命中缓存"""
+        def _prewarm():
+            try:
+                self.create_download_link(filename, folder_path)
+            except Exception as e:
+                print(f"[OneDrive] 预生成下载链接失败 {filename}: {e}")
+        Thread(target=_prewarm, daemon=True).start()
+
+    def _fetch_download_link(self, folder_id, filename, folder_path):
+        # 首先获取文件的 item_id（已缓存时直接按 ID 查询）
+        file_url, by_id = self._file_url(folder_id, filename)
         response = self._make_request("GET", file_url)
+        if response.status_code == 404:
+            self.invalidate_item(folder_id, filename)
+            if not by_id:
+                self.invalidate_folder(folder_path, folder_id)  # 无法区分是文件还是文件夹不存在
         if response.status_code != 200:
             print(f"[OneDrive] 无法找到文件获取ID: {filename}, {response.text}")
             return None
@@ -293,15 +616,17 @@ class OneDriveClient:
         item_id = item_data.get('id')
         if not item_id:
             return None
+        self.item_ids.put((folder_id, filename), item_id)
 
         # 尝试获取 @microsoft.graph.downloadUrl
         download_url = item_data.get('@microsoft.graph.downloadUrl')
         if download_url:
             print(f"[OneDrive] 直接下载链接: {download_url}")
+            self.download_links.put(item_id, download_url)
             return download_url
 
         # 如果没有下载链接，则创建共享链接
-        share_url = f"{Config.GRAPH_API_BASE_URL}/users/{Config.ONEDRIVE_USER_ID}/drive/items/{item_id}/createLink"
+        share_url = self._items_url(item_id, '/createLink')
         payload = {
             "type": "view",  # 或者 "edit" 根据需求
             "scope": "anonymous"  # 或者 "organization"
@@ -315,6 +640,8 @@ class OneDriveClient:
                 # 添加 ?download=1 参数以尝试直接下载
                 download_link = f"{web_url}?download=1"
                 print(f"[OneDrive] 创建的下载链接: {download_link}")
+                # 匿名共享链接不会自动过期，可以缓存更久
+                self.download_links.put(item_id, download_link, Config.ONEDRIVE_SHARE_LINK_TTL)
                 return download_link
         else:
             print(f"[OneDrive] 创建共享链接失败: {response.status_code}, {response.text}")
@@ -326,10 +653,13 @@ class OneDriveClient:
             return []
 
         # ✅ 修复：加上 'file' 字段！
-        url = f"{Config.GRAPH_API_BASE_URL}/users/{Config.ONEDRIVE_USER_ID}/drive/items/{folder_id}/children?$select=name,size,lastModifiedDateTime,file"
+        # 顺便取回 id，填充文件 ID 缓存，之后的删除 / 下载不用再按路径查询
+        url = self._items_url(folder_id, '/children?$select=id,name,size,lastModifiedDateTime,file')
         files = []
         while url:
             response = self._make_request("GET", url)
+            if response.status_code == 404:
+                self.invalidate_folder(folder_path, folder_id)
             if response.status_code != 200:
                 print(f"[OneDrive] 列出文件失败: {response.status_code}, {response.text}")
                 break
@@ -337,6 +667,7 @@ class OneDriveClient:
             data = response.json()
             for item in data.get('value', []):
                 if item.get('file'):  # 现在能正确识别文件了
+                    self.item_ids.put((folder_id, item['name']), item.get('id'))
                     files.append({
                         'name': item['name'],
                         'size': item['size'],
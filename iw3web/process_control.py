@@ -0,0 +1,161 @@
+# process_control.py
+
+import os
+import sys
+import signal
+import subprocess
+from abc import ABC, abstractmethod
+import psutil
+from config import Config
+
+
+class ProcessControlError(Exception):
+    pass
+
+
+class ProcessControl(ABC):
+    """
+    转换进程的启动方式和暂停 / 恢复方法。
+    suspend / resume 返回被操作对象的描述（例如 "3 个进程"），失败时抛出 ProcessControlError。
+    """
+    name = None
+
+    def popen_kwargs(self):
+        """传给 subprocess.Popen 的额外参数（让 iw3 进程树可以被整体控制）"""
+        return {}
+
+    @abstractmethod
+    def suspend(self, pid):
+        """暂停 pid 及其子进程"""
+
+    @abstractmethod
+    def resume(self, pid):
+        """恢复 pid 及其子进程"""
+
+    @staticmethod
+    def _tree(pid):
+        """父进程 + 所有子进程（递归）"""
+        try:
+            parent = psutil.Process(pid)
+            return [parent] + parent.children(recursive=True)
+        except psutil.NoSuchProcess:
+            raise ProcessControlError("转换进程已结束或不存在")
+
+
+class PosixProcessControl(ProcessControl):
+    """
+    转换进程在独立会话中启动（start_new_session），自己是进程组组长；
+    暂停 / 恢复只需向整个进程组发送一次 SIGSTOP / SIGCONT，不用遍历进程树，也不用启动外部程序。
+    """
+    name = 'posix'
+
+    def popen_kwargs(self):
+        return {'start_new_session': True}
+
+    def _signal_group(self, pid, sig):
+        try:
+            if os.getpgid(pid) != pid:
+                # 不是组长（不是由本模块启动的进程），退回逐个进程发送信号
+                processes = self._tree(pid)
+                for proc in processes:
+                    proc.send_signal(sig)
+                return f"{len(processes)} 个进程"
+            os.killpg(pid, sig)
+            return f"进程组 {pid}"
+        except ProcessLookupError:
+            raise ProcessControlError("转换进程已结束或不存在")
+        except (OSError, psutil.Error) as e:
+            raise ProcessControlError(str(e))
+
+    def suspend(self, pid):
+        return self._signal_group(pid, signal.SIGSTOP)
+
+    def resume(self, pid):
+        return self._signal_group(pid, signal.SIGCONT)
+
+
+class PsutilProcessControl(ProcessControl):
+    """用 psutil 逐个暂停进程树中的进程（Windows 上为 NtSuspendProcess），不依赖 pssuspend.exe"""
+    name = 'psutil'
+
+    def popen_kwargs(self):
+        if sys.platform == 'win32':
+            return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        return {}
+
+    def _apply(self, pid, resume):
+        count = 0
+        for proc in self._tree(pid):
+            try:
+                if resume:
+                    proc.resume()
+                else:
+                    proc.suspend()
+                count += 1
+            except psutil.NoSuchProcess:
+                pass
+            except psutil.Error as e:
+                print(f"[警告] 无法{'恢复' if resume else '暂停'}进程 {proc.pid}: {e}")
+        if not count:
+            raise ProcessControlError(f"未能{'恢复' if resume else '暂停'}任何进程")
+        return f"{count} 个进程"
+
+    def suspend(self, pid):
+        return self._apply(pid, resume=False)
+
+    def resume(self, pid):
+        return self._apply(pid, resume=True)
+
+
+class PssuspendProcessControl(PsutilProcessControl):
+    """原来的方式：对进程树中的每个进程调用一次 pssuspend.exe（Windows）"""
+    name = 'pssuspend'
+
+    def _apply(self, pid, resume):
+        action = '恢复' if resume else '暂停'
+        pssuspend_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pssuspend.exe')
+        if not os.path.isfile(pssuspend_path):
+            raise ProcessControlError(f"pssuspend.exe 未找到: {pssuspend_path}")
+
+        success_count = 0
+        for proc in self._tree(pid):
+            try:
+                # 检查进程是否还活着
+                if not proc.is_running():
+                    continue
+                cmd = [pssuspend_path, '-r', str(proc.pid)] if resume else [pssuspend_path, str(proc.pid)]
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+                if result.returncode == 0:
+                    print(f"[{action}] 成功{action}进程 {proc.pid} ({proc.name()})")
+                    success_count += 1
+                else:
+                    error_msg = result.stderr.strip() or result.stdout.strip()
+                    print(f"[警告] {action}进程 {proc.pid} 失败: {error_msg}")
+            except Exception as e:
+                print(f"[警告] 无法{action}进程 {proc.pid}: {e}")
+        if not success_count:
+            raise ProcessControlError(f"未能{action}任何进程")
+        return f"{success_count} 个进程"
+
+
+BACKENDS = {
+    'posix': PosixProcessControl,
+    'psutil': PsutilProcessControl,
+    'pssuspend': PssuspendProcessControl
+}
+
+
+def create_process_control(name=None):
+    """按 PROCESS_CONTROL_BACKEND 创建；'auto' 时 Windows 用 pssuspend，其他系统用进程组信号"""
+    name = name or Config.PROCESS_CONTROL_BACKEND
+    if name == 'auto':
+        name = 'pssuspend' if sys.platform == 'win32' else 'posix'
+    if name not in BACKENDS:
+        raise ValueError(f"未知的进程控制方式: {name}，可选 {', '.join(BACKENDS)}")
+    if name == 'posix' and not hasattr(os, 'killpg'):
+        raise ValueError("当前系统不支持进程组信号，请使用 psutil 或 pssuspend")
+    return BACKENDS[name]()
+
+
+# 全局实例
+process_control = create_process_control()
@@ -0,0 +1,68 @@
+# progress_parser.py
+
+import re
+import time
+
+# tqdm 风格的进度行，例如:
+#   video.mp4:  45%|████▌     | 4500/10000 [01:23<01:42, 53.21it/s]
+#   video.mp4:   3%|▎         | 30/1000 [00:25<13:20,  1.21s/it]
+PROGRESS_RE = re.compile(
+    r'(\d+)/(\d+)\s*\[([\d:]+)<([\d:?]+),\s*([\d.]+|\?)\s*([a-zA-Z]*/[a-zA-Z]+)'
+)
+
+
+def parse_duration(text):
+    """把 tqdm 的 MM:SS / H:MM:SS 转成秒，无法解析时返回 None"""
+    try:
+        seconds = 0
+        for part in text.split(':'):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+class ProgressParser:
+    """
+    从 iw3 输出中解析进度（已处理帧数、总帧数、FPS、剩余时间）。
+    每行只做一次简单的字符检查和正则匹配；进度通过 on_update 回调发布，
+    且最多每 interval 秒发布一次，不拖慢输出转发线程。
+    """
+
+    def __init__(self, on_update=None, interval=1.0):
+        self.on_update = on_update
+        self.interval = interval
+        self.progress = None
+        self.last_publish = 0
+
+    def feed(self, line):
+        """处理一行输出，是进度行时返回 True"""
+        if '|' not in line or '[' not in line:
+            return False  # 快速跳过普通日志行
+        match = PROGRESS_RE.search(line)
+        if not match:
+            return False
+
+        done, total = int(match.group(1)), int(match.group(2))
+        rate_text, unit = match.group(5), match.group(6)
+        fps = None
+        if rate_text != '?':
+            rate = float(rate_text)
+            # "s/it" 表示每帧耗时，换算成每秒帧数
+            fps = (1 / rate if rate else None) if unit.startswith('s/') else rate
+        eta = (total - done) / fps if fps else parse_duration(match.group(4))
+
+        self.progress = {
+            'frames_done': done,
+            'total_frames': total,
+            'percent': round(done / total * 100, 1) if total else None,
+            'fps': round(fps, 2) if fps else None,
+            'elapsed': parse_duration(match.group(3)),
+            'eta': round(eta) if eta is not None else None
+        }
+
+        now = time.monotonic()
+        if self.on_update and (now - self.last_publish >= self.interval or done == total):
+            self.last_publish = now
+            self.on_update(self.progress)
+        return True
@@ -0,0 +1,151 @@
+# resource_monitor.py
+
+import os
+import time
+import threading
+import psutil
+from config import Config
+from metrics import admission_rejections
+
+
+def _format_size(size):
+    size = max(size, 0)
+    if size >= 1024 ** 3:
+        return f"{size / 1024 ** 3:.2f}GB"
+    return f"{size / 1024 ** 2:.1f}MB"
+
+
+class Rejection:
+    """准入检查不通过：HTTP 状态码（磁盘 507，内存 / CPU 429）、原因和建议的重试间隔"""
+
+    def __init__(self, status, reason, message, retry_after):
+        self.status = status
+        self.reason = reason
+        self.message = message
+        self.retry_after = retry_after
+
+    def response(self):
+        """(响应体, 状态码, 头) 三元组，可直接交给 Flask"""
+        return ({'error': self.message, 'reason': self.reason, 'retry_after': self.retry_after},
+                self.status, {'Retry-After': str(self.retry_after)})
+
+
+class ResourceMonitor:
+    """
+    根据磁盘剩余空间、内存和 CPU 占用决定是否接受新的上传会话、直链下载和转换任务，
+    避免写到一半才因为磁盘满失败。
+
+    - 磁盘：剩余空间减去已接受但尚未写完的数据（上传会话和直链下载的剩余字节，由 pending_sources 提供，
+      与 UPLOAD_FOLDER 在同一磁盘时才扣除）再减去本次需要的空间，结果不能低于 RESOURCE_MIN_FREE_DISK。
+      预分配的文件在部分文件系统上是稀疏的，不占用剩余空间，所以未写完的部分要单独扣除
+    - 内存：已用百分比超过 RESOURCE_MAX_MEMORY_PERCENT 时拒绝
+    - CPU：只限制新开始的转换，超过 RESOURCE_MAX_CPU_PERCENT 时推迟（None 表示不限制）
+    内存和 CPU 每 RESOURCE_SAMPLE_INTERVAL 秒采样一次，磁盘每次检查时读取（statvfs，开销很小）。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sampled_at = 0
+        self.memory_percent = 0.0
+        self.cpu_percent = 0.0
+        self.pending_sources = []  # callable，返回 UPLOAD_FOLDER 中已接受但尚未写入的字节数
+        self.conversion_block = None  # 当前推迟转换的原因（状态展示用）
+        psutil.cpu_percent(interval=None)  # 第一次调用只建立基准
+
+    # === 采样 ===
+
+    def _sample(self):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.sampled_at >= Config.RESOURCE_SAMPLE_INTERVAL:
+                self.memory_percent = psutil.virtual_memory().percent
+                self.cpu_percent = psutil.cpu_percent(interval=None)
+                self.sampled_at = now
+            return self.memory_percent, self.cpu_percent
+
+    def pending_bytes(self, folder):
+        try:
+            if os.stat(folder).st_dev != os.stat(Config.UPLOAD_FOLDER).st_dev:
+                return 0
+        except OSError:
+            pass
+        total = 0
+        for source in self.pending_sources:
+            try:
+                total += source()
+            except Exception as e:
+                print(f"[资源] 统计未写入数据失败: {e}")
+        return total
+
+    def available_bytes(self, folder):
+        """目录所在磁盘可供新数据使用的字节数（可能为负）"""
+        try:
+            free = psutil.disk_usage(folder).free
+        except OSError:
+            return None
+        return free - self.pending_bytes(folder) - Config.RESOURCE_MIN_FREE_DISK
+
+    # === 准入检查（返回 None 表示通过，否则返回 Rejection）===
+
+    def _check(self, kind, folder, needed_bytes, check_cpu=False, count=True):
+        memory, cpu = self._sample()
+        rejection = None
+        available = self.available_bytes(folder)
+        if available is not None and available < needed_bytes:
+            rejection = self.disk_rejection(folder, available, needed_bytes)
+        elif Config.RESOURCE_MAX_MEMORY_PERCENT is not None and memory > Config.RESOURCE_MAX_MEMORY_PERCENT:
+            rejection = Rejection(429, 'memory', f"内存占用过高: {memory:.0f}%", Config.RESOURCE_RETRY_AFTER)
+        elif check_cpu and Config.RESOURCE_MAX_CPU_PERCENT is not None and cpu > Config.RESOURCE_MAX_CPU_PERCENT:
+            rejection = Rejection(429, 'cpu', f"CPU 占用过高: {cpu:.0f}%", Config.RESOURCE_RETRY_AFTER)
+        if rejection is not None and count:
+            admission_rejections.labels(kind, rejection.reason).inc()
+        return rejection
+
+    @staticmethod
+    def disk_rejection(folder, available, needed_bytes):
+        return Rejection(
+            507, 'disk',
+            f"磁盘空间不足: {folder} 可用 {_format_size(available)}"
+            f"（保留 {_format_size(Config.RESOURCE_MIN_FREE_DISK)}），需要 {_format_size(needed_bytes)}",
+            Config.RESOURCE_RETRY_AFTER)
+
+    def check_upload(self, total_size):
+        """新的分块上传会话（total_size 为声明的文件大小）"""
+        return self._check('upload', Config.UPLOAD_FOLDER, total_size)
+
+    def check_download(self, total_size=None):
+        """直链下载：提交时大小未知，只检查保留空间；探测到大小后再检查一次"""
+        return self._check('download', Config.UPLOAD_FOLDER, total_size or 0)
+
+    def check_conversion(self):
+        """开始新转换前的整体检查（内存、CPU、转换目录的保留空间）"""
+        return self._check('conversion', Config.CONVERTED_FOLDER, 0, check_cpu=True, count=False)
+
+    @staticmethod
+    def output_bytes(task):
+        """转换输出需要的空间，按 输入大小 × RESOURCE_OUTPUT_SIZE_RATIO 估算"""
+        try:
+            return int(os.path.getsize(task['input_path']) * Config.RESOURCE_OUTPUT_SIZE_RATIO)
+        except OSError:
+            return 0
+
+    def set_conversion_block(self, rejection):
+        """记录推迟转换的原因；工作线程会反复检查，每次推迟只在开始时计数一次"""
+        if rejection is not None and self.conversion_block is None:
+            admission_rejections.labels('conversion', rejection.reason).inc()
+        self.conversion_block = rejection.message if rejection else None
+
+    def snapshot(self):
+        memory, cpu = self._sample()
+        folders = {}
+        for name, folder in (('upload', Config.UPLOAD_FOLDER), ('converted', Config.CONVERTED_FOLDER)):
+            try:
+                usage = psutil.disk_usage(folder)
+                folders[name] = {'free': usage.free, 'total': usage.total, 'pending': self.pending_bytes(folder)}
+            except OSError:
+                folders[name] = None
+        return {'disk': folders, 'memory_percent': memory, 'cpu_percent': cpu}
+
+
+# 全局实例
+resource_monitor = ResourceMonitor()
@@ -0,0 +1,120 @@
+# result_cache.py
+
+import os
+import json
+import time
+import shlex
+import threading
+
+
+def normalize_args(additional_args):
+    """
+    规范化附加参数：只去掉参数之间多余的空白，顺序保持不变（iw3 参数顺序可能有意义）。
+    引号原样保留（posix=False，不把 Windows 路径中的反斜杠当作转义），"a b" 和 'a b' 是不同的键：
+    转换时参数按空白直接拆分传给 iw3，两种引号得到的命令行本来就不同。
+    """
+    try:
+        return ' '.join(shlex.split(additional_args or '', posix=False))
+    except ValueError:
+        return ' '.join((additional_args or '').split())
+
+
+class ResultCache:
+    """
+    转换结果缓存：(输入内容哈希, 规范化参数) -> 已有的输出文件。
+    同一视频用相同参数再次上传时直接复用输出，不再运行 iw3。
+    每条记录同时保存输出文件的大小和修改时间，命中时由调用方校验输出仍然存在且未被覆盖。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None  # key -> {'filename', 'size', 'mtime', 'created'}
+        self.lookups = 0
+        self.hits = 0
+
+    @staticmethod
+    def make_key(content_hash, additional_args):
+        return f"{content_hash}|{normalize_args(additional_args)}"
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = {}
+            try:
+                if os.path.exists(self.path):
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        self.entries = json.load(f)
+            except Exception as e:
+                print(f"[结果缓存] 读取失败: {e}")
+        return self.entries
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[结果缓存] 保存失败: {e}")
+
+    def lookup(self, content_hash, additional_args, stat_output):
+        """
+        查找可复用的输出文件名，没有时返回 None。
+        :param stat_output: filename -> (size, mtime) 或 None（输出已不存在），用于校验记录是否仍然有效；
+                            mtime 为 None 时（OneDrive 上的文件）只校验大小
+        """
+        if not content_hash:
+            return None
+        key = self.make_key(content_hash, additional_args)
+        with self.lock:
+            self.lookups += 1
+            entry = self._load().get(key)
+        if entry is None:
+            return None
+        stat = stat_output(entry['filename'])
+        if stat is None or stat[0] != entry['size'] or (
+                stat[1] is not None and entry['mtime'] is not None and abs(stat[1] - entry['mtime']) > 1):
+            # 输出已被删除 / 淘汰或被同名文件覆盖
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+                    self._save()
+            return None
+        with self.lock:
+            self.hits += 1
+        return entry['filename']
+
+    def put(self, content_hash, additional_args, filename, size, mtime):
+        if not content_hash:
+            return
+        key = self.make_key(content_hash, additional_args)
+        with self.lock:
+            entries = self._load()
+            # 同名输出被新结果覆盖，旧记录随之失效
+            for old_key in [k for k, e in entries.items() if e['filename'] == filename]:
+                del entries[old_key]
+            entries[key] = {'filename': filename, 'size': size, 'mtime': mtime, 'created': time.time()}
+            self._save()
+
+    def forget_output(self, filename):
+        """输出文件被删除或淘汰时调用"""
+        with self.lock:
+            entries = self._load()
+            stale = [k for k, e in entries.items() if e['filename'] == filename]
+            for key in stale:
+                del entries[key]
+            if stale:
+                self._save()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self._load()),
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_ratio': round(self.hits / self.lookups, 3) if self.lookups else 0.0
+            }
+
+
+# 全局实例（路径相对于工作目录，与 conversion_state.json 一致）
+result_cache = ResultCache('result_cache.json')
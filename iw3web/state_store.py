@@ -0,0 +1,200 @@
+# state_store.py
+
+import os
+import json
+import threading
+from config import Config
+
+
+class StateStore:
+    """
+    持久化状态（队列 / 任务表 / 已转换文件 / 当前状态）。
+
+    - conversion_state.json 是快照，只在压缩时整体重写（先写临时文件再原子替换）
+    - conversion_state.journal 是追加日志，每次变更只追加一行 JSON，写入量与变更大小成正比
+    - 每条日志带递增序号，快照记录已包含的最后序号；压缩过程中崩溃时重放会跳过已合入快照的记录
+    - 已转换文件在内存中是有序字典（旧 -> 新），增删为 O(1)；快照中仍保存为最新在前的列表
+    """
+
+    def __init__(self, snapshot_path, journal_path, compact_every=1000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.lock = threading.RLock()
+        self.state = self._empty_state()
+        self.seq = 0
+        self.journal_records = 0
+        self.journal_file = None
+
+    @staticmethod
+    def _empty_state():
+        return {
+            'queue': [],
+            'tasks': {},
+            'converted_files': {},
+            'current_status': '空闲'
+        }
+
+    # === 加载 / 压缩 ===
+
+    def load(self):
+        """读取快照并重放日志，然后压缩一次，返回状态副本"""
+        with self.lock:
+            self.state = self._empty_state()
+            self.seq = 0
+            try:
+                if os.path.exists(self.snapshot_path):
+                    with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                        snapshot = json.load(f)
+                    self.seq = snapshot.pop('seq', 0)
+                    for key in self.state:
+                        if key in snapshot:
+                            self.state[key] = snapshot[key]
+                    self.state['converted_files'] = dict.fromkeys(reversed(self.state['converted_files']))
+            except Exception as e:
+                print(f"[状态] 加载状态快照失败: {e}")
+
+            replayed = self._replay_journal()
+            if replayed:
+                print(f"[状态] 已重放 {replayed} 条状态日志")
+            self.compact()
+            return self.snapshot()
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return 0
+        replayed = 0
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 最后一行可能在写入时崩溃而不完整，之后的内容全部丢弃
+                    print("[状态] 状态日志末尾不完整，已忽略")
+                    break
+                if record.get('seq', 0) <= self.seq:
+                    continue  # 已包含在快照中
+                self._apply(record)
+                self.seq = record['seq']
+                replayed += 1
+        return replayed
+
+    def compact(self):
+        """把当前状态写成新快照（原子替换），然后清空日志"""
+        with self.lock:
+            snapshot = dict(self.state)
+            snapshot['converted_files'] = list(reversed(self.state['converted_files']))
+            snapshot['seq'] = self.seq
+            tmp_path = self.snapshot_path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+            except Exception as e:
+                print(f"[状态] 写入状态快照失败: {e}")
+                return
+
+            if self.journal_file:
+                self.journal_file.close()
+            # 快照已落盘，截断日志；若此处崩溃，重放时会按序号跳过旧记录
+            self.journal_file = open(self.journal_path, 'w', encoding='utf-8')
+            self.journal_records = 0
+
+    # === 变更 ===
+
+    def _append(self, op, **fields):
+        record = {'op': op, **fields}
+        with self.lock:
+            self.seq += 1
+            record['seq'] = self.seq
+            self._apply(record)
+            try:
+                if self.journal_file is None:
+                    self.journal_file = open(self.journal_path, 'a', encoding='utf-8')
+                self.journal_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                self.journal_file.flush()
+            except Exception as e:
+                print(f"[状态] 写入状态日志失败: {e}")
+            self.journal_records += 1
+            if self.journal_records >= self.compact_every:
+                self.compact()
+
+    def _apply(self, record):
+        state = self.state
+        op = record['op']
+        if op == 'queue_push':
+            state['queue'].append(record['task'])
+        elif op == 'queue_push_front':
+            state['queue'].insert(0, record['task'])
+        elif op == 'queue_update':
+            for task in state['queue']:
+                if task.get('input_path') == record['input_path']:
+                    task.update(record['fields'])
+        elif op == 'queue_remove':
+            state['queue'] = [t for t in state['queue'] if t.get('input_path') != record['input_path']]
+        elif op == 'task_put':
+            state['tasks'][record['task']['task_id']] = record['task']
+        elif op == 'task_update':
+            if record['task_id'] in state['tasks']:
+                state['tasks'][record['task_id']].update(record['fields'])
+        elif op == 'task_remove':
+            state['tasks'].pop(record['task_id'], None)
+        elif op in ('uploaded_add', 'uploaded_remove'):
+            pass  # 旧版日志：待转换列表现在由任务表生成
+        elif op == 'converted_add':
+            state['converted_files'][record['name']] = None
+        elif op == 'converted_remove':
+            state['converted_files'].pop(record['name'], None)
+        elif op == 'converted_set':
+            state['converted_files'] = dict.fromkeys(reversed(record['names']))
+        elif op == 'status':
+            state['current_status'] = record['status']
+        else:
+            print(f"[状态] 未知的状态日志操作: {op}")
+
+    def queue_push(self, task, front=False):
+        # 保存副本：之后对任务的修改只通过 queue_update 记录，不会悄悄改动快照
+        self._append('queue_push_front' if front else 'queue_push', task=dict(task))
+
+    def queue_remove(self, input_path):
+        self._append('queue_remove', input_path=input_path)
+
+    def queue_update(self, input_path, **fields):
+        """更新排队任务的字段（优先级 / 排序调整量）"""
+        self._append('queue_update', input_path=input_path, fields=fields)
+
+    def task_put(self, task):
+        self._append('task_put', task=dict(task))
+
+    def task_update(self, task_id, fields):
+        self._append('task_update', task_id=task_id, fields=fields)
+
+    def task_remove(self, task_id):
+        self._append('task_remove', task_id=task_id)
+
+    def converted_add(self, name):
+        self._append('converted_add', name=name)
+
+    def converted_remove(self, name):
+        self._append('converted_remove', name=name)
+
+    def converted_set(self, names):
+        self._append('converted_set', names=list(names))
+
+    def set_status(self, status):
+        self._append('status', status=status)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'queue': [dict(task) for task in self.state['queue']],
+                'tasks': {task_id: dict(task) for task_id, task in self.state['tasks'].items()},
+                'converted_files': list(reversed(self.state['converted_files'])),
+                'current_status': self.state['current_status']
+            }
+
+
+# 全局实例（路径相对于工作目录，与原 conversion_state.json 一致）
+state_store = StateStore('conversion_state.json', 'conversion_state.journal', Config.STATE_COMPACT_EVERY)
@@ -0,0 +1,50 @@
+# status_events.py
+
+import threading
+import itertools
+from collections import deque
+
+
+class StatusBroadcaster:
+    """
+    带版本号的状态变更通道。
+    每次状态变更发布一条增量记录（版本号 +1），客户端带上自己已知的版本号即可只取之后的变更；
+    没有变更时等待方阻塞在条件变量上，不占用 CPU。
+    """
+
+    def __init__(self, history=1000):
+        self.cond = threading.Condition()
+        self.version = 0
+        self.changes = deque(maxlen=history)
+
+    def publish(self, change):
+        with self.cond:
+            self.version += 1
+            self.changes.append((self.version, change))
+            self.cond.notify_all()
+            return self.version
+
+    def changes_since(self, since):
+        """
+        返回 since 之后的变更列表 [(version, change), ...]。
+        since 太旧（历史已被覆盖）或来自未来（服务重启过）时返回 None，调用方需要重新获取全量状态。
+        """
+        with self.cond:
+            if since > self.version:
+                return None
+            if since == self.version:
+                return []
+            if not self.changes or self.changes[0][0] > since + 1:
+                return None
+            offset = since + 1 - self.changes[0][0]
+            return list(itertools.islice(self.changes, offset, None))
+
+    def wait(self, since, timeout):
+        """等待直到版本号超过 since 或超时，返回当前版本号"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.version != since, timeout=timeout)
+            return self.version
+
+
+# 全局实例
+status_events = StatusBroadcaster()
@@ -0,0 +1,108 @@
+# stop_windows.py
+
+from datetime import datetime, timedelta
+from config import Config
+
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+DAY_GROUPS = {
+    'daily': range(7),
+    'weekdays': range(5),
+    'weekends': (5, 6)
+}
+
+
+def parse_days(spec):
+    """'daily' / 'weekdays' / 'weekends' / 'mon' ... 'sun'，或它们的列表 -> 星期序号集合（0 为周一）"""
+    if isinstance(spec, str):
+        spec = spec.lower()
+        if spec in DAY_GROUPS:
+            return set(DAY_GROUPS[spec])
+        if spec in WEEKDAYS:
+            return {WEEKDAYS.index(spec)}
+        raise ValueError(f"无法识别的星期: {spec}")
+    days = set()
+    for item in spec:
+        days |= parse_days(item)
+    return days
+
+
+class StopSchedule:
+    """
+    每周的停止时间段（这段时间内不新开始任务）。
+    配置 STOP_WINDOWS 为 (星期, 开始, 结束) 列表；为空时沿用 STOP_TIME_START / STOP_TIME_END 作为每天的时间段。
+    结束早于开始表示跨天（例如周五 23:00 ~ 周六 03:00），开始等于结束表示整天。
+    每次调用都按当前配置展开，修改 Config 后立即生效。
+    """
+
+    def _windows(self):
+        windows = Config.STOP_WINDOWS
+        if not windows and Config.STOP_TIME_START is not None and Config.STOP_TIME_END is not None:
+            windows = [('daily', Config.STOP_TIME_START, Config.STOP_TIME_END)]
+        return [(parse_days(days), start, end) for days, start, end in windows or []]
+
+    def intervals(self, now=None, days=8):
+        """把时间段展开成 [7 天前, now + days 天) 内的具体时间区间，重叠或相接的区间会合并"""
+        now = now or datetime.now()
+        intervals = []
+        for days_of_week, start, end in self._windows():
+            for offset in range(-7, days):
+                date = now.date() + timedelta(days=offset)
+                if date.weekday() not in days_of_week:
+                    continue
+                start_dt = datetime.combine(date, start)
+                end_dt = datetime.combine(date if end > start else date + timedelta(days=1), end)
+                intervals.append([start_dt, end_dt])
+        intervals.sort()
+        merged = []
+        for interval in intervals:
+            if merged and interval[0] <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], interval[1])
+            else:
+                merged.append(interval)
+        return merged
+
+    def blocked_until(self, now=None):
+        """当前在停止时间段内时返回恢复时间，否则返回 None"""
+        now = now or datetime.now()
+        for start, end in self.intervals(now):
+            if start <= now < end:
+                return end
+        return None
+
+    def next_start(self, now=None):
+        """下一个停止时间段的开始时间，没有配置时返回 None"""
+        now = now or datetime.now()
+        for start, _ in self.intervals(now):
+            if start > now:
+                return start
+        return None
+
+    def gap(self, now=None):
+        """
+        当前所在的空闲区间：(距离下一个停止时间段开始的秒数, 整个空闲区间的秒数)。
+        在停止时间段内或没有配置时返回 None。
+        """
+        now = now or datetime.now()
+        previous_end = None
+        for start, end in self.intervals(now):
+            if start <= now < end:
+                return None
+            if start > now:
+                length = (start - previous_end).total_seconds() if previous_end else float('inf')
+                return (start - now).total_seconds(), length
+            previous_end = end
+        return None
+
+    def snapshot(self, now=None):
+        now = now or datetime.now()
+        resume = self.blocked_until(now)
+        next_start = self.next_start(now)
+        return {
+            'blocked_until': resume.isoformat(timespec='seconds') if resume else None,
+            'next_window': next_start.isoformat(timespec='seconds') if next_start else None,
+            'gap_seconds': round((next_start - now).total_seconds()) if next_start else None
+        }
+
+
+# 全局实例
+stop_schedule = StopSchedule()
@@ -0,0 +1,154 @@
+# storage_index.py
+
+import os
+import json
+import heapq
+import threading
+
+
+class StorageIndex:
+    """
+    已转换文件的存储索引：记录每个文件的大小和修改时间，维护总大小和按修改时间排序的淘汰堆。
+    - 新增 / 删除文件时增量更新，淘汰决策为 O(log n)，不再每个任务遍历目录或列出 OneDrive
+    - 堆使用惰性删除：删除只改字典，弹出时跳过已失效的堆元素
+    - 后台定期全量扫描校准（reconcile），扫描期间发生的增删以索引为准
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.lock = threading.RLock()
+        self.mode = None
+        self.entries = {}  # name -> (size, mtime)
+        self.heap = []  # (mtime, name)
+        self.total_bytes = 0
+        self.generation = 0
+        self.touched = {}  # name -> 最近一次增删时的 generation
+        self.dirty = False
+
+    def add(self, name, size, mtime):
+        with self.lock:
+            old = self.entries.get(name)
+            if old:
+                self.total_bytes -= old[0]
+            self.entries[name] = (size, mtime)
+            self.total_bytes += size
+            heapq.heappush(self.heap, (mtime, name))
+            self._touch(name)
+
+    def remove(self, name):
+        with self.lock:
+            old = self.entries.pop(name, None)
+            if old:
+                self.total_bytes -= old[0]
+            self._touch(name)
+            return old is not None
+
+    def _touch(self, name):
+        self.generation += 1
+        self.touched[name] = self.generation
+        self.dirty = True
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self._rebuild_heap()  # 失效元素过多时重建，避免堆无限增长
+
+    def _rebuild_heap(self):
+        self.heap = [(mtime, name) for name, (size, mtime) in self.entries.items()]
+        heapq.heapify(self.heap)
+
+    def get(self, name):
+        """返回 (size, mtime)，不存在时返回 None"""
+        with self.lock:
+            return self.entries.get(name)
+
+    def oldest(self, skip=()):
+        """返回最旧的 (name, size)，跳过 skip 中的文件；没有时返回 None"""
+        with self.lock:
+            skipped = []
+            result = None
+            while self.heap:
+                mtime, name = self.heap[0]
+                entry = self.entries.get(name)
+                if entry is None or entry[1] != mtime:
+                    heapq.heappop(self.heap)  # 已删除或已更新的失效元素
+                    continue
+                if name in skip:
+                    skipped.append(heapq.heappop(self.heap))
+                    continue
+                result = (name, entry[0])
+                break
+            for item in skipped:
+                heapq.heappush(self.heap, item)
+            return result
+
+    def names_by_mtime(self, newest_first=True):
+        with self.lock:
+            items = sorted(self.entries.items(), key=lambda item: item[1][1], reverse=newest_first)
+            return [name for name, _ in items]
+
+    # === 全量校准 ===
+
+    def begin_scan(self):
+        """扫描开始前调用，返回当前 generation"""
+        with self.lock:
+            return self.generation
+
+    def reconcile(self, scanned, scan_generation, mode):
+        """
+        用全量扫描结果替换索引。
+        :param scanned: {name: (size, mtime)}
+        :param scan_generation: begin_scan() 的返回值；之后增删过的文件以索引当前状态为准
+        """
+        with self.lock:
+            entries = dict(scanned)
+            for name, generation in self.touched.items():
+                if generation > scan_generation:
+                    if name in self.entries:
+                        entries[name] = self.entries[name]
+                    else:
+                        entries.pop(name, None)
+            self.touched = {name: g for name, g in self.touched.items() if g > scan_generation}
+            self.entries = entries
+            self.total_bytes = sum(size for size, _ in entries.values())
+            self.mode = mode
+            self._rebuild_heap()
+            self.dirty = True
+
+    # === 持久化 ===
+
+    def load(self, mode):
+        """读取保存的索引，存储模式（本地 / OneDrive）不一致时忽略"""
+        try:
+            if not os.path.exists(self.index_path):
+                return False
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('mode') != mode:
+                return False
+            with self.lock:
+                self.entries = {name: (size, mtime) for name, (size, mtime) in data['entries'].items()}
+                self.total_bytes = sum(size for size, _ in self.entries.values())
+                self.mode = mode
+                self._rebuild_heap()
+            return True
+        except Exception as e:
+            print(f"[存储索引] 加载失败: {e}")
+            return False
+
+    def save(self):
+        """原子写入索引文件（只在有变更时写）"""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {'mode': self.mode, 'entries': {name: list(entry) for name, entry in self.entries.items()}}
+            self.dirty = False
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            self.dirty = True
+            print(f"[存储索引] 保存失败: {e}")
+
+
+# 全局实例（路径相对于工作目录，与 conversion_state.json 一致）
+storage_index = StorageIndex('storage_index.json')
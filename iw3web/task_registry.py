@@ -0,0 +1,229 @@
+# task_registry.py
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from config import Config
+from state_store import state_store
+from status_events import status_events
+
+# 任务状态及允许的转换：
+#   queued -> converting -> done                    （本地存储）
+#   queued -> converting -> uploading -> done       （OneDrive：转换完成后在后台上传）
+#   converting -> queued                            （服务关闭时放回队列）
+#   queued / converting -> cancelled，converting / uploading -> failed
+TRANSITIONS = {
+    'queued': {'converting', 'cancelled'},
+    'converting': {'queued', 'uploading', 'done', 'failed', 'cancelled'},
+    'uploading': {'done', 'failed'},
+    'done': set(),
+    'failed': set(),
+    'cancelled': set()
+}
+FINAL_STATES = {'done', 'failed', 'cancelled'}
+
+# 进入某个状态时记录的时间戳（uploaded 在创建任务时记录，cloud_uploaded 在 uploading -> done 时记录）
+STATE_TIMESTAMPS = {
+    'queued': 'queued',
+    'converting': 'started',
+    'uploading': 'finished',
+    'done': 'finished',
+    'failed': 'finished',
+    'cancelled': 'finished'
+}
+
+
+class TaskRegistry:
+    """
+    以任务 ID 为键的任务表，取代按原始文件名识别任务。
+    - 按 ID 查找 / 更新是 O(1)；按输出文件名反查（上传阶段回调、删除已转换文件）也是 O(1)
+    - 每次状态转换记录时间戳，并写入状态日志（task_put / task_update），重启后恢复
+    - 已结束的任务最多保留 TASK_HISTORY_LIMIT 个，超出时删除最早结束的
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tasks = OrderedDict()  # task_id -> record
+        self.by_output = {}  # output_filename -> task_id
+        self.finished = deque()  # 已结束任务的 ID（按结束顺序）
+
+    # === 加载 ===
+
+    def load(self, records):
+        """从状态快照恢复；上次没有正常关闭而停在 converting 的任务由调用方决定放回队列还是标记失败"""
+        with self.lock:
+            self.tasks.clear()
+            self.by_output.clear()
+            self.finished.clear()
+            for record in sorted(records.values(), key=lambda r: r['timestamps'].get('uploaded', 0)):
+                self.tasks[record['task_id']] = record
+                if record.get('output_filename'):
+                    self.by_output[record['output_filename']] = record['task_id']
+            for record in sorted(self.tasks.values(), key=lambda r: r['timestamps'].get('finished', 0)):
+                if record['state'] in FINAL_STATES:
+                    self.finished.append(record['task_id'])
+
+    # === 创建 / 查询 ===
+
+    def create(self, task, uploaded_at=None):
+        """
+        登记新任务（状态为 queued），返回 task_id。
+        task 中已有 task_id（例如旧版状态文件恢复的任务）时沿用。
+        """
+        now = time.time()
+        task_id = task.setdefault('task_id', uuid.uuid4().hex[:12])
+        record = {
+            'task_id': task_id,
+            'filename': task['original_filename'],
+            'output_filename': task.get('output_filename'),
+            'state': 'queued',
+            'timestamps': {'uploaded': uploaded_at or now, 'queued': now},
+            'message': None
+        }
+        with self.lock:
+            self.tasks[task_id] = record
+            state_store.task_put(record)
+        self._publish(record)
+        return task_id
+
+    def get(self, task_id):
+        with self.lock:
+            record = self.tasks.get(task_id)
+            return self._copy(record) if record else None
+
+    def find_by_output(self, output_filename):
+        with self.lock:
+            task_id = self.by_output.get(output_filename)
+            return self._copy(self.tasks[task_id]) if task_id in self.tasks else None
+
+    def output_in_use(self, output_filename, task_id=None):
+        """输出文件名是否已被另一个尚未结束的任务占用"""
+        with self.lock:
+            owner = self.by_output.get(output_filename)
+            return owner is not None and owner != task_id and \
+                owner in self.tasks and self.tasks[owner]['state'] not in FINAL_STATES
+
+    def queued(self):
+        """排队中的任务（最新的在前）"""
+        with self.lock:
+            return [self._copy(r) for r in reversed(self.tasks.values()) if r['state'] == 'queued']
+
+    def snapshot(self, limit=100):
+        """最近的任务（最新的在前）"""
+        with self.lock:
+            records = []
+            for record in reversed(self.tasks.values()):
+                if len(records) >= limit:
+                    break
+                records.append(self._copy(record))
+            return records
+
+    # === 状态转换 ===
+
+    def reserve_output(self, task_id, original_filename, exists):
+        """
+        为任务分配不与已有文件 / 其他任务冲突的输出文件名（同名时加 " (1)"、" (2)" 后缀）。
+        :param exists: name -> bool，输出位置是否已有该文件
+        """
+        stem, ext = os.path.splitext(original_filename)
+        with self.lock:
+            record = self.tasks.get(task_id)
+            if record and record.get('output_filename'):
+                return record['output_filename']  # 被中断后重新转换的任务沿用原来的输出名
+            name = self._free_output_name(stem, ext, task_id, exists)
+            if record:
+                self.by_output[name] = task_id
+                self._update(record, output_filename=name)
+            return name
+
+    def change_output_extension(self, task_id, ext, exists):
+        """
+        iw3 实际输出的格式与预留的文件名不同时（批量转换由 iw3 决定输出格式），
+        按原文件名 + 该扩展名重新分配不冲突的输出文件名并返回。
+        """
+        with self.lock:
+            record = self.tasks.get(task_id)
+            if record is None:
+                return None
+            current = record.get('output_filename')
+            if current and os.path.splitext(current)[1].lower() == ext.lower():
+                return current
+            if self.by_output.get(current) == task_id:
+                del self.by_output[current]
+            name = self._free_output_name(os.path.splitext(record['filename'])[0], ext, task_id, exists)
+            self.by_output[name] = task_id
+            self._update(record, output_filename=name)
+            return name
+
+    def _free_output_name(self, stem, ext, task_id, exists):
+        """调用方持有 self.lock"""
+        name, counter = stem + ext, 0
+        while exists(name) or self.output_in_use(name, task_id):
+            counter += 1
+            name = f"{stem} ({counter}){ext}"
+        return name
+
+    def set_output(self, task_id, output_filename):
+        """输出文件名变化（例如结果缓存命中后复用已有文件）"""
+        with self.lock:
+            record = self.tasks.get(task_id)
+            if record is None or record.get('output_filename') == output_filename:
+                return
+            if self.by_output.get(record.get('output_filename')) == task_id:
+                del self.by_output[record['output_filename']]
+            # 复用的文件仍属于正在上传它的任务，上传完成的回调要找到那个任务
+            if not self.output_in_use(output_filename, task_id):
+                self.by_output[output_filename] = task_id
+            self._update(record, output_filename=output_filename)
+
+    def transition(self, task_id, state, message=None):
+        """
+        把任务切换到新状态并记录时间戳，非法的状态转换只打印警告并返回 False。
+        """
+        with self.lock:
+            record = self.tasks.get(task_id)
+            if record is None:
+                return False
+            if state not in TRANSITIONS[record['state']]:
+                print(f"[任务] 忽略非法状态转换 {task_id}: {record['state']} -> {state}")
+                return False
+            timestamps = dict(record['timestamps'])
+            timestamps[STATE_TIMESTAMPS[state]] = time.time()
+            if record['state'] == 'uploading' and state == 'done':
+                timestamps['finished'] = record['timestamps'].get('finished')
+                timestamps['cloud_uploaded'] = time.time()
+            self._update(record, state=state, timestamps=timestamps, message=message)
+            if state in FINAL_STATES:
+                self.finished.append(task_id)
+                self._prune()
+        return True
+
+    def _update(self, record, **fields):
+        record.update(fields)
+        state_store.task_update(record['task_id'], fields)
+        self._publish(record)
+
+    def _prune(self):
+        while len(self.finished) > Config.TASK_HISTORY_LIMIT:
+            task_id = self.finished.popleft()
+            record = self.tasks.pop(task_id, None)
+            if record is None:
+                continue
+            if self.by_output.get(record.get('output_filename')) == task_id:
+                del self.by_output[record['output_filename']]
+            state_store.task_remove(task_id)
+
+    # === 状态推送 ===
+
+    @staticmethod
+    def _copy(record):
+        return {**record, 'timestamps': dict(record['timestamps'])}
+
+    def _publish(self, record):
+        status_events.publish({'type': 'task', 'task': self._copy(record)})
+
+
+# 全局实例
+task_registry = TaskRegistry()
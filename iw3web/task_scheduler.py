@@ -0,0 +1,371 @@
+# task_scheduler.py
+
+import os
+import time
+import uuid
+import queue
+import heapq
+import itertools
+import threading
+import subprocess
+from config import Config
+from status_events import status_events
+
+
+def estimate_duration_from_size(input_path):
+    """按文件大小和 SCHEDULER_BYTES_PER_SECOND 粗略估算视频时长（秒），不读取文件内容"""
+    try:
+        return os.path.getsize(input_path) / Config.SCHEDULER_BYTES_PER_SECOND
+    except OSError:
+        return 0.0
+
+
+def estimate_duration(input_path):
+    """
+    估算视频时长（秒），用于短任务优先和停止时间段前的任务筛选。
+    优先用 ffprobe 读取容器时长；没有 ffprobe 或读取失败时按文件大小估算。
+    ffprobe 最多要 10 秒，只在后台线程中调用（TaskScheduler._probe_worker），不在请求线程中调用。
+    """
+    try:
+        result = subprocess.run(
+            [Config.FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=duration',
+             '-of', 'default=noprint_wrappers=1:nokey=1', input_path],
+            capture_output=True, text=True, timeout=10
+        )
+        if result.returncode == 0:
+            return float(result.stdout.strip())
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        pass
+    return estimate_duration_from_size(input_path)
+
+
+class QueueEntry:
+    __slots__ = ('task', 'seq', 'version')
+
+    def __init__(self, task, seq):
+        self.task = task
+        self.seq = seq
+        self.version = 0
+
+
+class TaskScheduler:
+    """
+    转换队列：按排序键从小到大出队的最小堆，取代原来的 FIFO queue.Queue。
+
+    排序键 = 加入时间 - 优先级 × SCHEDULER_PRIORITY_STEP [+ 预计时长 × SCHEDULER_SJF_WEIGHT] + 手动调整量
+    - 优先级越高越早出队，每高 1 级相当于提前 SCHEDULER_PRIORITY_STEP 秒加入
+    - sjf 模式下长视频的键更大；但键以加入时间为基准，排队越久的任务相对新任务越靠前（老化），不会饿死
+    - 上移 / 下移 / 置顶通过调整量（sort_adjust）实现，与优先级一样随任务持久化
+
+    键与当前时间无关，排队期间不需要重新计算。删除和调整优先级采用惰性删除：
+    旧的堆项通过版本号失效，出队时跳过，插入 / 删除 / 调整都是 O(log n)。
+
+    入队时预计时长先按文件大小估算（不阻塞上传请求），后台线程再逐个用 ffprobe 读取实际时长，
+    更新后同样通过惰性删除重新入堆，并回调 duration_callbacks（main 注册后用于持久化）。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.heap = []  # (key, seq, version, task_id)
+        self.entries = {}  # task_id -> QueueEntry
+        self.counter = itertools.count()
+        self.publish_lock = threading.Lock()
+        self.publish_timer = None
+        self.last_publish = 0
+        self.probe_queue = queue.Queue()  # 等待 ffprobe 读取时长的 task_id
+        self.probe_thread = None
+        self.duration_callbacks = []  # 读取到实际时长后的回调（参数为任务）
+
+    # === 排序键 ===
+
+    @staticmethod
+    def _key(task):
+        key = task['enqueued_at'] - task.get('priority', 0) * Config.SCHEDULER_PRIORITY_STEP + task.get('sort_adjust', 0)
+        if Config.SCHEDULER_POLICY == 'sjf':
+            key += task.get('estimated_duration', 0) * Config.SCHEDULER_SJF_WEIGHT
+        return key
+
+    def _push(self, task_id):
+        entry = self.entries[task_id]
+        entry.version += 1
+        heapq.heappush(self.heap, (self._key(entry.task), entry.seq, entry.version, task_id))
+        # 失效的堆项过多时重建，避免反复调整后堆无限增长
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [(self._key(e.task), e.seq, e.version, tid) for tid, e in self.entries.items()]
+            heapq.heapify(self.heap)
+
+    def _ordered(self):
+        """按出队顺序排列的任务 id（O(n log n)，只用于上移 / 下移和状态展示）"""
+        return sorted(self.entries, key=lambda tid: (self._key(self.entries[tid].task), self.entries[tid].seq))
+
+    # === 入队 / 出队 / 删除 ===
+
+    @staticmethod
+    def prepare(task):
+        """
+        补全 task_id / enqueued_at / priority / estimated_duration（不加入队列）。
+        调用方可以先持久化补全后的任务，再调用 put 让工作线程看到它。
+        """
+        task.setdefault('task_id', uuid.uuid4().hex[:12])
+        task.setdefault('enqueued_at', time.time())
+        task.setdefault('priority', 0)
+        if 'estimated_duration' not in task:
+            task['estimated_duration'] = round(estimate_duration_from_size(task['input_path']), 1)
+        return task
+
+    def put(self, task, front=False):
+        """
+        加入任务，返回 task_id。task 中的 priority / sort_adjust / enqueued_at 会被补全并随任务持久化，
+        重启后按原来的位置恢复。front=True 时排到当前队首之前（用于放回被中断的任务）。
+        """
+        self.prepare(task)
+
+        with self.lock:
+            if front:
+                task['sort_adjust'] = 0
+                if self.entries:
+                    head = min(self._key(e.task) for e in self.entries.values())
+                    task['sort_adjust'] = head - self._key(task) - 1
+            self.entries[task['task_id']] = QueueEntry(task, next(self.counter))
+            self._push(task['task_id'])
+            if not task.get('duration_probed'):
+                self._schedule_probe(task['task_id'])
+        self._publish()
+        return task['task_id']
+
+    # === 后台读取视频时长 ===
+
+    def _schedule_probe(self, task_id):
+        """调用方持有 self.lock"""
+        self.probe_queue.put(task_id)
+        if self.probe_thread is None:
+            self.probe_thread = threading.Thread(target=self._probe_worker, daemon=True)
+            self.probe_thread.start()
+
+    def _probe_worker(self):
+        while True:
+            task_id = self.probe_queue.get()
+            with self.lock:
+                entry = self.entries.get(task_id)
+                input_path = entry.task['input_path'] if entry else None
+            if input_path is None:
+                continue  # 已出队或已删除
+            duration = round(estimate_duration(input_path), 1)
+            with self.lock:
+                entry = self.entries.get(task_id)
+                if entry is None:
+                    continue
+                entry.task['estimated_duration'] = duration
+                entry.task['duration_probed'] = True
+                if Config.SCHEDULER_POLICY == 'sjf':
+                    self._push(task_id)  # 排序键变化，旧堆项失效
+            for callback in self.duration_callbacks:
+                try:
+                    callback(entry.task)
+                except Exception as e:
+                    print(f"[调度] 时长更新回调失败 {task_id}: {e}")
+            self._publish()
+
+    def pop(self, admit=None):
+        """
+        取出排序键最小的任务，队列为空时返回 None。
+        admit(task) 返回 False 的任务留在队列中原来的位置，取下一个（例如停止时间段前放不下的长任务）。
+        """
+        with self.lock:
+            task = None
+            skipped = []
+            while self.heap:
+                item = heapq.heappop(self.heap)
+                entry = self.entries.get(item[3])
+                if entry is None or entry.version != item[2]:
+                    continue
+                if admit is not None and not admit(entry.task):
+                    skipped.append(item)
+                    continue
+                del self.entries[item[3]]
+                task = entry.task
+                break
+            for item in skipped:
+                heapq.heappush(self.heap, item)
+        if task is not None:
+            self._publish()
+        return task
+
+    def take(self, admit, limit, depth):
+        """
+        按出队顺序查看队首最多 depth 个任务，取出其中最多 limit 个 admit(task) 为 True 的任务，其余留在原位。
+        用于把队首附近参数相同的小文件合并成一批；只看队首附近，不会把队尾的任务大幅提前。
+        """
+        taken = []
+        with self.lock:
+            skipped = []
+            examined = 0
+            while self.heap and len(taken) < limit and examined < depth:
+                item = heapq.heappop(self.heap)
+                entry = self.entries.get(item[3])
+                if entry is None or entry.version != item[2]:
+                    continue
+                examined += 1
+                if admit(entry.task):
+                    del self.entries[item[3]]
+                    taken.append(entry.task)
+                else:
+                    skipped.append(item)
+            for item in skipped:
+                heapq.heappush(self.heap, item)
+        if taken:
+            self._publish()
+        return taken
+
+    def remove(self, task_id):
+        """从队列中删除任务，返回被删除的任务（不存在时返回 None）"""
+        with self.lock:
+            entry = self.entries.pop(task_id, None)
+        if entry is None:
+            return None
+        self._publish()
+        return entry.task
+
+    def find(self, original_filename):
+        """按文件名查找排队中的任务"""
+        with self.lock:
+            for entry in self.entries.values():
+                if entry.task['original_filename'] == original_filename:
+                    return entry.task
+        return None
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def empty(self):
+        return len(self) == 0
+
+    # === 调整顺序 ===
+
+    def set_priority(self, task_id, priority):
+        """修改优先级，返回任务（不存在时返回 None）"""
+        with self.lock:
+            entry = self.entries.get(task_id)
+            if entry is None:
+                return None
+            entry.task['priority'] = int(priority)
+            self._push(task_id)
+        self._publish()
+        return entry.task
+
+    def move(self, task_id, direction):
+        """
+        在当前出队顺序中移动任务：up / down 与相邻任务交换位置，top / bottom 移到队首 / 队尾。
+        返回受影响的任务列表（调用方据此持久化 sort_adjust），任务不存在时返回 None。
+        """
+        with self.lock:
+            if task_id not in self.entries:
+                return None
+            order = self._ordered()
+            index = order.index(task_id)
+            task = self.entries[task_id].task
+            if direction in ('up', 'down'):
+                other_index = index - 1 if direction == 'up' else index + 1
+                if not 0 <= other_index < len(order):
+                    return []
+                other = self.entries[order[other_index]].task
+                key, other_key = self._key(task), self._key(other)
+                # 交换两者的排序键；键相同（按加入顺序排列）时再错开一点
+                task['sort_adjust'] = task.get('sort_adjust', 0) + other_key - key
+                other['sort_adjust'] = other.get('sort_adjust', 0) + key - other_key
+                nudge = -0.001 if direction == 'up' else 0.001
+                if key == other_key:
+                    task['sort_adjust'] += nudge
+                self._push(task_id)
+                self._push(other['task_id'])
+                changed = [task, other]
+            elif direction in ('top', 'bottom'):
+                if (index == 0 and direction == 'top') or (index == len(order) - 1 and direction == 'bottom'):
+                    return []
+                target = self._key(self.entries[order[0 if direction == 'top' else -1]].task)
+                task['sort_adjust'] = task.get('sort_adjust', 0) + target - self._key(task) + (-1 if direction == 'top' else 1)
+                self._push(task_id)
+                changed = [task]
+            else:
+                raise ValueError(f"未知的移动方向: {direction}")
+        self._publish()
+        return changed
+
+    # === 状态 ===
+
+    def snapshot(self, limit=None):
+        """按出队顺序的任务列表；指定 limit 时只取队首 limit 个（O(n log limit)）"""
+        now = time.time()
+        with self.lock:
+            if limit is None:
+                order = self._ordered()
+            else:
+                order = heapq.nsmallest(limit, self.entries,
+                                        key=lambda tid: (self._key(self.entries[tid].task), self.entries[tid].seq))
+            return [{
+                'task_id': tid,
+                'filename': self.entries[tid].task['original_filename'],
+                'priority': self.entries[tid].task.get('priority', 0),
+                'estimated_duration': self.entries[tid].task.get('estimated_duration'),
+                'waiting': round(now - self.entries[tid].task['enqueued_at'])
+            } for tid in order]
+
+    def _publish(self):
+        """
+        发布队列变化，每秒最多一次：间隔内的多次变化合并，在间隔结束时发布一次最新的队首。
+        批量上传或重启恢复上万个任务时，不会每次入队都重新排序整个队列。
+        """
+        with self.publish_lock:
+            if self.publish_timer is not None:
+                return
+            delay = self.last_publish + 1 - time.monotonic()
+            if delay > 0:
+                self.publish_timer = threading.Timer(delay, self._publish_now)
+                self.publish_timer.daemon = True
+                self.publish_timer.start()
+                return
+            self.last_publish = time.monotonic()
+        self._publish_now(timer=False)
+
+    def _publish_now(self, timer=True):
+        if timer:
+            with self.publish_lock:
+                self.publish_timer = None
+                self.last_publish = time.monotonic()
+        status_events.publish({'type': 'queue', 'tasks': self.snapshot(Config.QUEUE_DISPLAY_LIMIT), 'total': len(self)})
+
+
+class ConversionTimeModel:
+    """
+    预计转换耗时 = 视频时长 × 系数。
+    系数初始为 CONVERSION_TIME_RATIO，每完成一个任务按实际耗时做指数滑动平均修正。
+    """
+
+    def __init__(self, smoothing=0.3):
+        self.lock = threading.Lock()
+        self.smoothing = smoothing
+        self.ratio = None
+        self.samples = 0
+
+    def current_ratio(self):
+        with self.lock:
+            return self.ratio if self.ratio is not None else Config.CONVERSION_TIME_RATIO
+
+    def predict(self, task):
+        """预计转换耗时（秒）"""
+        return task.get('estimated_duration', 0) * self.current_ratio()
+
+    def observe(self, task, elapsed):
+        duration = task.get('estimated_duration')
+        if not duration or duration <= 0 or elapsed <= 0:
+            return
+        sample = elapsed / duration
+        with self.lock:
+            self.ratio = sample if self.ratio is None else self.ratio * (1 - self.smoothing) + sample * self.smoothing
+            self.samples += 1
+
+
+# 全局实例
+task_scheduler = TaskScheduler()
+conversion_time_model = ConversionTimeModel()
@@ -0,0 +1,272 @@
+# fake_graph_server.py
+"""
+本地 Microsoft Graph 替身服务器，用于在没有真实 OneDrive 的情况下测试上传 / 续传 / 删除。
+
+只实现 onedrive_client.py 用到的接口，文件保存在内存中。可以在上传途中注入失败：
+    --fail-every N     每 N 个分块请求失败一次（返回 500）
+    --drop-after BYTES 收到的数据累计超过 BYTES 后，下一个分块请求直接断开连接（只触发一次）
+
+用法:
+    python tools/fake_graph_server.py --port 8765 --write-token
+然后在 config.py 中设置:
+    USE_ONEDRIVE_STORAGE = True
+    GRAPH_API_BASE_URL = 'http://127.0.0.1:8765'
+--write-token 会把一个长期有效的假令牌写入 Config.TOKEN_PATH，避免向微软登录服务请求令牌。
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, unquote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import Config
+
+lock = threading.Lock()
+folders = {}  # path -> folder_id
+files = {}  # (folder_id, name) -> {'id', 'name', 'data', 'modified'}
+sessions = {}  # session_id -> {'folder_id', 'name', 'size', 'received': bytearray, 'ranges': set}
+stats = {'chunk_requests': 0, 'failed_requests': 0, 'bytes_received': 0, 'item_requests': 0}
+options = argparse.Namespace(fail_every=0, drop_after=0)
+
+
+def missing_ranges(session):
+    """把已收到的字节区间换算成 Graph 的 nextExpectedRanges 格式"""
+    ranges, pos = [], 0
+    for start, end in sorted(session['ranges']):
+        if start > pos:
+            ranges.append(f"{pos}-{start - 1}")
+        pos = max(pos, end + 1)
+    if pos < session['size']:
+        ranges.append(f"{pos}-")
+    return ranges
+
+
+def drive_item(entry):
+    return {
+        'id': entry['id'],
+        'name': entry['name'],
+        'size': len(entry['data']),
+        'lastModifiedDateTime': entry['modified'],
+        'file': {'mimeType': 'application/octet-stream'}
+    }
+
+
+class GraphHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _route(self):
+        """返回 (kind, args)：folder / item / children / session"""
+        path = unquote(urlparse(self.path).path)
+        if path.startswith('/content/'):
+            return 'download', path[len('/content/'):]
+        if path.startswith('/upload/'):
+            return 'session', path[len('/upload/'):]
+        _, _, rest = path.partition('/drive/')
+        if rest.startswith('root:'):
+            return 'folder', rest[len('root:'):]
+        if rest == 'root/children':
+            return 'root_children', None
+        if rest.startswith('items/'):
+            rest = rest[len('items/'):]
+            if rest.endswith('/children'):
+                return 'children', rest[:-len('/children')]
+            if ':/' in rest:
+                folder_id, _, name = rest.partition(':/')
+                if name.endswith(':/createUploadSession'):
+                    return 'create_session', (folder_id, name[:-len(':/createUploadSession')])
+                if name.endswith(':/content'):
+                    return 'content', (folder_id, name[:-len(':/content')])
+                return 'item_by_path', (folder_id, name)
+            return 'item_by_id', rest
+        return None, None
+
+    def _item_with_link(self, entry):
+        """按文件查询时和 Graph 一样附带预授权下载链接"""
+        item = drive_item(entry)
+        item['@microsoft.graph.downloadUrl'] = f"http://{self.headers.get('Host')}/content/{entry['id']}"
+        return item
+
+    def _find_by_id(self, item_id):
+        for key, entry in files.items():
+            if entry['id'] == item_id:
+                return key, entry
+        return None, None
+
+    def _store(self, folder_id, name, data):
+        entry = {'id': uuid.uuid4().hex, 'name': name, 'data': bytes(data),
+                 'modified': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')}
+        files[(folder_id, name)] = entry
+        return entry
+
+    def do_GET(self):
+        kind, args = self._route()
+        with lock:
+            if kind == 'folder':
+                folder_id = folders.setdefault(args, uuid.uuid4().hex)
+                return self._send(200, {'id': folder_id, 'name': args.strip('/'), 'folder': {}})
+            if kind == 'root_children':
+                return self._send(200, {'value': [{'name': p.strip('/')} for p in folders]})
+            if kind == 'children':
+                items = [drive_item(e) for (fid, _), e in files.items() if fid == args]
+                return self._send(200, {'value': items})
+            if kind == 'item_by_path':
+                stats['item_requests'] += 1
+                entry = files.get(args)
+                return self._send(200, self._item_with_link(entry)) if entry else self._send(404, {'error': 'itemNotFound'})
+            if kind == 'item_by_id':
+                stats['item_requests'] += 1
+                _, entry = self._find_by_id(args)
+                return self._send(200, self._item_with_link(entry)) if entry else self._send(404, {'error': 'itemNotFound'})
+            if kind == 'download':
+                _, entry = self._find_by_id(args)
+                if not entry:
+                    return self._send(404, {'error': 'itemNotFound'})
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(entry['data'])))
+                self.end_headers()
+                self.wfile.write(entry['data'])
+                return
+            if kind == 'session':
+                session = sessions.get(args)
+                if not session:
+                    return self._send(404, {'error': 'itemNotFound'})
+                return self._send(200, {'nextExpectedRanges': missing_ranges(session)})
+        self._send(404, {'error': 'unknown'})
+
+    def do_POST(self):
+        kind, args = self._route()
+        self._body()
+        if kind != 'create_session':
+            return self._send(404, {'error': 'unknown'})
+        session_id = uuid.uuid4().hex
+        host = self.headers.get('Host')
+        expires = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat().replace('+00:00', 'Z')
+        with lock:
+            sessions[session_id] = {'folder_id': args[0], 'name': args[1], 'size': None,
+                                    'received': None, 'ranges': set()}
+        self._send(200, {'uploadUrl': f"http://{host}/upload/{session_id}", 'expirationDateTime': expires})
+
+    def do_PUT(self):
+        kind, args = self._route()
+        if kind == 'content':
+            data = self._body()
+            with lock:
+                entry = self._store(args[0], args[1], data)
+            return self._send(201, drive_item(entry))
+        if kind != 'session':
+            self._body()
+            return self._send(404, {'error': 'unknown'})
+
+        # Content-Range: bytes start-end/total
+        unit_range, _, total = self.headers['Content-Range'].partition('/')
+        start, _, end = unit_range.split(' ')[1].partition('-')
+        start, end, total = int(start), int(end), int(total)
+
+        with lock:
+            stats['chunk_requests'] += 1
+            drop = options.drop_after and stats['bytes_received'] >= options.drop_after
+            if drop:
+                options.drop_after = 0
+            fail = options.fail_every and stats['chunk_requests'] % options.fail_every == 0
+        if drop:
+            # 模拟网络中断：读一半就断开
+            self.rfile.read((end - start + 1) // 2)
+            stats['failed_requests'] += 1
+            self.close_connection = True
+            self.connection.close()
+            return
+        data = self._body()
+        if fail:
+            stats['failed_requests'] += 1
+            return self._send(500, {'error': 'injected failure'})
+
+        with lock:
+            session = sessions.get(args)
+            if not session:
+                return self._send(404, {'error': 'itemNotFound'})
+            if session['received'] is None:
+                session['size'] = total
+                session['received'] = bytearray(total)
+            if len(data) != end - start + 1:
+                return self._send(400, {'error': 'length mismatch'})
+            session['received'][start:end + 1] = data
+            session['ranges'].add((start, end))
+            stats['bytes_received'] += len(data)
+            missing = missing_ranges(session)
+            if missing:
+                return self._send(202, {'nextExpectedRanges': missing})
+            del sessions[args]
+            entry = self._store(session['folder_id'], session['name'], session['received'])
+        self._send(201, drive_item(entry))
+
+    def do_DELETE(self):
+        kind, args = self._route()
+        with lock:
+            if kind == 'session':
+                sessions.pop(args, None)
+                return self._send(204)
+            if kind == 'item_by_path':
+                return self._send(204) if files.pop(args, None) else self._send(404, {'error': 'itemNotFound'})
+            if kind == 'item_by_id':
+                key, _ = self._find_by_id(args)
+                if key:
+                    del files[key]
+                    return self._send(204)
+                return self._send(404, {'error': 'itemNotFound'})
+        self._send(404, {'error': 'unknown'})
+
+
+def write_token():
+    with open(Config.TOKEN_PATH, 'w') as f:
+        json.dump({'access_token': 'fake-token', 'expires_at': time.time() + 365 * 24 * 3600}, f)
+    print(f"已写入假令牌: {Config.TOKEN_PATH}")
+
+
+def serve(port=8765, fail_every=0, drop_after=0):
+    """启动服务器（后台线程），返回 server 对象；测试脚本可直接调用"""
+    options.fail_every = fail_every
+    options.drop_after = drop_after
+    server = ThreadingHTTPServer(('127.0.0.1', port), GraphHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地 Graph API 替身服务器')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fail-every', type=int, default=0)
+    parser.add_argument('--drop-after', type=int, default=0)
+    parser.add_argument('--write-token', action='store_true')
+    args = parser.parse_args()
+    if args.write_token:
+        write_token()
+    serve(args.port, args.fail_every, args.drop_after)
+    print(f"Graph 替身服务器已启动: http://127.0.0.1:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,331 @@
+# upload_sessions.py
+
+import io
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from config import Config
+
+
+def _stream_length(stream):
+    """从当前位置到末尾的字节数（不移动读取位置）；流不支持定位时返回 None"""
+    try:
+        start = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        length = stream.tell() - start
+        stream.seek(start)
+        return length
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class UploadSession:
+    """
+    一次分块上传会话。
+    创建时按声明的总大小预分配目标文件，每个分块到达时直接写入对应偏移，
+    全部到齐后只需一次重命名即可得到完整文件（不再二次合并）。
+
+    已收到的分块记录在位图中（每块 1 bit），位图同时写入 _upload_<id>.bitmap，
+    每收到一块只改写其中一个字节，服务重启后可以据此继续上传。
+
+    内容哈希（SHA-256）随上传增量计算：哈希游标指向下一个待计算的块，
+    每收到一块就把从游标开始连续已到达的块读入哈希（乱序到达的块等前面的块到齐后再计算）。
+    """
+
+    def __init__(self, session_id, original_filename, total_size, chunk_size, total_chunks, created_at=None):
+        self.session_id = session_id
+        self.original_filename = original_filename
+        self.total_size = total_size
+        self.chunk_size = chunk_size
+        self.total_chunks = total_chunks
+        self.created_at = created_at or time.time()
+        self.updated_at = self.created_at
+        base_path = os.path.join(Config.UPLOAD_FOLDER, f"_upload_{session_id}")
+        self.part_path = base_path + '.part'
+        self.meta_path = base_path + '.json'
+        self.bitmap_path = base_path + '.bitmap'
+        self.bitmap = bytearray((total_chunks + 7) // 8)
+        self.received_count = 0
+        self.completed = False
+        self.lock = threading.Lock()
+        # 增量内容哈希（不持久化，重启后从头补算）
+        self.hasher = hashlib.sha256()
+        self.hash_cursor = 0
+        self.hash_lock = threading.Lock()
+
+    @property
+    def paths(self):
+        return (self.part_path, self.meta_path, self.bitmap_path)
+
+    def preallocate(self):
+        """创建目标文件并扩展到声明的总大小，同时写入会话元数据和空位图"""
+        with open(self.part_path, 'wb') as f:
+            f.truncate(self.total_size)
+        with open(self.bitmap_path, 'wb') as f:
+            f.write(self.bitmap)
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'session_id': self.session_id,
+                'original_filename': self.original_filename,
+                'total_size': self.total_size,
+                'chunk_size': self.chunk_size,
+                'total_chunks': self.total_chunks,
+                'created_at': self.created_at
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, meta_path):
+        """从 _upload_<id>.json 和位图文件恢复会话，文件不完整时返回 None"""
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        session = cls(meta['session_id'], meta['original_filename'], meta['total_size'],
+                      meta['chunk_size'], meta['total_chunks'], meta.get('created_at'))
+        if not os.path.isfile(session.part_path) or not os.path.isfile(session.bitmap_path):
+            return None
+        with open(session.bitmap_path, 'rb') as f:
+            bitmap = f.read()
+        if len(bitmap) != len(session.bitmap):
+            return None
+        session.bitmap[:] = bitmap
+        session.received_count = sum(bin(byte).count('1') for byte in bitmap)
+        session.updated_at = os.path.getmtime(session.bitmap_path)
+        return session
+
+    def has_chunk(self, chunk_index):
+        return bool(self.bitmap[chunk_index >> 3] & (1 << (chunk_index & 7)))
+
+    def expected_chunk_length(self, chunk_index):
+        start = chunk_index * self.chunk_size
+        return min(self.chunk_size, self.total_size - start)
+
+    def write_chunk(self, chunk_index, stream):
+        """
+        把分块写入预分配文件的对应偏移。
+        先检查长度再写入，大小不符的块不会覆盖已收到的数据；已收到的块（客户端重试，
+        或会话已经完成、文件正在 / 已经改名）直接返回成功，不再写入。
+        :return: (success: bool, message: str)
+        """
+        if not 0 <= chunk_index < self.total_chunks:
+            return False, f"chunk_index 超出范围: {chunk_index}"
+        if self.has_chunk(chunk_index):
+            return True, "duplicate"
+
+        expected = self.expected_chunk_length(chunk_index)
+        length = _stream_length(stream)
+        if length is None:
+            # 不可定位的流：最多读入 expected + 1 字节到内存再检查
+            buffer = bytearray()
+            while len(buffer) <= expected:
+                data = stream.read(min(1024 * 1024, expected + 1 - len(buffer)))
+                if not data:
+                    break
+                buffer += data
+            length, stream = len(buffer), io.BytesIO(bytes(buffer))
+        if length != expected:
+            return False, f"块 {chunk_index} 大小不符: 收到 {length} bytes，应为 {expected} bytes"
+
+        with open(self.part_path, 'r+b') as f:
+            f.seek(chunk_index * self.chunk_size)
+            written = 0
+            while True:
+                buf = stream.read(min(1024 * 1024, expected - written + 1))
+                if not buf:
+                    break
+                written += len(buf)
+                if written > expected:
+                    return False, f"块 {chunk_index} 大小超出预期 ({expected} bytes)"
+                f.write(buf)
+
+        if written != expected:
+            return False, f"块 {chunk_index} 大小不符: 收到 {written} bytes，应为 {expected} bytes"
+
+        self._mark_received(chunk_index)
+        self._advance_hash()
+        return True, "ok"
+
+    def _advance_hash(self):
+        """把从哈希游标开始、连续已到达的块读入哈希"""
+        with self.hash_lock:
+            if self.hash_cursor >= self.total_chunks or not self.has_chunk(self.hash_cursor):
+                return
+            with open(self.part_path, 'rb') as f:
+                f.seek(self.hash_cursor * self.chunk_size)
+                while self.hash_cursor < self.total_chunks and self.has_chunk(self.hash_cursor):
+                    self.hasher.update(f.read(self.expected_chunk_length(self.hash_cursor)))
+                    self.hash_cursor += 1
+
+    def content_hash(self):
+        """所有块到齐后返回内容哈希（十六进制），否则返回 None"""
+        self._advance_hash()
+        with self.hash_lock:
+            if self.hash_cursor < self.total_chunks:
+                return None
+            return self.hasher.hexdigest()
+
+    def _mark_received(self, chunk_index):
+        byte_index = chunk_index >> 3
+        mask = 1 << (chunk_index & 7)
+        with self.lock:
+            self.updated_at = time.time()
+            if self.bitmap[byte_index] & mask:
+                return  # 并发重试的同一块，两次写入的数据相同
+            self.bitmap[byte_index] |= mask
+            self.received_count += 1
+            # 只改写位图中对应的一个字节（数据块已先写入，重启后位图不会多报）
+            with open(self.bitmap_path, 'r+b') as f:
+                f.seek(byte_index)
+                f.write(bytes((self.bitmap[byte_index],)))
+
+    def missing_ranges(self):
+        """返回尚未收到的分块区间列表 [[start, end], ...]（闭区间）"""
+        ranges = []
+        start = None
+        with self.lock:
+            bitmap = bytes(self.bitmap)
+        for byte_index, byte in enumerate(bitmap):
+            if byte == 0xFF and start is None:
+                continue  # 整字节都已收到，快速跳过
+            for bit in range(8):
+                chunk_index = (byte_index << 3) + bit
+                if chunk_index >= self.total_chunks:
+                    break
+                if byte & (1 << bit):
+                    if start is not None:
+                        ranges.append([start, chunk_index - 1])
+                        start = None
+                elif start is None:
+                    start = chunk_index
+        if start is not None:
+            ranges.append([start, self.total_chunks - 1])
+        return ranges
+
+    def mark_completed(self):
+        """
+        所有分块都已到达时标记完成，只有第一个调用者返回 True。
+        并发上传的最后几个分块同时到达时，保证只入队一次。
+        """
+        with self.lock:
+            if self.completed or self.received_count < self.total_chunks:
+                return False
+            self.completed = True
+            return True
+
+    def finalize(self, final_path):
+        """把预分配文件重命名为最终文件（同一目录下为 O(1) 操作），并删除会话记录"""
+        os.replace(self.part_path, final_path)
+        self._remove_files((self.meta_path, self.bitmap_path))
+
+    def discard(self):
+        self._remove_files(self.paths)
+
+    def _remove_files(self, paths):
+        for path in paths:
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except Exception as e:
+                    print(f"[上传会话] 删除文件失败 {path}: {e}")
+
+    def to_dict(self):
+        return {
+            'session_id': self.session_id,
+            'filename': self.original_filename,
+            'total_size': self.total_size,
+            'chunk_size': self.chunk_size,
+            'total_chunks': self.total_chunks,
+            'received_chunks': self.received_count,
+            'missing': self.missing_ranges()
+        }
+
+
+class UploadSessionRegistry:
+    """上传会话表，会话记录保存在 UPLOAD_FOLDER 中，重启后可恢复"""
+
+    def __init__(self, finished_limit=1000):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        # 最近完成的会话 session_id -> task_id：完成后迟到 / 重试的分块按幂等成功处理
+        self.finished = OrderedDict()
+        self.finished_limit = finished_limit
+
+    def create(self, session_id, original_filename, total_size, chunk_size, total_chunks):
+        self.expire_stale()
+        session = UploadSession(session_id, original_filename, total_size, chunk_size, total_chunks)
+        try:
+            session.preallocate()
+        except Exception:
+            session.discard()
+            raise
+        with self.lock:
+            self.sessions[session_id] = session
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def remove(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None)
+
+    def mark_finished(self, session_id, task_id):
+        with self.lock:
+            self.finished[session_id] = task_id
+            while len(self.finished) > self.finished_limit:
+                self.finished.popitem(last=False)
+
+    def finished_task(self, session_id):
+        """已完成会话对应的 task_id，不是最近完成的会话时返回 None"""
+        with self.lock:
+            return self.finished.get(session_id)
+
+    def expire_stale(self):
+        """丢弃超过 UPLOAD_SESSION_TTL 没有新分块的会话"""
+        deadline = time.time() - Config.UPLOAD_SESSION_TTL
+        with self.lock:
+            stale = [s for s in self.sessions.values() if s.updated_at < deadline and not s.completed]
+            for session in stale:
+                del self.sessions[session.session_id]
+        for session in stale:
+            print(f"[上传会话] 会话已过期，删除: {session.session_id} ({session.original_filename})")
+            session.discard()
+
+    def restore(self):
+        """启动时从 UPLOAD_FOLDER 恢复未完成的上传会话"""
+        if not os.path.exists(Config.UPLOAD_FOLDER):
+            return
+        restored = 0
+        for item in os.listdir(Config.UPLOAD_FOLDER):
+            if not (item.startswith('_upload_') and item.endswith('.json')):
+                continue
+            meta_path = os.path.join(Config.UPLOAD_FOLDER, item)
+            try:
+                session = UploadSession.load(meta_path)
+            except Exception as e:
+                print(f"[上传会话] 读取会话失败 {item}: {e}")
+                session = None
+            if session is None:
+                continue
+            with self.lock:
+                self.sessions[session.session_id] = session
+            restored += 1
+        self.expire_stale()
+        print(f"[上传会话] 恢复了 {restored} 个未完成的上传会话")
+
+    def pending_bytes(self):
+        """已接受但尚未收到的字节数（资源准入检查时从剩余空间中扣除）"""
+        with self.lock:
+            return sum(max(0, s.total_size - s.received_count * s.chunk_size)
+                       for s in self.sessions.values() if not s.completed)
+
+    def owned_paths(self):
+        """当前会话占用的所有文件（清理孤立文件时需要保留）"""
+        with self.lock:
+            return {os.path.abspath(path) for session in self.sessions.values() for path in session.paths}
+
+
+# 全局实例
+upload_sessions = UploadSessionRegistry()
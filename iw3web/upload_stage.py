@@ -0,0 +1,210 @@
+# upload_stage.py
+
+import os
+import json
+import time
+import random
+import threading
+from config import Config
+from onedrive_client import one_drive_client
+from storage_index import storage_index
+from status_events import status_events
+from metrics import onedrive_retries
+
+
+class UploadJob:
+    def __init__(self, seq, local_path, filename, attempts=0, next_attempt_at=0, last_error=None, enqueued_at=None):
+        self.seq = seq
+        self.local_path = local_path
+        self.filename = filename
+        self.attempts = attempts
+        self.next_attempt_at = next_attempt_at
+        self.last_error = last_error
+        self.enqueued_at = enqueued_at or time.time()
+        self.uploading = False
+
+    def to_record(self):
+        return {
+            'seq': self.seq,
+            'local_path': self.local_path,
+            'filename': self.filename,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at,
+            'last_error': self.last_error,
+            'enqueued_at': self.enqueued_at
+        }
+
+    def to_dict(self, now):
+        if self.uploading:
+            state = '正在上传'
+        elif self.next_attempt_at > now:
+            state = '等待重试'
+        else:
+            state = '排队中'
+        return {
+            'filename': self.filename,
+            'state': state,
+            'attempts': self.attempts,
+            'retry_in': max(0, round(self.next_attempt_at - now)) if not self.uploading else 0,
+            'last_error': self.last_error
+        }
+
+
+class UploadStage:
+    """
+    转换后的 OneDrive 上传阶段，与转换工作线程解耦：
+    - convert_file 转换完成后只把输出文件交给 submit()，立即返回处理下一个任务
+    - 固定数量的上传线程按入队顺序上传；失败的任务按指数退避重试，不阻塞其他任务
+    - 待上传列表持久化到 upload_stage.json，重启后继续上传
+    """
+
+    def __init__(self, state_path, workers):
+        self.state_path = state_path
+        self.workers = workers
+        self.cond = threading.Condition()
+        self.jobs = {}  # filename -> UploadJob
+        self.seq = 0
+        self.threads = []
+        self.uploaded_callbacks = []  # 上传成功后调用 callback(filename)
+
+    # === 持久化 ===
+
+    def _save(self):
+        records = [job.to_record() for job in sorted(self.jobs.values(), key=lambda j: j.seq)]
+        tmp_path = self.state_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(records, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_path)
+        except Exception as e:
+            print(f"[上传队列] 保存失败: {e}")
+
+    def restore(self):
+        """启动时恢复未完成的上传任务（本地文件已不存在的任务直接丢弃）"""
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except Exception as e:
+            print(f"[上传队列] 读取失败: {e}")
+            return
+        with self.cond:
+            for record in records:
+                if not os.path.isfile(record['local_path']):
+                    print(f"[上传队列] 本地文件已不存在，跳过: {record['local_path']}")
+                    continue
+                record['next_attempt_at'] = 0  # 重启后立即重试
+                job = UploadJob(**record)
+                self.jobs[job.filename] = job
+                self.seq = max(self.seq, job.seq)
+            self._save()
+            self.cond.notify_all()
+        print(f"[上传队列] 恢复了 {len(self.jobs)} 个待上传文件")
+        self._publish()
+
+    # === 提交 / 查询 ===
+
+    def submit(self, local_path, filename):
+        with self.cond:
+            if filename in self.jobs:
+                return
+            self.seq += 1
+            self.jobs[filename] = UploadJob(self.seq, local_path, filename)
+            self._save()
+            self.cond.notify()
+        print(f"[上传队列] 已加入上传队列: {filename}")
+        self._publish()
+
+    def contains(self, filename):
+        with self.cond:
+            return filename in self.jobs
+
+    def snapshot(self):
+        now = time.time()
+        with self.cond:
+            jobs = sorted(self.jobs.values(), key=lambda j: j.seq)
+            return {
+                'workers': self.workers,
+                'backlog': len(jobs),
+                'jobs': [job.to_dict(now) for job in jobs]
+            }
+
+    def _publish(self):
+        status_events.publish({'type': 'upload_stage', **self.snapshot()})
+
+    # === 上传线程 ===
+
+    def start(self):
+        if self.threads:
+            return
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _next_job(self):
+        """取出入队最早且已到重试时间的任务；没有时等待"""
+        with self.cond:
+            while True:
+                now = time.time()
+                waiting = [job for job in self.jobs.values() if not job.uploading]
+                ready = [job for job in waiting if job.next_attempt_at <= now]
+                if ready:
+                    job = min(ready, key=lambda j: j.seq)
+                    job.uploading = True
+                    return job
+                timeout = min((job.next_attempt_at for job in waiting), default=now + 60) - now
+                self.cond.wait(timeout=max(0.1, timeout))
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            self._publish()
+            try:
+                success, message = one_drive_client.upload_file(job.local_path, job.filename)
+            except Exception as e:
+                success, message = False, f"上传异常: {e}"
+
+            if success:
+                self._finish(job)
+            else:
+                self._retry_later(job, message)
+            self._publish()
+
+    def _finish(self, job):
+        print(f"[上传成功] {job.filename}")
+        try:
+            storage_index.add(job.filename, os.path.getsize(job.local_path), time.time())
+        except OSError as e:
+            print(f"[存储索引] 读取文件大小失败 {job.local_path}: {e}")
+        if os.path.isfile(job.local_path):
+            try:
+                os.remove(job.local_path)
+                print(f"[删除本地转换文件] {job.local_path}")
+            except Exception as e:
+                print(f"[警告] 删除本地转换文件失败 {job.local_path}: {e}")
+        with self.cond:
+            self.jobs.pop(job.filename, None)
+            self._save()
+        for callback in self.uploaded_callbacks:
+            try:
+                callback(job.filename)
+            except Exception as e:
+                print(f"[上传队列] 上传完成回调失败: {e}")
+
+    def _retry_later(self, job, message):
+        with self.cond:
+            job.uploading = False
+            job.attempts += 1
+            onedrive_retries.labels('upload').inc()
+            wait_time = min(2 * (2 ** (job.attempts - 1)) + random.uniform(0, 1), Config.ONEDRIVE_UPLOAD_MAX_BACKOFF)
+            job.next_attempt_at = time.time() + wait_time
+            job.last_error = message
+            self._save()
+            self.cond.notify_all()
+        print(f"[上传失败] 第{job.attempts}次尝试失败: {job.filename}，{wait_time:.0f} 秒后重试")
+
+
+# 全局实例（路径相对于工作目录，与 conversion_state.json 一致；上传线程由 main 启动）
+upload_stage = UploadStage('upload_stage.json', Config.ONEDRIVE_UPLOAD_WORKERS)
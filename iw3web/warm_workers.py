@@ -0,0 +1,222 @@
+# warm_workers.py
+
+import json
+import time
+import uuid
+import queue
+import threading
+import subprocess
+import psutil
+from config import Config
+from log_sink import log_context
+from process_control import process_control
+from metrics import warm_worker_restarts
+
+
+class WarmWorkerError(Exception):
+    pass
+
+
+class WarmWorker:
+    """
+    一个常驻 iw3 进程（iw3_worker.py，协议见该文件），每个转换槽位一个。
+    - 第一次使用时启动，等待 ready；之后的任务直接发送，不再重复启动解释器和加载模型
+    - 空闲超过 IW3_WORKER_PING_INTERVAL 秒后，下一个任务前先 ping，没有响应则重启
+    - 进程在任务中途退出（崩溃或被终止）时任务失败，下一个任务重新启动进程
+    - 每处理 IW3_WORKER_MAX_JOBS 个任务重启一次，释放长时间运行累积的显存 / 内存
+    """
+
+    def __init__(self, slot_id):
+        self.slot_id = slot_id
+        self.process = None
+        self.messages = None
+        self.jobs = 0
+        self.last_active = 0
+        self.line_handler = None  # 当前任务的输出处理函数（标准错误中的 iw3 / tqdm 输出）
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    # === 启动 / 停止 ===
+
+    def start(self):
+        started = time.monotonic()
+        self.process = subprocess.Popen(
+            list(Config.IW3_WORKER_COMMAND),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,     # 协议
+            stderr=subprocess.PIPE,     # iw3 输出
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            bufsize=1,
+            cwd=Config.IW3_WORKER_CWD,
+            **process_control.popen_kwargs()
+        )
+        self.messages = queue.Queue()
+        threading.Thread(target=self._read_protocol, args=(self.process, self.messages), daemon=True).start()
+        threading.Thread(target=self._read_output, args=(self.process,), daemon=True).start()
+
+        if self._wait('ready', Config.IW3_WORKER_STARTUP_TIMEOUT) is None:
+            self.stop()
+            raise WarmWorkerError(f"常驻 iw3 进程启动失败或超时（{Config.IW3_WORKER_STARTUP_TIMEOUT} 秒）")
+        self.jobs = 0
+        self.last_active = time.monotonic()
+        print(f"[常驻进程] 槽位 {self.slot_id} 已启动，PID: {self.process.pid}，耗时 {time.monotonic() - started:.1f} 秒")
+
+    def stop(self):
+        """请求进程退出，5 秒内没有退出则结束整个进程树"""
+        process, self.process = self.process, None
+        if process is None:
+            return
+        if process.poll() is None:
+            try:
+                process.stdin.write(json.dumps({'type': 'exit'}) + '\n')
+                process.stdin.flush()
+                process.wait(timeout=5)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                try:
+                    parent = psutil.Process(process.pid)
+                    for proc in [parent] + parent.children(recursive=True):
+                        proc.kill()
+                except psutil.NoSuchProcess:
+                    pass
+                process.wait()
+        for pipe in (process.stdin, process.stdout, process.stderr):
+            try:
+                pipe.close()
+            except (OSError, ValueError):
+                pass
+
+    def restart(self, reason):
+        print(f"[常驻进程] 槽位 {self.slot_id} 重启（{reason}）")
+        warm_worker_restarts.labels(reason).inc()
+        self.stop()
+        self.start()
+
+    # === 读取进程输出 ===
+
+    @staticmethod
+    def _read_protocol(process, messages):
+        try:
+            for line in process.stdout:
+                try:
+                    messages.put(json.loads(line))
+                except ValueError:
+                    print(f"[常驻进程] 无法解析的响应: {line.strip()}")
+        except (OSError, ValueError):
+            pass
+        finally:
+            messages.put(None)  # 进程已退出
+
+    def _read_output(self, process):
+        try:
+            for line in process.stderr:
+                line = line.rstrip('\n')
+                handler = self.line_handler
+                if handler is not None:
+                    handler(line)
+                elif line.strip():
+                    with log_context(source='iw3'):
+                        print(line.strip())
+        except (OSError, ValueError):
+            pass
+
+    def _wait(self, kind, timeout=None, job_id=None):
+        """等待指定类型的响应；超时或进程退出时返回 None"""
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            try:
+                message = self.messages.get(timeout=max(0, deadline - time.monotonic()) if deadline else None)
+            except queue.Empty:
+                return None
+            if message is None:
+                return None
+            if message.get('type') == kind and (job_id is None or message.get('id') == job_id):
+                return message
+
+    def _send(self, message):
+        self.process.stdin.write(json.dumps(message, ensure_ascii=False) + '\n')
+        self.process.stdin.flush()
+
+    # === 健康检查 / 执行任务 ===
+
+    def healthy(self):
+        if not self.alive():
+            return False
+        if time.monotonic() - self.last_active < Config.IW3_WORKER_PING_INTERVAL:
+            return True
+        try:
+            self._send({'type': 'ping'})
+        except (OSError, ValueError):
+            return False
+        return self._wait('pong', Config.IW3_WORKER_PING_TIMEOUT) is not None
+
+    def run(self, args, on_line, on_start=None):
+        """
+        发送一个转换任务并等待完成，返回 (退出码, 错误信息)。
+        :param on_line: 处理任务期间 iw3 输出的每一行
+        :param on_start: 任务开始时以进程 PID 调用（登记到槽位，供暂停 / 终止使用）
+        """
+        if self.process is None:
+            self.start()
+        elif not self.alive():
+            self.restart('crash')
+        elif not self.healthy():
+            self.restart('health')
+
+        job_id = uuid.uuid4().hex[:12]
+        self.line_handler = on_line
+        try:
+            if on_start is not None:
+                on_start(self.process.pid)
+            self._send({'type': 'job', 'id': job_id, 'args': list(args)})
+            message = self._wait('done', job_id=job_id)
+        except (OSError, ValueError):
+            message = None
+        finally:
+            self.line_handler = None
+            self.last_active = time.monotonic()
+
+        if message is None:
+            # 任务中途退出（崩溃或被终止），下一个任务重新启动
+            returncode = self.process.wait() if self.process else None
+            warm_worker_restarts.labels('exited').inc()
+            self.stop()
+            return returncode or -1, f"常驻 iw3 进程在任务中途退出（退出码 {returncode}）"
+
+        self.jobs += 1
+        if Config.IW3_WORKER_MAX_JOBS and self.jobs >= Config.IW3_WORKER_MAX_JOBS:
+            print(f"[常驻进程] 槽位 {self.slot_id} 已处理 {self.jobs} 个任务，下次使用时重启")
+            warm_worker_restarts.labels('max_jobs').inc()
+            self.stop()
+        return message['returncode'], message.get('message')
+
+
+class WarmWorkerPool:
+    """每个转换槽位一个常驻进程（同一槽位同一时间只有一个任务，不需要额外加锁）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.workers = {}
+
+    def get(self, slot_id):
+        with self.lock:
+            worker = self.workers.get(slot_id)
+            if worker is None:
+                worker = self.workers[slot_id] = WarmWorker(slot_id)
+            return worker
+
+    def stop_all(self):
+        with self.lock:
+            workers = list(self.workers.values())
+        for worker in workers:
+            worker.stop()
+
+
+# 全局实例
+warm_workers = WarmWorkerPool()